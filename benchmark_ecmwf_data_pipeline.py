@@ -0,0 +1,410 @@
+import os
+import re
+import argparse
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import defaultdict
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+import eccodes
+import logging
+# Configure basic logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# import custom script
+from ecmwf_data_processing_scripts import *
+# *************************************************************************************************
+
+# ****************** Synthetic GRIB2 files
+# the fields the pipeline reads, as (typeOfLevel, level, shortName); tp is accumulated from step 0
+SYNTHETIC_GRIB_FIELDS = [("surface", 0, "tp"), ("surface", 0, "tprate"), ("heightAboveGround", 2, "2t")]
+TYPE_OF_LEVEL_SURFACE_CODES = {"surface": 1, "heightAboveGround": 103}
+
+
+def get_synthetic_field_values(short_name="", lats=None, step_hour=0, rng=None):
+    # roughly realistic fields, so the packing and compression behave as on real data
+    match short_name:
+        case "2t":
+            # warm tropics, cold poles, a diurnal swing and some noise, in kelvin
+            values = (300 - 45 * np.abs(np.sin(np.radians(lats))) + 5 * np.sin(2 * np.pi * step_hour / 24)
+                      + rng.normal(0, 1.5, lats.size))
+        case "tp":
+            # mostly dry, with gamma distributed rain accumulating with the step, in m
+            values = np.where(rng.random(lats.size) < 0.3, rng.gamma(0.5, 0.002, lats.size), 0) * step_hour / 6
+        case _:
+            values = np.where(rng.random(lats.size) < 0.3, rng.gamma(0.5, 0.0002, lats.size), 0)
+    return values
+
+
+def make_synthetic_grib_file(file_path="", step_hour=6, run_date=20250922, resolution=0.25):
+    """Writes a global regular lat/lon GRIB2 step file with the fields of SYNTHETIC_GRIB_FIELDS."""
+    n_lat = int(round(180 / resolution)) + 1
+    n_lon = int(round(360 / resolution))
+    # north to south, each latitude repeated along the row, as the grid is scanned
+    lats = np.repeat(np.linspace(90, -90, n_lat), n_lon)
+    rng = np.random.default_rng(step_hour)
+    with open(file_path, 'wb') as f:
+        for type_of_level, level, short_name in SYNTHETIC_GRIB_FIELDS:
+            gid = eccodes.codes_grib_new_from_samples("GRIB2")
+            try:
+                eccodes.codes_set(gid, "gridType", "regular_ll")
+                for key, value in {"Ni": n_lon, "Nj": n_lat,
+                                   "latitudeOfFirstGridPointInDegrees": 90.0,
+                                   "longitudeOfFirstGridPointInDegrees": -180.0,
+                                   "latitudeOfLastGridPointInDegrees": -90.0,
+                                   "longitudeOfLastGridPointInDegrees": 180.0 - resolution,
+                                   "iDirectionIncrementInDegrees": resolution,
+                                   "jDirectionIncrementInDegrees": resolution}.items():
+                    eccodes.codes_set(gid, key, value)
+                eccodes.codes_set(gid, "centre", "ecmf")
+                eccodes.codes_set(gid, "dataDate", run_date)
+                eccodes.codes_set(gid, "dataTime", 0)
+                if short_name == "tp":
+                    eccodes.codes_set(gid, "productDefinitionTemplateNumber", 8)
+                    eccodes.codes_set(gid, "stepType", "accum")
+                eccodes.codes_set(gid, "typeOfFirstFixedSurface", TYPE_OF_LEVEL_SURFACE_CODES[type_of_level])
+                eccodes.codes_set(gid, "shortName", short_name)
+                eccodes.codes_set(gid, "typeOfLevel", type_of_level)
+                eccodes.codes_set(gid, "level", level)
+                if short_name == "tp":
+                    eccodes.codes_set(gid, "startStep", 0)
+                    eccodes.codes_set(gid, "endStep", step_hour)
+                else:
+                    eccodes.codes_set(gid, "step", step_hour)
+                eccodes.codes_set(gid, "bitsPerValue", 16)
+                eccodes.codes_set_values(gid, get_synthetic_field_values(short_name=short_name, lats=lats,
+                                                                         step_hour=step_hour, rng=rng))
+                eccodes.codes_write(gid, f)
+            finally:
+                eccodes.codes_release(gid)
+
+
+def generate_synthetic_grib_files(grib_dir="", number_of_steps=8, step_size=6, resolution=0.25, run_date=20250922):
+    # named as the downloaded step files, so the rest of the benchmark treats them alike
+    os.makedirs(grib_dir, exist_ok=True)
+    start_t = time.perf_counter()
+    for step_hour in range(step_size, step_size * number_of_steps + 1, step_size):
+        make_synthetic_grib_file(file_path=f"{grib_dir}/ecmwf_data_{run_date}000000_{step_hour}h_oper_fc.grib2",
+                                 step_hour=step_hour, run_date=run_date, resolution=resolution)
+    print(f"Generated {number_of_steps} synthetic {resolution}° grib2 step files in {grib_dir} "
+          f"in {time.perf_counter() - start_t:.2f}s")
+
+
+def get_step_files_in_dir(grib_dir=""):
+    # e.g. ecmwf_data_20250922000000_12h_oper_fc.grib2 -> {12: <path>}, in step order
+    step_files = {}
+    for file_path in Path(grib_dir).glob("*.grib2"):
+        matched = re.search(r'_(\d+)h_', file_path.name)
+        if matched:
+            step_files[int(matched.group(1))] = str(file_path)
+    return dict(sorted(step_files.items()))
+
+
+def benchmark_decode_workers(grib_dir="", filter_levels=[], level=2, yaml_file="", decode_workers_list=[1]):
+    """
+    Times the decode of all the grib2 files in grib_dir, for each number of decode workers.
+
+    The step frames of every run are compared with the single worker run, to check the
+    output does not depend on the order the workers complete in.
+    """
+    results = []
+    reference_frames = None
+    step_files = get_step_files_in_dir(grib_dir=grib_dir)
+    print(f"Decode benchmark on {len(step_files)} files in {grib_dir}, cpu count: {os.cpu_count()}")
+
+    for decode_workers in decode_workers_list:
+        decode_executor = get_decode_executor(decode_workers=decode_workers)
+        try:
+            if decode_executor is not None:
+                # warm up the worker processes, so the spawn/import cost is not timed
+                list(decode_executor.map(abs, range(decode_workers)))
+            start_t = time.perf_counter()
+            step_frames = load_grib2_to_step_frames(step_files=step_files, filter_levels=filter_levels,
+                                                    level=level, yaml_file=yaml_file,
+                                                    decode_executor=decode_executor)
+            wall_s = time.perf_counter() - start_t
+        finally:
+            if decode_executor is not None:
+                decode_executor.shutdown(wait=True)
+
+        if reference_frames is None:
+            reference_frames = step_frames
+        identical = (list(step_frames.keys()) == list(reference_frames.keys()) and
+                     all(step_frames[k].equals(reference_frames[k]) for k in step_frames))
+        results.append({
+            "decode_workers": decode_workers,
+            "files": len(step_files),
+            "wall_s": round(wall_s, 3),
+            "speedup": round(results[0]["wall_s"] / wall_s, 2) if results else 1.0,
+            "identical_output": identical,
+        })
+        print(f"decode_workers={decode_workers}: {wall_s:.2f}s, speedup x{results[-1]['speedup']}, identical output: {identical}")
+    return results
+
+
+def benchmark_output_formats(grib_dir="", filter_levels=[], level=2, yaml_file="", output_formats=["csv"]):
+    """
+    Compares the size, write and read times of the published output per format.
+
+    The step files in grib_dir are decoded and combined per day once, then every day is
+    serialized per format as publish_chunk would. Reads are timed for the whole data and for
+    a selective read of 3 columns of one param.
+    """
+    results = []
+    step_files = get_step_files_in_dir(grib_dir=grib_dir)
+    step_frames = load_grib2_to_step_frames(step_files=step_files, filter_levels=filter_levels,
+                                            level=level, yaml_file=yaml_file)
+    step_hours = list(step_frames.keys())
+    day_dfs = []
+    for i in range(0, len(step_hours), 4):
+        day_frames = {step_hour: step_frames[step_hour] for step_hour in step_hours[i:i + 4]}
+        day_dfs.append(combine_step_frames_for_one_day(step_frames=day_frames, hour_array=step_hours[i:i + 4]))
+    selected_columns = ["longitude", "latitude", f"{step_hours[0]}h"]
+    print(f"Output format benchmark on {len(day_dfs)} days, {sum(len(df) for df in day_dfs)} rows")
+
+    output_root = tempfile.mkdtemp(prefix="output_formats_")
+    try:
+        for output_format in output_formats:
+            output_dir = f"{output_root}/{output_format}"
+            start_t = time.perf_counter()
+            total_bytes = 0
+            for cnt, day_df in enumerate(day_dfs):
+                output_files = serialize_day_dataframe(df=day_df, output_format=output_format,
+                                                       file_stem=f"ecmwf_data_fc_{cnt+1}")
+                for save_file, get_chunks in output_files:
+                    os.makedirs(os.path.dirname(f"{output_dir}/{save_file}"), exist_ok=True)
+                    with open(f"{output_dir}/{save_file}", 'wb') as f:
+                        for body in get_chunks():
+                            f.write(body)
+                            total_bytes += len(body)
+            write_s = time.perf_counter() - start_t
+
+            start_t = time.perf_counter()
+            read_rows = len(load_ecmwf_output(object_prefix=output_dir, output_format=output_format))
+            read_s = time.perf_counter() - start_t
+
+            start_t = time.perf_counter()
+            selected_rows = len(load_ecmwf_output(object_prefix=output_dir, output_format=output_format,
+                                                  columns=selected_columns, params=["temperature_celcius"]))
+            selective_read_s = time.perf_counter() - start_t
+
+            results.append({
+                "output_format": output_format,
+                "bytes": total_bytes,
+                "size_vs_csv": round(total_bytes / results[0]["bytes"], 3) if results else 1.0,
+                "write_s": round(write_s, 3),
+                "read_s": round(read_s, 3),
+                "selective_read_s": round(selective_read_s, 3),
+                "rows": read_rows,
+                "selected_rows": selected_rows,
+            })
+            print(f"{output_format}: {total_bytes / (1024 * 1024):.2f} MB, write {write_s:.2f}s, "
+                  f"read {read_s:.2f}s, selective read {selective_read_s:.2f}s")
+    finally:
+        shutil.rmtree(output_root, ignore_errors=True)
+    return results
+
+
+def merge_level_datasets(level_datasets={}, yaml_file="", k2cvalue=273.15):
+    # the merge half of load_combine_filter_ecmwf_grib_data, on already decoded datasets
+    cols_dict = get_level_combine_cols(yaml_file=yaml_file, filter_levels=list(level_datasets.keys()))
+    df = combine_level_datasets_on_grid(level_datasets=level_datasets, cols_dict=cols_dict)
+    df['t2m_cel'] = df['t2m'].astype('float64') - k2cvalue
+    return df
+
+
+def benchmark_pipeline_stages(grib_dir="", filter_levels=[], level=2, yaml_file="", output_formats=["csv"]):
+    """
+    Times each stage of the pipeline on its own, over all the grib2 files in grib_dir.
+
+    Stages: the per level load_grib2_to_dataframe (the earlier decode), the single pass
+    decode to cropped datasets, the merge of the levels into one frame, the combine per day
+    from the step frames and from step csv files (combine_csvs_for_one_day), then for each
+    output format the serialization and the upload to an in process S3 (moto), first upload
+    and unchanged re-run. cfgrib reads the values lazily, so the merge includes reading the
+    cropped values; the .idx files are built in an untimed warm up pass.
+    """
+    timings = defaultdict(lambda: {"calls": 0, "total_s": 0.0, "rows": 0, "bytes": 0})
+
+    def timed(stage, fn, rows=lambda result: 0, nbytes=lambda result: 0):
+        start_t = time.perf_counter()
+        result = fn()
+        timings[stage]["total_s"] += time.perf_counter() - start_t
+        timings[stage]["calls"] += 1
+        timings[stage]["rows"] += rows(result)
+        timings[stage]["bytes"] += nbytes(result)
+        return result
+
+    step_files = get_step_files_in_dir(grib_dir=grib_dir)
+    print(f"Stage benchmark on {len(step_files)} files in {grib_dir}")
+    min_max_coords = get_region_box(yaml_file=yaml_file)
+    for file_path in step_files.values():
+        cfgrib.open_datasets(file_path)
+
+    work_dir = tempfile.mkdtemp(prefix="pipeline_stages_")
+    try:
+        step_frames = {}
+        for step_hour, file_path in step_files.items():
+            for filter_level in filter_levels:
+                timed("load_grib2_to_dataframe",
+                      lambda: load_grib2_to_dataframe(file_path, filter_level=filter_level, level=level,
+                                                      min_max_coords=min_max_coords),
+                      rows=lambda df: len(df) if df is not None else 0)
+            level_datasets = timed("decode", lambda: load_grib2_levels_to_datasets(
+                file_path, filter_levels=filter_levels, level=level, min_max_coords=min_max_coords))
+            step_frames[step_hour] = timed("merge", lambda: merge_level_datasets(level_datasets=level_datasets,
+                                                                                 yaml_file=yaml_file),
+                                           rows=len)
+            step_frames[step_hour].to_csv(f"{work_dir}/{Path(file_path).stem}.csv", index=None)
+
+        step_hours = list(step_frames.keys())
+        day_dfs = []
+        for i in range(0, len(step_hours), 4):
+            hour_array = step_hours[i:i + 4]
+            day_frames = {step_hour: step_frames[step_hour] for step_hour in hour_array}
+            day_dfs.append(timed("combine_step_frames_for_one_day",
+                                 lambda: combine_step_frames_for_one_day(step_frames=day_frames, hour_array=hour_array,
+                                                                         stream_to_use="oper"), rows=len))
+            # the step csv files of the day on their own, as the earlier csv based combine reads them all
+            day_csv_dir = f"{work_dir}/day_{i // 4 + 1}"
+            os.makedirs(f"{day_csv_dir}/temp", exist_ok=True)
+            for step_hour in hour_array:
+                shutil.move(f"{work_dir}/{Path(step_files[step_hour]).stem}.csv", f"{day_csv_dir}/temp/")
+            timed("combine_csvs_for_one_day",
+                  lambda: combine_csvs_for_one_day(prepped_path=day_csv_dir, prepped_suffix="temp",
+                                                   hour_array=hour_array, stream_to_use="oper"), rows=len)
+
+        for output_format in output_formats:
+            day_outputs = []
+            for cnt, day_df in enumerate(day_dfs):
+                # csv is serialized as its chunks are read, so the bodies are materialised within the timing
+                day_outputs += timed(f"serialize_{output_format}",
+                                     lambda: [(save_file, b"".join(get_chunks())) for save_file, get_chunks in
+                                              serialize_day_dataframe(df=day_df, output_format=output_format,
+                                                                      file_stem=f"ecmwf_data_fc_{cnt+1}")],
+                                     nbytes=lambda outputs: sum(len(body) for _, body in outputs))
+            benchmark_upload_to_local_s3(timed=timed, output_format=output_format, day_outputs=day_outputs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = []
+    for stage, timing in timings.items():
+        results.append({"stage": stage, "calls": timing["calls"], "total_s": round(timing["total_s"], 3),
+                        "per_call_ms": round(1000 * timing["total_s"] / max(timing["calls"], 1), 1),
+                        "rows": timing["rows"], "bytes": timing["bytes"]})
+        print(f"{stage}: {timing['total_s']:.2f}s over {timing['calls']} calls")
+    return results
+
+
+def benchmark_upload_to_local_s3(timed=None, output_format="csv", day_outputs=[]):
+    # an in process S3 stand-in, no network and no credentials needed
+    try:
+        from moto import mock_aws
+    except ImportError:
+        logging.warning("moto is not installed, the upload stages are skipped (pip install moto)")
+        return
+    with mock_aws():
+        s3c = boto3.client("s3", region_name="us-east-1", aws_access_key_id="benchmark",
+                           aws_secret_access_key="benchmark", config=S3_CLIENT_CONFIG)
+        s3c.create_bucket(Bucket="benchmark-bucket")
+        known_md5s = {}
+        for stage in [f"upload_{output_format}", f"upload_unchanged_{output_format}"]:
+            manifest_objects = {}
+            for save_file, body in day_outputs:
+                upload_result = timed(stage, lambda: upload_bytes_if_changed(
+                    body=body, bucket="benchmark-bucket", key=f"benchmark/{save_file}", s3_client=s3c,
+                    known_md5s=known_md5s, content_type=OUTPUT_FORMAT_CONTENT_TYPES[output_format]),
+                    nbytes=lambda result: result["size"] if result["uploaded"] else 0)
+                if not upload_result["status"]:
+                    raise ValueError(f"Upload of {save_file} to the local s3 failed")
+                manifest_objects[upload_result["key"]] = {"md5": upload_result["md5"], "size": upload_result["size"]}
+            # as the pipeline does, so the re-run knows the md5 of the multipart uploads too
+            save_s3_manifest(objects=manifest_objects, bucket="benchmark-bucket", object_prefix="benchmark/",
+                             s3_client=s3c)
+            known_md5s = get_known_content_md5s(bucket="benchmark-bucket", object_prefix="benchmark/", s3_client=s3c)
+
+
+def get_git_commit():
+    # the commit benchmarked, to line up the results across commits
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarking the ECMWF data pipeline stages...')
+    parser.add_argument('--grib_dir', type=str, default='download',
+                        help='folder with the step grib2 files to benchmark on')
+    parser.add_argument('--filter_levels', type=str, default="surface, heightAboveGround",
+                        help='a comma separated filter-level strings e.g. "surface, heightAboveGround"')
+    parser.add_argument('--level', type=str, default='2',
+                        help='level value for extraction if applicable, to specific filter_level')
+    parser.add_argument('--yaml_file', type=str, default='gribcfg.yaml',
+                        help='settings required for download')
+    parser.add_argument('--decode_workers_list', type=str, default='1, 2, 4',
+                        help='a comma separated list of decode worker counts to compare e.g. "1, 2, 4, 8"')
+    parser.add_argument('--output_formats', type=str, default='csv, parquet, arrow',
+                        help='a comma separated list of output formats to compare, the first is the reference e.g. "csv, parquet"')
+    parser.add_argument('--output_file', type=str, default='',
+                        help='optional json file to write the results to')
+    parser.add_argument('--benchmarks', type=str, default='stages, decode_workers, output_formats',
+                        help='a comma separated list of the benchmarks to run: stages, decode_workers, output_formats')
+    parser.add_argument('--synthetic_steps', type=str, default='0',
+                        help='number of synthetic global grib2 step files to generate and benchmark on instead of grib_dir (0 = use grib_dir)')
+    parser.add_argument('--synthetic_resolution', type=str, default='0.25',
+                        help='grid resolution in degrees of the synthetic grib2 files')
+
+    parse_args = parser.parse_args()
+    logging.info(f'\nRun args for benchmarking the ECMWF data pipeline --> {parse_args}')
+
+    filter_levels = [item.strip() for item in parse_args.filter_levels.split(",") if item.strip()]
+    decode_workers_list = [int(item) for item in parse_args.decode_workers_list.split(",") if item.strip()]
+    output_formats = [item.strip() for item in parse_args.output_formats.split(",") if item.strip()]
+    benchmarks = [item.strip() for item in parse_args.benchmarks.split(",") if item.strip()]
+    synthetic_steps = int(parse_args.synthetic_steps)
+    synthetic_resolution = float(parse_args.synthetic_resolution)
+
+    grib_dir = parse_args.grib_dir
+    synthetic_dir = ""
+    if synthetic_steps > 0:
+        synthetic_dir = tempfile.mkdtemp(prefix="synthetic_grib_")
+        generate_synthetic_grib_files(grib_dir=synthetic_dir, number_of_steps=synthetic_steps,
+                                      resolution=synthetic_resolution)
+        grib_dir = synthetic_dir
+
+    report = {
+        "run_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "git_commit": get_git_commit(),
+        "cpu_count": os.cpu_count(),
+        "grib_dir": "synthetic" if synthetic_dir else grib_dir,
+        "synthetic_steps": synthetic_steps,
+        "synthetic_resolution": synthetic_resolution if synthetic_dir else None,
+    }
+    try:
+        if "stages" in benchmarks:
+            report["stages"] = benchmark_pipeline_stages(grib_dir=grib_dir, filter_levels=filter_levels,
+                                                         level=int(parse_args.level), yaml_file=parse_args.yaml_file,
+                                                         output_formats=output_formats)
+        if "decode_workers" in benchmarks:
+            report["decode_workers"] = benchmark_decode_workers(grib_dir=grib_dir, filter_levels=filter_levels,
+                                                                level=int(parse_args.level),
+                                                                yaml_file=parse_args.yaml_file,
+                                                                decode_workers_list=decode_workers_list)
+        if "output_formats" in benchmarks:
+            report["output_formats"] = benchmark_output_formats(grib_dir=grib_dir, filter_levels=filter_levels,
+                                                                level=int(parse_args.level),
+                                                                yaml_file=parse_args.yaml_file,
+                                                                output_formats=output_formats)
+    finally:
+        if synthetic_dir:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+    if parse_args.output_file:
+        with open(parse_args.output_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark results saved to: {parse_args.output_file}")
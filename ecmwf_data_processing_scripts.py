@@ -1,114 +1,270 @@
 import os
 from pathlib import Path
-from ecmwf.opendata import Client
-import re
 import numpy as np
 import pandas as pd 
-import time
-from datetime import datetime, timedelta, date, timezone
-from tqdm import tqdm
-from glob import glob
+from datetime import datetime
+from glob import glob, escape as glob_escape
+import tempfile
+import hashlib
+import json
+import threading
+import queue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 
 import xarray as xr
-import yaml
-from geopy.geocoders import Nominatim
-import functools as ft
+import cfgrib
+import eccodes
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset
 
 import logging
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # ***************** DO NOT CHANGE THESE IMPORTS ************************
 from s3_scripts import *
 # **********************************************************************
+from grib_cache_scripts import *
+from ecmwf_run_plan_scripts import *
+from ecmwf_data_reader_scripts import *
+from point_extraction_scripts import *
+from run_metrics_scripts import *
+from run_state_scripts import *
 
 # *************  Scripts - common
-def get_ecmwf_client():
-    ecmwf_client = Client(source="ecmwf")
-    return ecmwf_client
+# one ecmwf client per download worker thread, the client holds a requests.Session
+# which is not meant to be shared across threads
+_ecmwf_thread_local = threading.local()
 
+def get_thread_ecmwf_client():
+    ecmwf_client = getattr(_ecmwf_thread_local, "client", None)
+    if ecmwf_client is None:
+        ecmwf_client = get_ecmwf_client()
+        _ecmwf_thread_local.client = ecmwf_client
+    return ecmwf_client
 
-def convert_coordinate_to_numeric(coord_string):
-    # Find all sequences of one or more digits
-    numbers_as_strings = re.findall(r'\d+', coord_string)
 
-    # Convert the extracted strings to integers
-    coord_values = [int(num) for num in numbers_as_strings]
-    return coord_values
+def re_arrange_df(df, cols=[]):
+    # get all current columns
+    all_columns = df.columns.tolist()
+    # new column order
+    new_column_order = cols + [col for col in all_columns if col not in cols]
+    # rearrange the DataFrame columns and return
+    rearranged_df = df[new_column_order]
+    return rearranged_df
 
+# *************  Scripts - GRIB2 related
+def crop_dataset_to_bbox(ds, min_max_coords={}):
+    """
+    Crops an xarray Dataset to the lat/lon box by label slicing, before anything is flattened.
 
-def convert_degrees_to_decimal(degrees, minutes=None, seconds=None, direction=None):
+    ECMWF grids run north to south, i.e. latitude is descending, so the slice bounds
+    are flipped to follow the order of the axis. Bounds are inclusive, the same as
+    the >= / <= filter on the dataframe.
     """
-    Converts Degrees, Minutes, Seconds (DMS) to Decimal Degrees (DD).
+    lats = ds['latitude'].values
+    lons = ds['longitude'].values
+    min_lat, max_lat = min_max_coords["min_lat_bhutan"], min_max_coords["max_lat_bhutan"]
+    min_lon, max_lon = min_max_coords["min_lon_bhutan"], min_max_coords["max_lon_bhutan"]
+
+    lat_slice = slice(max_lat, min_lat) if lats[0] > lats[-1] else slice(min_lat, max_lat)
+    lon_slice = slice(max_lon, min_lon) if lons[0] > lons[-1] else slice(min_lon, max_lon)
+    cropped_ds = ds.sel(latitude=lat_slice, longitude=lon_slice)
+    return cropped_ds
+
+
+# ****************** Region index
+# the grid is the same for every step file of a run (and from run to run), so the box is parsed
+# from the yaml once per process and its integer lat/lon slice bounds are worked out once per grid,
+# then kept in REGION_INDEX_FILE for the next runs
+REGION_INDEX_FILE = "region_index.json"
+# the grid definition keys of the grib header, as decoded by cfgrib
+GRID_FINGERPRINT_ATTRS = ["GRIB_gridType", "GRIB_Nx", "GRIB_Ny",
+                          "GRIB_latitudeOfFirstGridPointInDegrees", "GRIB_longitudeOfFirstGridPointInDegrees",
+                          "GRIB_latitudeOfLastGridPointInDegrees", "GRIB_longitudeOfLastGridPointInDegrees",
+                          "GRIB_iDirectionIncrementInDegrees", "GRIB_jDirectionIncrementInDegrees",
+                          "GRIB_iScansNegatively", "GRIB_jScansPositively"]
+_region_lock = threading.Lock()
+_region_configs = {}
+_level_cols_configs = {}
+_region_indexes = {}
+_region_index_files_loaded = set()
+
+
+def get_regions(yaml_file=""):
+    # the regions of the yaml, parsed again only if the yaml changed
+    config_key = (os.path.abspath(yaml_file), os.stat(yaml_file).st_mtime_ns)
+    with _region_lock:
+        if config_key not in _region_configs:
+            regions = get_regions_from_yaml(yaml_file=yaml_file)
+            if not all(region["min_max_coords"] for region in regions):
+                return []
+            _region_configs[config_key] = regions
+        return _region_configs[config_key]
+
+
+def get_level_combine_cols(yaml_file="", filter_levels=[]):
+    # the pre_combine_cols of each filter level, parsed again only if the yaml changed
+    config_key = (os.path.abspath(yaml_file), os.stat(yaml_file).st_mtime_ns, tuple(filter_levels))
+    with _region_lock:
+        if config_key not in _level_cols_configs:
+            _level_cols_configs[config_key] = get_pre_combine_cols(yaml_file=yaml_file, filter_levels=filter_levels)
+        return _level_cols_configs[config_key]
 
-    Args:
-        degrees (float or int): The degree component.
-        minutes (float or int): The minute component.
-        seconds (float or int): The second component.
-        direction (str, optional): The cardinal direction ('N', 'S', 'E', 'W').
-                                   If 'S' or 'W', the decimal degrees will be negative.
-                                   Defaults to None.
+
+def get_region_box(yaml_file=""):
+    # the min/max lat/lon box to decode, around all the regions of the yaml
+    return get_regions_union_box(get_regions(yaml_file=yaml_file))
+
+
+def has_named_regions(regions=[]):
+    # False for the single unnamed region of a yaml without a 'regions' list
+    return len(regions) > 1 or bool(regions and regions[0]["name"])
+
+
+def get_region_mask(lats=None, lons=None, box={}):
+    # inclusive bounds, the same as the crop of the decoded datasets
+    return ((lats >= box["min_lat_bhutan"]) & (lats <= box["max_lat_bhutan"]) &
+            (lons >= box["min_lon_bhutan"]) & (lons <= box["max_lon_bhutan"]))
+
+
+def get_region_dataframes(df=None, regions=[]):
+    """
+    Splits a dataframe decoded over the box around all the regions into one per region.
 
     Returns:
-        float: The equivalent value in decimal degrees.
+        list: (region name, dataframe); a single unnamed region is the dataframe as is.
+    """
+    if not has_named_regions(regions):
+        return [("", df)]
+    region_dfs = []
+    lats = df["latitude"].to_numpy()
+    lons = df["longitude"].to_numpy()
+    for region in regions:
+        in_region = get_region_mask(lats=lats, lons=lons, box=region["min_max_coords"])
+        df_region = df[in_region].reset_index(drop=True)
+        if len(df_region) == 0:
+            logging.warning(f"No grid points in region {region['name']}")
+        region_dfs.append((region["name"], df_region))
+    return region_dfs
+
+
+def get_grid_fingerprint(ds):
+    # from the grid definition in the grib header, without looking at the coordinate values
+    attrs = next(iter(ds.data_vars.values())).attrs if len(ds.data_vars) > 0 else {}
+    header = {name: attrs.get(name) for name in GRID_FINGERPRINT_ATTRS}
+    if all(value is None for value in header.values()):
+        # no grid definition to go by, fall back to the coordinates
+        return hashlib.sha1(ds['latitude'].values.tobytes() + ds['longitude'].values.tobytes()).hexdigest()[:16]
+    return hashlib.sha1(json.dumps(header, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def get_region_index_key(fingerprint="", min_max_coords={}):
+    return (f"{fingerprint}:{min_max_coords['min_lat_bhutan']}:{min_max_coords['max_lat_bhutan']}:"
+            f"{min_max_coords['min_lon_bhutan']}:{min_max_coords['max_lon_bhutan']}")
+
+
+def compute_region_index(ds, min_max_coords={}):
     """
-    conv_mins = (float(minutes) / 60) if minutes is not None else 0
-    conv_secs = (float(seconds) / 3600) if seconds is not None else 0
-    # deg_decimal = float(degrees) + (float(minutes) / 60) + (float(seconds) / 3600)
-    deg_decimal = float(degrees) + conv_mins + conv_secs
+    Integer [start, stop) slice bounds of the box on the lat and lon axes of the dataset.
+
+    The bounds are inclusive, the same as the label slicing in crop_dataset_to_bbox. The first
+    and last coordinate values in the box are kept to check the index against a grid later on.
+    """
+    region_index = {}
+    for coord, min_key, max_key in [("latitude", "min_lat_bhutan", "max_lat_bhutan"),
+                                    ("longitude", "min_lon_bhutan", "max_lon_bhutan")]:
+        values = ds[coord].values
+        in_box = np.flatnonzero((values >= min_max_coords[min_key]) & (values <= min_max_coords[max_key]))
+        start, stop = (int(in_box[0]), int(in_box[-1]) + 1) if len(in_box) > 0 else (0, 0)
+        region_index[coord] = {"start": start, "stop": stop, "size": int(values.size),
+                               "first": float(values[start]) if stop > start else None,
+                               "last": float(values[stop - 1]) if stop > start else None}
+    return region_index
 
-    # further process if cardinal direction has been provided
-    if direction and direction.upper() in ['S', 'W']:
-        deg_decimal *= -1
 
-    return deg_decimal
+def is_region_index_valid(ds, region_index={}):
+    # a cheap check, on the axis sizes and the values at the slice bounds
+    for coord, bounds in region_index.items():
+        values = ds[coord].values
+        if values.size != bounds["size"]:
+            return False
+        if bounds["stop"] > bounds["start"] and (float(values[bounds["start"]]) != bounds["first"] or
+                                                 float(values[bounds["stop"] - 1]) != bounds["last"]):
+            return False
+    return True
 
-def set_coords_as_decimal(yaml_file=""):
-    result = {}
-    data = None
-    vals = None
 
+def load_region_index_file(region_index_file=""):
+    # once per process, merged into the in memory index
+    with _region_lock:
+        if region_index_file in _region_index_files_loaded:
+            return
+        _region_index_files_loaded.add(region_index_file)
+    if not os.path.exists(region_index_file):
+        return
     try:
-        # load config for coords
-        with open(yaml_file, 'r') as f:
-            data = yaml.load(f, Loader=yaml.SafeLoader)
-        # print(data['coords']['north'])
-        # fetch the north, west, south, east coords
-        coords_keys = data['coords'].keys()
-        coord_keys_map = data["coords_map"]
-
-        for key in coords_keys:
-            # print(key)
-            # convert coords to numeric
-            vals = convert_coordinate_to_numeric(data['coords'][key])
-            # convert coords to decimal
-            disp_key = coord_keys_map[key]
-            match len(vals):
-                case 2:
-                    result[disp_key] = convert_degrees_to_decimal(degrees=vals[0], minutes=vals[1])
-                case 3:
-                    result[disp_key] = convert_degrees_to_decimal(degrees=vals[0], minutes=vals[1], seconds=vals[2])
-                case _:  # Default case
-                    result[disp_key] = convert_degrees_to_decimal(degrees=vals[0], minutes=vals[1])
-            
+        with open(region_index_file, 'r') as f:
+            file_indexes = json.load(f)
+        with _region_lock:
+            for index_key, region_index in file_indexes.items():
+                _region_indexes.setdefault(index_key, region_index)
+    except Exception as ex:
+        logging.warning(f"Unable to read the region index file {region_index_file}: {ex}, rebuilding it")
+
 
+def save_region_index_file(region_index_file=""):
+    # written to a temp file and renamed, as decode workers may save at the same time
+    with _region_lock:
+        file_indexes = dict(_region_indexes)
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(region_index_file) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(file_indexes, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, region_index_file)
     except Exception as ex:
-        logging.error(f"Error occurred as exception: {ex}")
-    return result
+        logging.warning(f"Unable to save the region index file {region_index_file}: {ex}")
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
 
 
-def re_arrange_df(df, cols=[]):
-    # get all current columns
-    all_columns = df.columns.tolist()
-    # new column order
-    new_column_order = cols + [col for col in all_columns if col not in cols]
-    # rearrange the DataFrame columns and return
-    rearranged_df = df[new_column_order]
-    return rearranged_df
+def get_region_index(ds, min_max_coords={}, region_index_file=""):
+    """
+    The slice bounds of the box on the grid of ds, looked up by grid fingerprint.
+
+    Worked out only for a grid (or box) not seen before, in this process or, with a
+    region_index_file, in an earlier run.
+    """
+    if region_index_file:
+        load_region_index_file(region_index_file)
+    fingerprint = get_grid_fingerprint(ds)
+    index_key = get_region_index_key(fingerprint=fingerprint, min_max_coords=min_max_coords)
+    with _region_lock:
+        region_index = _region_indexes.get(index_key)
+    if region_index is not None and is_region_index_valid(ds, region_index):
+        return region_index
+
+    region_index = compute_region_index(ds, min_max_coords=min_max_coords)
+    logging.info(f"Region index for grid {fingerprint}: latitude {region_index['latitude']['start']}:"
+                 f"{region_index['latitude']['stop']}, longitude {region_index['longitude']['start']}:"
+                 f"{region_index['longitude']['stop']}")
+    with _region_lock:
+        _region_indexes[index_key] = region_index
+    if region_index_file:
+        save_region_index_file(region_index_file)
+    return region_index
+
+
+def crop_dataset_to_region(ds, min_max_coords={}, region_index_file=""):
+    # same result as crop_dataset_to_bbox, by position instead of label lookups
+    region_index = get_region_index(ds, min_max_coords=min_max_coords, region_index_file=region_index_file)
+    cropped_ds = ds.isel(latitude=slice(region_index["latitude"]["start"], region_index["latitude"]["stop"]),
+                         longitude=slice(region_index["longitude"]["start"], region_index["longitude"]["stop"]))
+    return cropped_ds
 
-# *************  Scripts - GRIB2 related
        
-def load_grib2_to_dataframe(file_path, filter_level="", level=0):
+def load_grib2_to_dataframe(file_path, filter_level="", level=0, min_max_coords=None):
     
     df = None
     ds = None
@@ -166,6 +322,10 @@ def load_grib2_to_dataframe(file_path, filter_level="", level=0):
                              decode_timedelta=True
                              )       
                
+        # crop to the box first, so only the region gets materialised
+        if ds is not None and min_max_coords:
+            ds = crop_dataset_to_bbox(ds, min_max_coords=min_max_coords)
+
         # load ds to dataframe
         if ds is not None:
             df = ds.to_dataframe()
@@ -175,28 +335,127 @@ def load_grib2_to_dataframe(file_path, filter_level="", level=0):
         # Handle the error, e.g., exit or try another engine
     return df
 
+def get_dataset_type_of_level(ds):
+    # every data variable carries its grib typeOfLevel as an attribute
+    for _, da in ds.data_vars.items():
+        return da.attrs.get("GRIB_typeOfLevel", "undef")
+    return "undef"
+
+
+def load_grib2_levels_to_datasets(file_path, filter_levels=[], level=0, min_max_coords=None,
+                                  region_index_file="", chunks=None):
+    """
+    Decodes all the requested filter levels from a GRIB2 file in a single pass.
+
+    cfgrib.open_datasets indexes the file once and splits it into hypercubes, which are
+    then routed by typeOfLevel; for heightAboveGround only the given level is kept.
+    With chunks (e.g. {}) the variables are dask arrays, read only when computed.
+
+    Returns:
+        dict: filter level -> xarray Dataset (cropped to the box if min_max_coords is given).
+    """
+    level_datasets = {}
+
+    # load the grib2 to a list of xarray datasets, one per compatible hypercube
+    open_kwargs = {} if chunks is None else {"chunks": chunks}
+    datasets = cfgrib.open_datasets(file_path, decode_timedelta=True, **open_kwargs)
+
+    routed = {filter_level: [] for filter_level in filter_levels}
+    for ds in datasets:
+        type_of_level = get_dataset_type_of_level(ds)
+        if type_of_level not in routed:
+            continue
+        if type_of_level == "heightAboveGround":
+            heights = np.atleast_1d(ds["heightAboveGround"].values).astype(float)
+            if float(level) not in heights:
+                continue
+            if ds["heightAboveGround"].ndim > 0:
+                ds = ds.sel(heightAboveGround=float(level))
+        routed[type_of_level].append(ds)
+
+    for filter_level, level_dss in routed.items():
+        if len(level_dss) == 0:
+            raise ValueError(f"No {filter_level} messages found in {file_path}")
+        ds = level_dss[0] if len(level_dss) == 1 else xr.merge(level_dss, compat="override", join="exact")
+        # crop to the box first, so only the region gets materialised
+        if min_max_coords:
+            ds = crop_dataset_to_region(ds, min_max_coords=min_max_coords, region_index_file=region_index_file)
+        level_datasets[filter_level] = ds
+
+    return level_datasets
+
+
+def check_level_grids_aligned(level_datasets={}):
+    # every level must sit on the very same lat/lon grid, else the positional stack is wrong
+    ref_level, ref_ds = None, None
+    for filter_level, ds in level_datasets.items():
+        if ref_ds is None:
+            ref_level, ref_ds = filter_level, ds
+            continue
+        for coord in ['latitude', 'longitude']:
+            if not np.array_equal(ds[coord].values, ref_ds[coord].values):
+                raise ValueError(f"Grid mismatch on {coord} between {ref_level} "
+                                 f"({ref_ds[coord].size} points) and {filter_level} ({ds[coord].size} points)")
+
+
+def combine_level_datasets_on_grid(level_datasets={}, cols_dict={}):
+    """
+    Combines the per level datasets into one dataframe, by position on their shared grid.
+
+    All the levels come from the same regular grid, so the rows line up one to one;
+    the columns are stacked as flat arrays instead of hash-joining on float lat/lon.
+    Columns follow cols_dict in level order, the same as an inner merge on lat/lon.
+    """
+    check_level_grids_aligned(level_datasets=level_datasets)
+
+    ref_ds = next(iter(level_datasets.values()))
+    # row order as in to_dataframe(): latitude major, longitude minor
+    lat_2d, lon_2d = np.meshgrid(ref_ds['latitude'].values, ref_ds['longitude'].values, indexing='ij')
+    n_points = lat_2d.size
+    grid_cols = {'latitude': lat_2d.ravel(), 'longitude': lon_2d.ravel()}
+
+    combined = {}
+    for filter_level, ds in level_datasets.items():
+        for col in cols_dict[filter_level]:
+            if col in combined:
+                continue
+            if col in grid_cols:
+                combined[col] = grid_cols[col]
+            elif ds[col].ndim == 0:
+                # scalar coordinates e.g. time, surface are repeated for every grid point
+                combined[col] = np.full(n_points, ds[col].values)
+            else:
+                combined[col] = ds[col].transpose('latitude', 'longitude').values.ravel()
+    df_cmb = pd.DataFrame(combined)
+    return df_cmb
+
+
 def load_combine_filter_ecmwf_grib_data(file_path="", filter_levels=[], level=2, k2cvalue=273.15,
-                                        yaml_file=""):
+                                        yaml_file="", region_index_file=""):
     status = False
     step = ""
-    df_flevel = None
-    df_flevels = []
     filtered_df = None
-    cols_dict = {
-        "surface": ['longitude', 'latitude', 'surface', 'tp', 'tprate'],
-        "heightAboveGround": ['longitude', 'latitude', 'time', 't2m']
-    }
     
     try:
+        step = " level cols "
+        # the columns taken from each level, as per pre_combine_cols in the yaml
+        cols_dict = get_level_combine_cols(yaml_file=yaml_file, filter_levels=filter_levels)
+
+        step = " filter for lats "
+        # parsed once per process, not for every file; the box around all the regions
+        min_max_coords = get_region_box(yaml_file=yaml_file)
+        if not min_max_coords:
+            raise ValueError(f"No lat/lon box could be read from {yaml_file}")
+
         step = " filter levels "
-        for filter_level in filter_levels:
-            df_flevel_curr = load_grib2_to_dataframe(file_path=file_path, filter_level=filter_level,
-                                                      level=level)
-            df_flevel = df_flevel_curr[cols_dict[filter_level]].copy(deep=True)
-            df_flevels.append(df_flevel)
+        # NOTE: one pass over the file for all the levels, each cropped to the box prior to to_dataframe()
+        level_datasets = load_grib2_levels_to_datasets(file_path=file_path, filter_levels=filter_levels,
+                                                       level=level, min_max_coords=min_max_coords,
+                                                       region_index_file=region_index_file)
 
         step = " combine data "
-        df_cmb_initial = ft.reduce(lambda left, right: pd.merge(left, right, on=['latitude', 'longitude'], how="inner"), df_flevels)
+        # NOTE: positional stack on the shared grid, raises on any grid mismatch across levels
+        df_cmb_initial = combine_level_datasets_on_grid(level_datasets=level_datasets, cols_dict=cols_dict)
         # print(f"df_cmb_initial: {df_cmb_initial.shape}")
         # print(f"df_cmb_initial cols: {df_cmb_initial.columns}")
         # print(df_cmb_initial.head(2))
@@ -206,16 +465,11 @@ def load_combine_filter_ecmwf_grib_data(file_path="", filter_levels=[], level=2,
         # print("Before k to c conversion")
         # print(df_cmb_k2c.head(2))
         # convert kelvin to celcius
-        df_cmb_k2c['t2m_cel'] = df_cmb_k2c['t2m'].apply(lambda x: x - k2cvalue) # 273.15)
+        # NOTE: in float64, same as the earlier per element python float arithmetic
+        df_cmb_k2c['t2m_cel'] = df_cmb_k2c['t2m'].astype('float64') - k2cvalue # 273.15
 
-        step = " filter for lats "
-        min_max_coords = set_coords_as_decimal(yaml_file=yaml_file)   
-        filtered_df = (df_cmb_k2c[
-            (df_cmb_k2c['latitude'] >= min_max_coords["min_lat_bhutan"]) 
-            & (df_cmb_k2c['latitude'] <= min_max_coords["max_lat_bhutan"]) &
-            (df_cmb_k2c['longitude'] >= min_max_coords["min_lon_bhutan"]) 
-            & (df_cmb_k2c['longitude'] <= min_max_coords["max_lon_bhutan"])
-        ])
+        # already cropped to the lat/lon box, within load_grib2_levels_to_datasets
+        filtered_df = df_cmb_k2c
         status = True
         
     except Exception as ex:
@@ -253,11 +507,127 @@ def load_grib2_to_csv(filter_levels=[], input_dir="", prepped_dir="",
             comb_df.to_csv(save_filename, index=None)
 
 
-# *************  Scripts - Other processing related
-def assign_param_by_tag(row):    
-    param_value = "temperature_celcius" if row['param_tag']=="t2m_cel" else "surface_runoff" if row['param_tag']=="surface" else "precipitation"
-    return param_value
+# *************  Scripts - in-memory step frames
+# A step frames registry is a plain dict of step hour -> decoded dataframe. When the
+# memory budget is exceeded, further frames are spilled to parquet and the registry
+# holds the spill file path instead, which get_step_frame reads back transparently.
+def get_step_frames_memory_mb(step_frames={}):
+    total_bytes = sum(frame.memory_usage(deep=True).sum() for frame in step_frames.values()
+                      if isinstance(frame, pd.DataFrame))
+    return total_bytes / (1024 * 1024)
+
+
+def register_step_frame(step_frames={}, step_hour=0, df=None, memory_budget_mb=0, spill_dir=""):
+    frame_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
+    if memory_budget_mb > 0 and get_step_frames_memory_mb(step_frames) + frame_mb > memory_budget_mb:
+        os.makedirs(spill_dir, exist_ok=True, mode=0o777)
+        spill_file = f"{spill_dir}/step_frame_{step_hour}h.parquet"
+        df.to_parquet(spill_file, index=False)
+        logging.info(f"Memory budget of {memory_budget_mb} MB exceeded, spilled step {step_hour}h to {spill_file}")
+        step_frames[step_hour] = spill_file
+    else:
+        step_frames[step_hour] = df
+    return step_frames
+
+
+def get_step_frame(step_frames={}, step_hour=0):
+    frame = step_frames[step_hour]
+    if isinstance(frame, pd.DataFrame):
+        return frame
+    return pd.read_parquet(frame)
+
+
+def clear_step_frames(step_frames={}):
+    # remove any spilled files, then drop the frames
+    for frame in step_frames.values():
+        if isinstance(frame, str) and os.path.exists(frame):
+            os.remove(frame)
+    step_frames.clear()
+
+
+def decode_grib_file_to_arrays(file_path="", filter_levels=[], level=2, yaml_file="", region_index_file=""):
+    """
+    Decodes one step file and returns its columns as NumPy arrays, or None if it failed.
+
+    Meant to run in a decode worker process: plain arrays pickle as raw buffers, which keeps
+    the transfer back to the parent cheap compared with a pickled DataFrame.
+    """
+    load_status, comb_df = load_combine_filter_ecmwf_grib_data(file_path=file_path,
+                                                               filter_levels=filter_levels,
+                                                               level=level, yaml_file=yaml_file,
+                                                               region_index_file=region_index_file)
+    if not load_status:
+        return None
+    return {col: comb_df[col].to_numpy() for col in comb_df.columns}
+
+
+def get_decode_executor(decode_workers=1):
+    # spawn rather than fork, as the decode runs alongside the download threads
+    if decode_workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=decode_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def load_grib2_to_step_frames(step_files={}, filter_levels=[], level=2, yaml_file="",
+                              memory_budget_mb=0, spill_dir="", decode_executor=None, region_index_file="",
+                              checkpoint_dir="", checkpoint_stem="", record_unit=None):
+    """
+    Decodes each step file into a typed dataframe, kept in memory in a step frames registry.
+
+    Args:
+        step_files (dict): step hour -> grib2 filename, as from download_ecmwf_step_files.
+        memory_budget_mb (int): spill frames to parquet in spill_dir beyond this, 0 for no limit.
+        decode_executor: optional process pool (see get_decode_executor) to decode the files
+                         in parallel; the frames are still registered in step order.
+        region_index_file (str): json file keeping the box slice bounds per grid across runs.
+        checkpoint_dir (str): if given, each decoded frame is also saved there as
+                              {checkpoint_stem}_{step}h.parquet, for a resumed run.
+        record_unit: optional journal callback, each step is recorded as decode/{step} done or failed.
+
+    Returns:
+        dict: step hour -> dataframe (or spill file), for the steps that decoded successfully.
+    """
+    step_frames = {}
+    if decode_executor is not None:
+        futures = {step_hour: decode_executor.submit(decode_grib_file_to_arrays, file_path=file_path,
+                                                     filter_levels=filter_levels, level=level,
+                                                     yaml_file=yaml_file, region_index_file=region_index_file)
+                   for step_hour, file_path in step_files.items()}
+    for step_hour, file_path in step_files.items():
+        print(f"\nProcessing grib2 file: {file_path}")
+        logging.info(f"\nProcessing grib2 file: {file_path}")
+        decode_error = f"Unable to decode {file_path}"
+        if decode_executor is not None:
+            # collected in step order, whatever order the workers complete in
+            try:
+                comb_arrays = futures[step_hour].result()
+            except Exception as ex:
+                # a failing worker (or a broken pool) fails its step only, as in the serial decode
+                logging.error(f"Error with exception: {ex} at step: decode {step_hour}h")
+                comb_arrays = None
+                decode_error = f"{decode_error}: {ex}"
+            load_status = comb_arrays is not None
+            comb_df = pd.DataFrame(comb_arrays) if load_status else None
+        else:
+            load_status, comb_df = load_combine_filter_ecmwf_grib_data(file_path=file_path,
+                                                                       filter_levels=filter_levels,
+                                                                       level=level, yaml_file=yaml_file,
+                                                                       region_index_file=region_index_file)
+        if load_status:
+            checkpoint_file = ""
+            if checkpoint_dir:
+                checkpoint_file = f"{checkpoint_dir}/{checkpoint_stem}_{step_hour}h.parquet"
+                comb_df.to_parquet(checkpoint_file, index=False)
+            register_step_frame(step_frames=step_frames, step_hour=step_hour, df=comb_df,
+                                memory_budget_mb=memory_budget_mb, spill_dir=spill_dir)
+            if record_unit is not None:
+                record_unit(f"decode/{step_hour}", "done", unit_file=checkpoint_file)
+        elif record_unit is not None:
+            record_unit(f"decode/{step_hour}", "failed", error=decode_error)
+    return step_frames
 
+
+# *************  Scripts - Other processing related
 def format_date_final(row, date_format="%Y-%m-%d"):
     # Parse the original string into a datetime object
     # Sample: row{'forecast_date'} = '2025-09-23 06:00:00'
@@ -269,259 +639,1145 @@ def format_date_final(row, date_format="%Y-%m-%d"):
 
     return date_value
 
-def combine_csvs_for_one_day(prepped_path="", prepped_suffix="temp", hour_array=[], stream_to_use=""):
+def widen_float_as_written(values):
+    # the value as the step csv files were written and read back by pandas: float32 -> float64 through
+    # the shortest decimal repr (e.g. 0.0012345 and not 0.0012344999704509974), and float64 through
+    # pandas' float parser, which is not round-trip exact (a few ulp off for about 1 in 5 temperatures)
+    if values.dtype not in (np.float32, np.float64):
+        return values
+    widened = values.astype(np.float64)
+    written = ~np.isnan(values)
+    widened[written] = pd.to_numeric(values[written].astype(str))
+    return widened
+
+
+# the columns shared by the forecast variables (DAY_FORECAST_VARS, the param_tag blocks)
+DAY_COMMON_COLS = ['latitude', 'longitude', 'time']
+
+def build_day_frame(common_values={}, hour_values={}, forecast_vars=DAY_FORECAST_VARS, stream_to_use=""):
+    """
+    Builds the long format day frame, rows as in a melt of forecast_vars: one block of all
+    grid points per variable, each hourly value in its own column.
+
+    Args:
+        common_values (dict): DAY_COMMON_COLS -> values of the grid points.
+        hour_values (dict): hour column e.g. '6h' -> {forecast var -> values of the grid points}.
+        forecast_vars (list): the blocks to build, a subset of DAY_FORECAST_VARS, in that order.
+    """
+    n_rows = len(common_values['latitude'])
+    final_df = pd.DataFrame({col: np.tile(common_values[col], len(forecast_vars)) for col in DAY_COMMON_COLS})
+    final_df['param_tag'] = pd.Categorical(np.repeat(forecast_vars, n_rows), categories=DAY_FORECAST_VARS)
+    for hour_key, var_values in hour_values.items():
+        # variable by variable, one after the other
+        final_df[hour_key] = np.concatenate([var_values[var] for var in forecast_vars])
+
+    final_df.rename(columns={"time": "forecast_date", "t2m_cel": "temperature", "tp": "precipitation"}, inplace=True)
+    # create param column, mapped once per category rather than per row
+    param_by_tag = {tag: assign_param_by_tag({'param_tag': tag}) for tag in DAY_FORECAST_VARS}
+    final_df['param'] = final_df['param_tag'].map(param_by_tag)
+    if stream_to_use != "oper":
+        # modify date column formatted as yyyy-mm-dd
+        final_df['forecast_date'] = pd.to_datetime(final_df['forecast_date']).dt.strftime("%Y-%m-%d")
+
+    # rearrange columns
+    cols_order = ['longitude', 'latitude', "forecast_date", "param", "param_tag"]
+    return re_arrange_df(final_df, cols=cols_order)
+
+
+def combine_step_frames_for_one_day(step_frames={}, hour_array=[], stream_to_use=""):
     combined_1day_df = None
      
     step = ""
 
-    print(f"\nCombining csvs to one csv - for current range of forecast_hours...")
-    logging.info(f"\nCombining csvs to one csv - for current range of forecast_hours...")
+    print("\nCombining step frames to one dataframe - for current range of forecast_hours...")
+    logging.info("\nCombining step frames to one dataframe - for current range of forecast_hours...")
     try:
-        # set up file paths
-        p_pattern = f"{prepped_path}/{prepped_suffix}/*.csv"
-        prepped_files = glob(p_pattern)
         # e.g.: hr_arr = ['6h', '12h', '18h', '24h'] as hr_arr2 = [f"{t}h" for t in [6,12,18,24]]
         hr_arr = [f"{t}h" for t in hour_array]
-        step = " matched_dict "
-        matched_dict = {item1: item2 for item1 in hr_arr for item2 in prepped_files if item1 in item2}        
-        print(f"matched_dict: {matched_dict}")
 
-        # create a dictionary to hold the dataframes for easy access
+        # create a dictionary to hold the dataframes for easy access, keyed by the exact step hour
         step = " load df " 
         dfs_dict = {}
-        for hr_s in hr_arr:
-            fname = matched_dict[hr_s]
-            dfs_dict[hr_s] = pd.read_csv(fname)
-        
-        # identify the common columns and the forecast variables
-        common_cols = ['latitude', 'longitude', 'time']
-        forecast_vars = ['t2m_cel', 'surface', 'tp']
-
-        # create a list to store the final, long-format dataframes for each variable
-        combined_list = []
+        for t, hr_s in zip(hour_array, hr_arr):
+            dfs_dict[hr_s] = get_step_frame(step_frames=step_frames, step_hour=t)
 
-        # loop through each forecast variable and each dataframe to build the long format
-        step = " forecastvars loop "
+        step = " forecastvars reshape "
         first_key = list(dfs_dict.keys())[0]
-        for var in forecast_vars:
-            # Initialize a new DataFrame with the common columns
-            combined_df_for_var = dfs_dict[first_key][common_cols].copy()
-            combined_df_for_var['param_tag'] = var
-
-            # Add the forecast data from each hourly dataframe
-            for hour_key, df in dfs_dict.items():
-                combined_df_for_var[hour_key] = df[var]
-
-            combined_list.append(combined_df_for_var)
-
-        # concatenate all the variable-specific dataframes into a single final dataframe
-        step = " concatcombined "
-        # print(f"len combined_list: {len(combined_list)}")
-        merged_df_loop = pd.concat(combined_list, ignore_index=True)
-
-        # print(f"Total rows in merged csv: {merged_df_loop.shape[0]}")
-        # print(f"merged_df_loop cols: {merged_df_loop.columns}")
-        
-        # rename the columns 
-        final_df = merged_df_loop.copy(deep=True)
-        step = " choosecols "
-        # e.g. ['latitude', 'longitude', 'time', 'param_tag', '6h', '12h', '18h', '24h']
-        f_cols = ['latitude', 'longitude', 'time', 'param_tag']
-        f_cols.extend(hr_arr)
-        final_df = final_df[f_cols]
-        step = " combrename "
-        final_df.rename(columns={"time": "forecast_date", "t2m_cel": "temperature", "tp": "precipitation"}, inplace=True)
-        # create param column
-        final_df['param'] = final_df.apply(lambda r: assign_param_by_tag(r), axis=1)
+        common_values = {col: widen_float_as_written(dfs_dict[first_key][col].to_numpy()) for col in DAY_COMMON_COLS}
+        hour_values = {hour_key: {var: widen_float_as_written(df[var].to_numpy()) for var in DAY_FORECAST_VARS}
+                       for hour_key, df in dfs_dict.items()}
         if stream_to_use == "oper":
             print("No need to format date, as it is already a short date")
-        else:
-            # modify date column formatted as yyyy-mm-dd
-            final_df['forecast_date'] = final_df.apply(lambda r: format_date_final(r), axis=1)
-        
-        # rearrange columns
-        step = " combrearr "
-        cols_order = ['longitude', 'latitude', "forecast_date", "param", "param_tag"]
-        combined_1day_df = re_arrange_df(final_df, cols=cols_order)
+        combined_1day_df = build_day_frame(common_values=common_values, hour_values=hour_values,
+                                           stream_to_use=stream_to_use)
         # print(combined_1day_df.columns)
     except Exception as ex:
         logging.error(f"Error with exception: {ex} at step: {step}")
     return combined_1day_df
 
 
+def combine_csvs_for_one_day(prepped_path="", prepped_suffix="temp", hour_array=[], stream_to_use=""):
+    combined_1day_df = None
+
+    print("\nCombining csvs to one csv - for current range of forecast_hours...")
+    logging.info("\nCombining csvs to one csv - for current range of forecast_hours...")
+    try:
+        # set up file paths
+        p_pattern = f"{prepped_path}/{prepped_suffix}/*.csv"
+        prepped_files = glob(p_pattern)
+        # match on the whole step token e.g. _6h_, so '6h' does not pick up a 36h file
+        step_frames = {}
+        for t in hour_array:
+            for fname in prepped_files:
+                if f"_{t}h_" in os.path.basename(fname):
+                    step_frames[t] = pd.read_csv(fname)
+        print(f"matched steps: {list(step_frames.keys())}")
+        combined_1day_df = combine_step_frames_for_one_day(step_frames=step_frames, hour_array=hour_array,
+                                                           stream_to_use=stream_to_use)
+    except Exception as ex:
+        logging.error(f"Error with exception: {ex}")
+    return combined_1day_df
+
+
 # *************  Scripts - Main driver function
-def get_forecast_hours_for_total_days(num_days=0, step_size=6, start=6):
-    hours_per_day = 24
-    hours_array = list(range(start, (num_days * hours_per_day) + 1, step_size))
-    return hours_array
-
-def get_formatted_utc_current_date():
-    utc_1dayprior_date = None
-    fmtd_utc_1dayprior_date = None
-    # get the current date in UTC
-    today_utc = datetime.now(timezone.utc).date()
-
-    # get the current UTC date and time, setting the time to 00:00:00
-    current_utc_date_at_midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    # we are keeping in UTC, so we don't alter the source data integrity 
-    utc_1dayprior_date = (current_utc_date_at_midnight - timedelta(days=1)) 
-
-    # check by printing the resulting date and time
-    print(f"The current UTC date at 0 hours is: {current_utc_date_at_midnight}")
-    print(f"UTC date 1day prior so we cover Bhutan TZ: {utc_1dayprior_date}")
-    fmtd_utc_1dayprior_date = utc_1dayprior_date.strftime("%Y-%m-%d %H:%M:%S")
-    return utc_1dayprior_date, fmtd_utc_1dayprior_date
+def get_grib_file_params(file_path=""):
+    """Returns the set of shortNames of the messages in a GRIB file, e.g. {'2t', 'tp'}."""
+    params = set()
+    with open(file_path, "rb") as f:
+        while (gid := eccodes.codes_grib_new_from_file(f)) is not None:
+            try:
+                params.add(eccodes.codes_get(gid, "shortName"))
+            finally:
+                eccodes.codes_release(gid)
+    return params
+
+
+def download_ecmwf_step_file(current_date=None, step_hour=0, stream_to_use="oper", target_filename="",
+                             params=[], levtypes=[], grib_cache_dir="", grib_cache_max_mb=0):
+    """
+    Downloads one forecast step to target_filename, skipping it if it already exists.
+
+    With a grib_cache_dir, the step is looked up in the grib cache first and on a miss
+    it is downloaded into the cache; the cached file is returned instead of target_filename.
+
+    When params are given, only those fields are fetched: the client reads the .index
+    sidecar of the step file and pulls just the matching messages as merged http
+    Range requests, instead of the complete global file. A param missing from the
+    .index is raised as a ValueError, the client itself only logs a warning for it.
+
+    The data is first written to a temp file in the same folder and then renamed,
+    so a partially downloaded file never shows up under the final *.grib2 name.
+    """
+    if grib_cache_dir:
+        cache_request = get_step_cache_request(current_date=current_date, step_hour=step_hour,
+                                               stream_to_use=stream_to_use, params=params, levtypes=levtypes)
+        cached_file = lookup_grib_cache(cache_dir=grib_cache_dir, request=cache_request)
+        if cached_file:
+            return cached_file
+        # download next to the cache, so adding it to the cache is a rename
+        target_filename = f"{grib_cache_dir}/{os.path.basename(target_filename)}.incoming"
+        download_ecmwf_step_file(current_date=current_date, step_hour=step_hour, stream_to_use=stream_to_use,
+                                 target_filename=target_filename, params=params, levtypes=levtypes)
+        return add_to_grib_cache(cache_dir=grib_cache_dir, request=cache_request, file_path=target_filename,
+                                 max_cache_mb=grib_cache_max_mb)
+
+    if os.path.exists(target_filename):
+        logging.info(f"⚠️ Already exists: {target_filename}")
+        return target_filename
+
+    # NOTE: suffix .part keeps the temp file out of the *.grib2 glob, but within the *.grib2* cleanup
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(target_filename) or ".",
+                                        prefix=f"{os.path.basename(target_filename)}.", suffix=".part")
+    os.close(fd)
+    try:
+        client = get_thread_ecmwf_client()
+        request = dict(
+            # UTC starting at 00 hours, so time arg befow can be excluded
+            # NOTE: without the tzinfo, the client compares the date with naive datetimes
+            date=current_date.replace(tzinfo=None),
+            # time=0,
+            step=step_hour,
+            stream=stream_to_use, # stream=['oper','wave','enfo','waef','scda','scwv'] adjust if needed,
+            # but we are allowed to only finite attrs within a level
+            type="fc", # Forecast data
+            target=tmp_filename,
+        )
+        if params:
+            # retrieve (unlike download) uses the .index sidecar to do byte-range requests
+            client.retrieve(param=params, levtype=levtypes, **request)
+            # NOTE: retrieve only warns for params missing from the .index, so check the fields we got
+            missing_params = [param for param in params if param not in get_grib_file_params(tmp_filename)]
+            if missing_params:
+                raise ValueError(f"No data for params {missing_params} in the ECMWF step file "
+                                 f"for {current_date} step {step_hour}h")
+        else:
+            client.download(**request)
+        os.replace(tmp_filename, target_filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    add_run_metric("files_downloaded", 1)
+    add_run_metric("bytes_downloaded", os.path.getsize(target_filename))
+    logging.info(f"Downloaded data for {current_date} step {step_hour}h to {target_filename}")
+    return target_filename
+
+
+def download_ecmwf_step_files(current_date=None, step_hours=[], stream_to_use="oper", download_dir="",
+                              max_parallel_downloads=4, params=[], levtypes=[],
+                              grib_cache_dir="", grib_cache_max_mb=0, record_unit=None):
+    """
+    Downloads the forecast steps concurrently, with at most max_parallel_downloads at a time.
+
+    With record_unit, each step is journaled as download/{step} done (with its file) or failed,
+    see run_state_scripts.py; the first failed step is raised once all the steps are through.
+
+    Returns:
+        dict: step hour -> downloaded (or cached) grib2 filename, in the order of step_hours.
+    """
+    target_filenames = {}
+    for step_hour in step_hours:
+        # set target filename
+        target_filenames[step_hour] = get_step_file_name(download_dir=download_dir, current_date=current_date,
+                                                         step_hour=step_hour, stream_to_use=stream_to_use)
+
+    max_workers = max(1, min(max_parallel_downloads, len(step_hours)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ecmwf_dl") as executor:
+        futures = {step_hour: executor.submit(download_ecmwf_step_file, current_date=current_date,
+                                              step_hour=step_hour, stream_to_use=stream_to_use,
+                                              target_filename=target_filename,
+                                              params=params, levtypes=levtypes,
+                                              grib_cache_dir=grib_cache_dir,
+                                              grib_cache_max_mb=grib_cache_max_mb)
+                   for step_hour, target_filename in target_filenames.items()}
+        # NOTE: the first failed download is re-raised, after the pool has drained
+        step_files = {}
+        download_ex = None
+        for step_hour, future in futures.items():
+            print(f"step_hour: {step_hour}")
+            try:
+                step_files[step_hour] = future.result()
+            except Exception as ex:
+                download_ex = download_ex or ex
+                if record_unit is not None:
+                    record_unit(f"download/{step_hour}", "failed", error=str(ex))
+                continue
+            if record_unit is not None:
+                record_unit(f"download/{step_hour}", "done", unit_file=step_files[step_hour])
+        if download_ex is not None:
+            raise download_ex
+
+    return step_files
+
+
+def delete_step_files(step_files={}):
+    # delete the grib2 and grib2.idx files of these steps only, as the next day may be downloading alongside
+    # NOTE: each time a grib2 file is opened, an index file i.e. idx file gets created,
+    #       so <file>.grib2* pattern is needed, as it will delete all grib2 related files.
+    for file_path in step_files.values():
+        for f_del in glob(f"{glob_escape(file_path)}*"):
+            if not f_del.endswith(".part"):
+                os.remove(f_del)
+
+
+def decode_and_combine_chunk(cnt=0, chunk=[], step_files={}, filter_levels=[], level=2, yaml_file="",
+                             memory_budget=0, spill_dir="", stream_to_use="oper", decode_executor=None,
+                             grib_cache_dir="", grib_cache_max_mb=0, region_index_file="",
+                             checkpoint_frames={}, checkpoint_dir="", checkpoint_stem="", record_unit=None):
+    # load
+    step_frames = load_grib2_to_step_frames(step_files=step_files, filter_levels=filter_levels,
+                                            level=level, yaml_file=yaml_file,
+                                            memory_budget_mb=memory_budget, spill_dir=spill_dir,
+                                            decode_executor=decode_executor,
+                                            region_index_file=region_index_file,
+                                            checkpoint_dir=checkpoint_dir, checkpoint_stem=checkpoint_stem,
+                                            record_unit=record_unit)
+    try:
+        # combine the step frames for one day to one common dataframe; the steps decoded by an
+        # earlier run are read back like spilled frames
+        # NOTE: the decode checkpoints are kept here, even if the combine fails, and only removed
+        #       once the combined day is checkpointed, see download_and_process_ecmwf_data
+        day_step_frames = {**step_frames, **checkpoint_frames}
+        df_comb_csv = combine_step_frames_for_one_day(step_frames=day_step_frames, hour_array=chunk,
+                                                      stream_to_use=stream_to_use)
+        if df_comb_csv is None:
+            raise ValueError(f"Unable to combine the step frames for day {cnt+1}, decoded steps: {list(day_step_frames.keys())}")
+        print(df_comb_csv.head(2))
+    finally:
+        # release the step frames, along with any spilled files, and the grib2 files
+        # NOTE: cached grib2 files (and their .idx) are kept, just no longer pinned
+        clear_step_frames(step_frames)
+        if grib_cache_dir:
+            unpin_grib_cache_files(cache_dir=grib_cache_dir, file_paths=step_files.values(),
+                                   max_cache_mb=grib_cache_max_mb)
+        else:
+            delete_step_files(step_files)
+    return df_comb_csv
+
+
+# ****************** Lazy (dask backed) day processing
+# NOTE: with lazy=True, the steps of a day are opened as dask arrays instead of being decoded
+#       to a dataframe each; the crop, the kelvin to celcius conversion and the reshape to the
+#       day layout are applied lazily, then computed one GRIB2 message at a time into a disk
+#       backed array (.npy memmap) in the spill folder. Publish reads the day back as tiles of
+#       rows sized by the memory budget, so memory stays flat however many days are processed.
+#       A GRIB2 message is always decoded whole, so the decode is tiled in time (one step at a
+#       time) and the output in space (tiles of grid rows).
+LAZY_DAY_FILE_PREFIX = "lazy_day_"
+# rough peak memory per row of a tile while it is built and written out as csv
+LAZY_TILE_BYTES_PER_ROW = 400
+LAZY_TILE_BYTES_PER_HOUR = 150
+
+
+def get_lazy_tile_rows(memory_budget_mb=0, n_hours=0):
+    # rows per output tile of a lazy day, as many as the memory budget allows
+    if memory_budget_mb <= 0:
+        return CSV_CHUNK_ROWS
+    bytes_per_row = LAZY_TILE_BYTES_PER_ROW + LAZY_TILE_BYTES_PER_HOUR * n_hours
+    return max(1, int(memory_budget_mb * 1024 * 1024 // bytes_per_row))
+
+
+def is_lazy_day(day=None):
+    # a lazy day is a dict (see decode_day_lazily), else it is the combined day dataframe
+    return isinstance(day, dict)
+
+
+def get_day_row_count(day=None):
+    if is_lazy_day(day):
+        n_vars, _, n_points = day["values"].shape
+        return n_vars * n_points
+    return len(day)
+
+
+def release_lazy_day(day=None):
+    # removes the disk backed array of a lazy day; no-op for a dataframe
+    if not is_lazy_day(day):
+        return
+    day.pop("values", None)
+    values_file = day.get("values_file", "")
+    if values_file and os.path.exists(values_file):
+        os.remove(values_file)
+
+
+def decode_day_lazily(cnt=0, chunk=[], step_files={}, filter_levels=[], level=2, yaml_file="",
+                      memory_budget=0, spill_dir="", stream_to_use="oper", k2cvalue=273.15,
+                      grib_cache_dir="", grib_cache_max_mb=0, region_index_file=""):
+    """
+    Decodes the step files of one day, through dask, into a disk backed array in spill_dir.
+
+    The values are the same as those of decode_and_combine_chunk, row for row.
+
+    Returns:
+        dict: the lazy day {"values": memmap of (forecast var, forecast hour, grid point), "values_file",
+              "lats", "lons", "time", "hour_cols", "stream_to_use", "tile_rows"}; see iter_lazy_day_frames.
+    """
+    # NOTE: imported here, as dask is only needed for the lazy mode
+    import dask.array as da
+
+    lazy_day = None
+    try:
+        missing_steps = [step_hour for step_hour in chunk if step_hour not in step_files]
+        if missing_steps:
+            raise ValueError(f"No step files for day {cnt+1}, steps: {missing_steps}")
+        min_max_coords = get_region_box(yaml_file=yaml_file)
+        if not min_max_coords:
+            raise ValueError(f"No lat/lon box could be read from {yaml_file}")
+
+        # the task graph: per forecast var, one flat lat-major array per step
+        step_arrays = {var: [] for var in DAY_FORECAST_VARS}
+        lats, lons, day_time = None, None, None
+        for step_hour in chunk:
+            level_datasets = load_grib2_levels_to_datasets(file_path=step_files[step_hour],
+                                                           filter_levels=filter_levels, level=level,
+                                                           min_max_coords=min_max_coords,
+                                                           region_index_file=region_index_file, chunks={})
+            check_level_grids_aligned(level_datasets=level_datasets)
+            ds_hag, ds_sfc = level_datasets["heightAboveGround"], level_datasets["surface"]
+            if lats is None:
+                lats, lons, day_time = ds_hag["latitude"].values, ds_hag["longitude"].values, ds_hag["time"].values
+            elif not (np.array_equal(lats, ds_hag["latitude"].values) and np.array_equal(lons, ds_hag["longitude"].values)):
+                raise ValueError(f"Grid mismatch between the steps of day {cnt+1}, at step {step_hour}")
+            n_points = lats.size * lons.size
+            # in float64, the same as load_combine_filter_ecmwf_grib_data
+            t2m_cel = ds_hag["t2m"].transpose("latitude", "longitude").data.astype("float64") - k2cvalue
+            step_arrays["t2m_cel"].append(t2m_cel.reshape(-1).map_blocks(widen_float_as_written, dtype=np.float64))
+            step_arrays["surface"].append(da.full(n_points, ds_sfc["surface"].values, chunks=n_points)
+                                          .map_blocks(widen_float_as_written, dtype=np.float64))
+            step_arrays["tp"].append(ds_sfc["tp"].transpose("latitude", "longitude").data.reshape(-1)
+                                     .map_blocks(widen_float_as_written, dtype=np.float64))
+
+        os.makedirs(spill_dir, exist_ok=True, mode=0o777)
+        fd, values_file = tempfile.mkstemp(prefix=f"{LAZY_DAY_FILE_PREFIX}{cnt+1}_", suffix=".npy", dir=spill_dir)
+        os.close(fd)
+        lazy_day = {"values_file": values_file, "lats": widen_float_as_written(lats),
+                    "lons": widen_float_as_written(lons), "time": day_time,
+                    "hour_cols": [f"{t}h" for t in chunk], "stream_to_use": stream_to_use,
+                    "tile_rows": get_lazy_tile_rows(memory_budget_mb=memory_budget, n_hours=len(chunk))}
+        values = np.lib.format.open_memmap(values_file, mode="w+", dtype=np.float64,
+                                           shape=(len(DAY_FORECAST_VARS), len(chunk), n_points))
+        lazy_day["values"] = values
+        # synchronous, i.e. one message decoded and written out at a time
+        sources = [step_arrays[var][h] for var in DAY_FORECAST_VARS for h in range(len(chunk))]
+        targets = [values[v, h] for v in range(len(DAY_FORECAST_VARS)) for h in range(len(chunk))]
+        da.store(sources, targets, lock=False, scheduler="synchronous")
+        values.flush()
+        print(f"Day {cnt+1}: {get_day_row_count(lazy_day)} rows decoded lazily to: {values_file}")
+        logging.info(f"Day {cnt+1}: {get_day_row_count(lazy_day)} rows decoded lazily to: {values_file}")
+    except Exception:
+        release_lazy_day(lazy_day)
+        raise
+    finally:
+        # NOTE: cached grib2 files (and their .idx) are kept, just no longer pinned
+        if grib_cache_dir:
+            unpin_grib_cache_files(cache_dir=grib_cache_dir, file_paths=step_files.values(),
+                                   max_cache_mb=grib_cache_max_mb)
+        else:
+            delete_step_files(step_files)
+    return lazy_day
+
+
+def iter_lazy_day_frames(lazy_day={}, min_max_coords=None):
+    """
+    Yields the rows of a lazy day as dataframes of at most tile_rows rows, in the row order and
+    with the columns of the combined day dataframe; with min_max_coords, only the rows in that box.
+    """
+    values = lazy_day["values"]
+    lats, lons = lazy_day["lats"], lazy_day["lons"]
+    n_points = values.shape[2]
+    for var_idx, var in enumerate(DAY_FORECAST_VARS):
+        for start in range(0, n_points, lazy_day["tile_rows"]):
+            points = np.arange(start, min(start + lazy_day["tile_rows"], n_points))
+            tile_lats, tile_lons = lats[points // len(lons)], lons[points % len(lons)]
+            keep = slice(None) if min_max_coords is None else get_region_mask(lats=tile_lats, lons=tile_lons,
+                                                                            box=min_max_coords)
+            tile_values = values[var_idx, :, points[0]:points[-1] + 1]
+            common_values = {"latitude": tile_lats[keep], "longitude": tile_lons[keep],
+                             "time": np.full(len(points), lazy_day["time"])[keep]}
+            hour_values = {hour_key: {var: np.asarray(tile_values[h])[keep]}
+                           for h, hour_key in enumerate(lazy_day["hour_cols"])}
+            yield build_day_frame(common_values=common_values, hour_values=hour_values, forecast_vars=[var],
+                                  stream_to_use=lazy_day["stream_to_use"])
+
+
+def get_region_day_frames(day=None, regions=[]):
+    """
+    Splits one day, the combined day dataframe or a lazy day, up per region.
+
+    Returns:
+        list: (region name, function returning the frames of the region); a single unnamed region is the whole day.
+    """
+    if not is_lazy_day(day):
+        return [(region_name, lambda df_region=df_region: [df_region])
+                for region_name, df_region in get_region_dataframes(df=day, regions=regions)]
+    if not has_named_regions(regions):
+        return [("", lambda: iter_lazy_day_frames(lazy_day=day))]
+    return [(region["name"], lambda box=region["min_max_coords"]: iter_lazy_day_frames(lazy_day=day, min_max_coords=box))
+            for region in regions]
+
+
+def extract_points_from_lazy_day(lazy_day={}, places=[], method="bilinear", point_tables={}):
+    # the forecast_date, param, param_tag of each block as in the day frame, from a frame of one grid point
+    block_df = build_day_frame(common_values={"latitude": lazy_day["lats"][:1], "longitude": lazy_day["lons"][:1],
+                                              "time": np.full(1, lazy_day["time"])},
+                               stream_to_use=lazy_day["stream_to_use"])
+    return extract_points_from_grid_values(values=lazy_day["values"], grid_lats=lazy_day["lats"],
+                                           grid_lons=lazy_day["lons"], block_df=block_df,
+                                           hour_cols=lazy_day["hour_cols"], places=places, method=method,
+                                           point_tables=point_tables)
+
+
+# ****************** Output formats
+# NOTE: the layout (OUTPUT_FORMATS, OUTPUT_PARTITION_COLS, get_output_partitioning) is shared
+#       with the reader, in ecmwf_data_reader_scripts.py
+OUTPUT_FORMAT_CONTENT_TYPES = {"csv": "text/csv",
+                               "parquet": "application/vnd.apache.parquet",
+                               "arrow": "application/vnd.apache.arrow.file"}
+OUTPUT_COMPRESSION = "zstd"
+# rows are lat-major, so a row group covers a band of latitudes and its min/max statistics
+# let readers skip row groups outside their box
+PARQUET_ROW_GROUP_SIZE = 65536
+
+
+def get_output_arrow_schema(df=None):
+    """
+    Typed schema of the combined one day dataframe, less the partition columns.
+
+    i.e. longitude, latitude, param_tag (dictionary encoded) and one float64 column per forecast hour.
+    """
+    fields = [pa.field("longitude", pa.float64(), nullable=False),
+              pa.field("latitude", pa.float64(), nullable=False),
+              pa.field("param_tag", pa.dictionary(pa.int8(), pa.string()), nullable=False)]
+    fields += [pa.field(col, pa.float64()) for col in df.columns
+               if col not in OUTPUT_PARTITION_COLS + ["longitude", "latitude", "param_tag"]]
+    return pa.schema(fields)
+
+
+def serialize_day_frames(get_frames=None, output_format="csv", file_stem=""):
+    """
+    Serializes one day to the output format, the day given as a function returning its frames
+    i.e. the combined one day dataframe, or the tiles of a lazy day.
+
+    csv is serialized lazily in row chunks, each time the chunks are asked for, so it can be
+    streamed to a file or an s3 multipart upload; the (compressed) partition files are
+    serialized up front, frame by frame.
+
+    Returns:
+        list: (relative file path, function returning the file content as byte chunks) per output file.
+    """
+    match output_format:
+        case "csv":
+            return [(f"{file_stem}.csv", lambda: iter_frames_csv_chunks(get_frames()))]
+        case "parquet" | "arrow":
+            schema = None
+            # (forecast_date, param) -> (buffer, open writer, tables not yet written)
+            partition_writers = {}
+
+            def write_tables(writer, tables, full_groups_only=False):
+                # small frames (tiles) are gathered up to full row groups / record batches
+                table = pa.concat_tables(tables)
+                n_rows = table.num_rows - table.num_rows % PARQUET_ROW_GROUP_SIZE if full_groups_only else table.num_rows
+                if n_rows == 0:
+                    return tables
+                if output_format == "parquet":
+                    writer.write_table(table.slice(0, n_rows), row_group_size=PARQUET_ROW_GROUP_SIZE)
+                else:
+                    writer.write_table(table.slice(0, n_rows).combine_chunks())
+                return [table.slice(n_rows)] if n_rows < table.num_rows else []
+
+            for frame in get_frames():
+                schema = schema or get_output_arrow_schema(frame)
+                for (forecast_date, param), part_df in frame.groupby(OUTPUT_PARTITION_COLS, sort=True, observed=True):
+                    table = pa.Table.from_pandas(part_df[schema.names], schema=schema, preserve_index=False)
+                    if (forecast_date, param) not in partition_writers:
+                        buf = pa.BufferOutputStream()
+                        if output_format == "parquet":
+                            writer = pq.ParquetWriter(buf, table.schema, compression=OUTPUT_COMPRESSION,
+                                                      write_statistics=True)
+                        else:
+                            writer = pa.ipc.new_file(buf, schema,
+                                                     options=pa.ipc.IpcWriteOptions(compression=OUTPUT_COMPRESSION))
+                        partition_writers[(forecast_date, param)] = (buf, writer, [])
+                    buf, writer, tables = partition_writers[(forecast_date, param)]
+                    tables.append(table)
+                    if sum(table.num_rows for table in tables) >= PARQUET_ROW_GROUP_SIZE:
+                        partition_writers[(forecast_date, param)] = (buf, writer, write_tables(writer, tables, full_groups_only=True))
+
+            output_files = []
+            for (forecast_date, param), (buf, writer, tables) in sorted(partition_writers.items(), key=lambda item: item[0]):
+                if tables:
+                    write_tables(writer, tables)
+                writer.close()
+                partition_dir = f"forecast_date={pd.Timestamp(forecast_date).strftime('%Y-%m-%d')}/param={param}"
+                body = buf.getvalue().to_pybytes()
+                output_files.append((f"{partition_dir}/{file_stem}.{output_format}", lambda body=body: [body]))
+            return output_files
+        case _:
+            raise ValueError(f"Unknown output format: {output_format}, expected one of {OUTPUT_FORMATS}")
+
+
+def serialize_day_dataframe(df=None, output_format="csv", file_stem=""):
+    # the combined one day dataframe as a single frame, see serialize_day_frames
+    return serialize_day_frames(get_frames=lambda: [df], output_format=output_format, file_stem=file_stem)
+
+
+def publish_chunk(cnt=0, chunk=[], df_comb_csv=None, start_date=None, stream_to_use="oper",
+                  push_destination="", push_data_path="", prepped_dir="", known_md5s={},
+                  output_format="csv", places=[], point_method="bilinear", point_tables={}, regions=[]):
+    """
+    Saves or uploads the combined dataframe (or the lazy day, see decode_day_lazily) of one day,
+    in the output format.
+
+    With named regions, the day is split up and each region is saved under {name}/.
+    With places, the per place time series of the day are saved alongside, as a small csv
+    under places/. On s3 an upload is skipped when known_md5s shows the stored object already
+    has the same content.
+
+    Returns:
+        list: published entries {"key", "md5", "size", "uploaded", "status"}, for the manifest.
+    """
+    published = []
+
+    # save the combined dataframe, as one csv file or the partition files
+    file_stem = get_day_file_stem(cnt=cnt, chunk=chunk, start_date=start_date, stream_to_use=stream_to_use)
+    print(f"Save file name for day {cnt+1}: {file_stem}.{output_format}")
+    output_files = []
+    for region_name, get_frames in get_region_day_frames(day=df_comb_csv, regions=regions):
+        region_dir = f"{region_name}/" if region_name else ""
+        output_files += [(f"{region_dir}{save_file}", get_chunks) for save_file, get_chunks in
+                         serialize_day_frames(get_frames=get_frames, output_format=output_format, file_stem=file_stem)]
+    if places:
+        if is_lazy_day(df_comb_csv):
+            df_places = extract_points_from_lazy_day(lazy_day=df_comb_csv, places=places, method=point_method,
+                                                     point_tables=point_tables)
+        else:
+            df_places = extract_points_from_day_dataframe(df=df_comb_csv, places=places, method=point_method,
+                                                          point_tables=point_tables)
+        places_stem = file_stem.replace("ecmwf_data_", "ecmwf_places_", 1)
+        print(f"Save file name for the places of day {cnt+1}: places/{places_stem}.csv ({len(df_places)} rows)")
+        output_files.append((f"places/{places_stem}.csv", lambda: iter_dataframe_csv_chunks(df_places)))
+    match push_destination: 
+        case "local":
+            # sample: cmb_file = f"{prepped_dir}/ecmwf_data_{start_date.strftime('%Y%m%d')}000000_{curr_cmb_hrs}h_scda_fc.csv"
+            for save_file, get_chunks in output_files:
+                cmb_file = f"{prepped_dir}/{save_file}"
+                os.makedirs(os.path.dirname(cmb_file), exist_ok=True, mode=0o777)
+                file_md5 = hashlib.md5()
+                with open(cmb_file, 'wb') as f:
+                    for body in get_chunks():
+                        f.write(body)
+                        file_md5.update(body)
+                published.append({"key": cmb_file, "md5": file_md5.hexdigest(), "size": os.path.getsize(cmb_file),
+                                  "uploaded": True, "status": True})
+            print(f"✅Saved for day {cnt+1}, the completely processed/prepped grib2 data as {len(output_files)} files in: {prepped_dir}\n")
+        case "s3":
+            # save as files on AWS s3
+            print(f"Saving data on s3 as {len(output_files)} files for day {cnt+1}")
+            logging.info(f"Saving data on s3 as {len(output_files)} files for day {cnt+1}")
+            # get s3 client details
+            s3c, bucket_name = get_s3_client()
+            
+            for save_file, get_chunks in output_files:
+                key = f"{push_data_path}/{save_file}"
+                # streamed as a multipart upload, when larger than a part
+                upload_result = upload_chunks_if_changed(get_chunks=get_chunks, bucket=bucket_name, key=key,
+                                                         s3_client=s3c, known_md5s=known_md5s,
+                                                         content_type=OUTPUT_FORMAT_CONTENT_TYPES[save_file.rsplit(".", 1)[-1]])
+                if upload_result["status"]:
+                    state = "uploaded" if upload_result["uploaded"] else "unchanged, not re-uploaded"
+                    logging.info(f"✅Push to s3 - the completely processed/prepped grib2 file {save_file} for day {cnt+1} succeeded ({state}).")
+                else:
+                    logging.warning(f"❌Push to s3 - the completely processed/prepped grib2 file {save_file} for day {cnt+1} failed.")
+                published.append(upload_result)
+    return published
+
+
+PIPELINE_DONE = None
+
+def put_unless_stopped(stage_queue, item, stop_event):
+    # blocks while the queue is full (back-pressure), but gives up once the pipeline is stopped
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def get_unless_stopped(stage_queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            return stage_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return PIPELINE_DONE
+
+
+def run_chunks_pipelined(chunks=[], download_fn=None, decode_fn=None, publish_fn=None, queue_size=1,
+                         max_parallel_publishes=1, day_indices=[]):
+    """
+    Runs the day chunks through download -> decode -> publish, as stages joined by bounded queues.
+
+    The downloader and decoder each run in their own thread and the publisher in the calling
+    thread, so day N+1 downloads while day N decodes and day N-1 uploads. With queue_size=1 at
+    most three days of grib2 files are on disk at any time: one downloading, one waiting and one
+    being decoded. The publisher hands the days to a pool of max_parallel_publishes threads, so
+    that many days upload at the same time; it takes the next day off the queue only once a
+    thread is free. A failing stage stops the stages upstream of it, while the days already
+    handed downstream still get published, the same as when the days ran one after the other.
+
+    Args:
+        download_fn: (cnt, chunk) -> step files.
+        decode_fn: (cnt, chunk, step files) -> combined dataframe.
+        publish_fn: (cnt, chunk, combined dataframe) -> published entries.
+        day_indices: the day index (cnt) of each chunk, when only some of the days are run; by default 0, 1, ...
+
+    Returns:
+        tuple: (published entries in chunk order, (stage label, exception) of the first failure or None)
+    """
+    decode_queue = queue.Queue(maxsize=queue_size)
+    publish_queue = queue.Queue(maxsize=queue_size)
+    stop_downloads = threading.Event()
+    stop_decodes = threading.Event()
+    failures = []
+    published = []
+
+    def fail(stage_label, ex, stop_events=[]):
+        logging.error(f"Error with exception: {ex} at stage: {stage_label}")
+        failures.append((stage_label, ex))
+        for stop_event in stop_events:
+            stop_event.set()
+
+    def downloader():
+        cnt = 0
+        try:
+            for cnt, chunk in zip(day_indices or range(len(chunks)), chunks):
+                if stop_downloads.is_set():
+                    return
+                logging.info(f"\nDownload process for Day {cnt+1}, chunk: {chunk}...")
+                step_files = download_fn(cnt, chunk)
+                if not put_unless_stopped(decode_queue, (cnt, chunk, step_files), stop_downloads):
+                    return
+        except Exception as ex:
+            fail(f" download {cnt+1} ", ex)
+        put_unless_stopped(decode_queue, PIPELINE_DONE, stop_downloads)
+
+    def decoder():
+        cnt = 0
+        try:
+            while True:
+                item = get_unless_stopped(decode_queue, stop_decodes)
+                if item is PIPELINE_DONE:
+                    break
+                cnt, chunk, step_files = item
+                logging.info(f"\nDecode process for Day {cnt+1}, chunk: {chunk}...")
+                df_comb_csv = decode_fn(cnt, chunk, step_files)
+                if not put_unless_stopped(publish_queue, (cnt, chunk, df_comb_csv), stop_decodes):
+                    return
+        except Exception as ex:
+            fail(f" decode {cnt+1} ", ex, stop_events=[stop_downloads])
+        put_unless_stopped(publish_queue, PIPELINE_DONE, stop_decodes)
+
+    stage_threads = [threading.Thread(target=downloader, name="ecmwf_downloader", daemon=True),
+                     threading.Thread(target=decoder, name="ecmwf_decoder", daemon=True)]
+    for stage_thread in stage_threads:
+        stage_thread.start()
+
+    publish_slots = threading.BoundedSemaphore(max_parallel_publishes)
+    publish_failed = threading.Event()
+    publish_futures = []
+
+    def publish_done(future):
+        if future.exception() is not None:
+            publish_failed.set()
+        publish_slots.release()
+
+    cnt = 0
+    with ThreadPoolExecutor(max_workers=max_parallel_publishes, thread_name_prefix="ecmwf_publisher") as publish_executor:
+        try:
+            while True:
+                # blocks while max_parallel_publishes days are publishing (back-pressure)
+                publish_slots.acquire()
+                item = get_unless_stopped(publish_queue, publish_failed)
+                if item is PIPELINE_DONE:
+                    break
+                cnt, chunk, df_comb_csv = item
+                logging.info(f"\nPublish process for Day {cnt+1}, chunk: {chunk}...")
+                publish_future = publish_executor.submit(publish_fn, cnt, chunk, df_comb_csv)
+                publish_futures.append((cnt, publish_future))
+                publish_future.add_done_callback(publish_done)
+        except Exception as ex:
+            fail(f" publish {cnt+1} ", ex, stop_events=[stop_downloads, stop_decodes])
+        if publish_failed.is_set():
+            stop_downloads.set()
+            stop_decodes.set()
+    # the pool is shut down (waited on) here, so all the publishes are done
+    for cnt, publish_future in publish_futures:
+        if publish_future.exception() is not None:
+            fail(f" publish {cnt+1} ", publish_future.exception(), stop_events=[stop_downloads, stop_decodes])
+        else:
+            published.append(publish_future.result())
+
+    for stage_thread in stage_threads:
+        stage_thread.join()
+    # report the earliest day that failed
+    failures.sort(key=lambda failure: int(failure[0].split()[-1]))
+    return published, (failures[0] if failures else None)
+
+
+def download_day_stage(cnt, chunk, run_state={}, current_date=None, stream_to_use="oper", download_dir="",
+                       max_parallel_downloads=4, params=[], levtypes=[], grib_cache_dir="", grib_cache_max_mb=0,
+                       record_unit=None):
+    """
+    Download stage of the pipeline: the grib2 step files of the day chunk.
+
+    In a resumed run, nothing is downloaded for a day already combined, nor for the steps decoded.
+
+    Returns:
+        dict: step hour -> grib2 file
+    """
+    with measure_stage("download", day=cnt+1):
+        if get_done_unit_file(run_state=run_state, unit=f"combine/{cnt+1}"):
+            return {}
+        download_steps = [step_hour for step_hour in chunk
+                          if not get_done_unit_file(run_state=run_state, unit=f"decode/{step_hour}")]
+        return download_ecmwf_step_files(current_date=current_date, step_hours=download_steps,
+                                         stream_to_use=stream_to_use, download_dir=download_dir,
+                                         max_parallel_downloads=max_parallel_downloads,
+                                         params=params, levtypes=levtypes,
+                                         grib_cache_dir=grib_cache_dir,
+                                         grib_cache_max_mb=grib_cache_max_mb,
+                                         record_unit=record_unit)
+
+
+def decode_day_stage(cnt, chunk, step_files, run_state={}, start_date=None, stream_to_use="oper",
+                     filter_levels=[], level=2, yaml_file="", memory_budget=0, spill_dir="",
+                     decode_executor=None, grib_cache_dir="", grib_cache_max_mb=0, region_index_file="",
+                     lazy=False, checkpoint=False, checkpoint_dir="", checkpoint_stem="",
+                     profile_decode=False, record_unit=None):
+    """
+    Decode stage of the pipeline: the step files of the day chunk, combined into the day dataframe.
+
+    A day combined by the run being resumed is read back from its checkpoint, and so are the steps
+    it decoded; with lazy, the day is a disk backed day (not checkpointed).
+    The day is journaled as combine/{day} done or failed, a failure is raised.
+
+    Returns:
+        pd.DataFrame (or a lazy day): the combined day
+    """
+    with measure_stage("decode", day=cnt+1), profile_stage("decode", enabled=profile_decode):
+        combine_file = get_done_unit_file(run_state=run_state, unit=f"combine/{cnt+1}")
+        try:
+            if combine_file:
+                # combined by the run being resumed
+                logging.info(f"Day {cnt+1} read back from its checkpoint: {combine_file}")
+                df_comb_csv = pd.read_parquet(combine_file)
+            elif lazy:
+                # a disk backed day, published in tiles sized by the memory budget
+                # NOTE: not checkpointed, a resumed run decodes the day again
+                df_comb_csv = decode_day_lazily(cnt=cnt, chunk=chunk, step_files=step_files,
+                                                filter_levels=filter_levels, level=level,
+                                                yaml_file=yaml_file, memory_budget=memory_budget,
+                                                spill_dir=spill_dir, stream_to_use=stream_to_use,
+                                                grib_cache_dir=grib_cache_dir,
+                                                grib_cache_max_mb=grib_cache_max_mb,
+                                                region_index_file=region_index_file)
+                if record_unit is not None:
+                    record_unit(f"combine/{cnt+1}", "done")
+            else:
+                # the steps decoded by the run being resumed are read back, the rest decoded
+                checkpoint_frames = {step_hour: get_done_unit_file(run_state=run_state, unit=f"decode/{step_hour}")
+                                     for step_hour in chunk if step_hour not in step_files}
+                df_comb_csv = decode_and_combine_chunk(cnt=cnt, chunk=chunk, step_files=step_files,
+                                                       filter_levels=filter_levels, level=level,
+                                                       yaml_file=yaml_file, memory_budget=memory_budget,
+                                                       spill_dir=spill_dir, stream_to_use=stream_to_use,
+                                                       decode_executor=decode_executor,
+                                                       grib_cache_dir=grib_cache_dir,
+                                                       grib_cache_max_mb=grib_cache_max_mb,
+                                                       region_index_file=region_index_file,
+                                                       checkpoint_frames=checkpoint_frames,
+                                                       checkpoint_dir=checkpoint_dir if checkpoint else "",
+                                                       checkpoint_stem=checkpoint_stem,
+                                                       record_unit=record_unit)
+                combine_file = ""
+                if checkpoint:
+                    combine_file = f"{checkpoint_dir}/{get_day_file_stem(cnt=cnt, chunk=chunk, start_date=start_date, stream_to_use=stream_to_use)}.parquet"
+                    df_comb_csv.to_parquet(combine_file, index=False)
+                if record_unit is not None:
+                    record_unit(f"combine/{cnt+1}", "done", unit_file=combine_file)
+                # the day checkpoint stands in for the step frames of the day from here on
+                for step_hour in chunk:
+                    step_frame_file = get_done_unit_file(run_state=run_state, unit=f"decode/{step_hour}")
+                    if step_frame_file:
+                        os.remove(step_frame_file)
+        except Exception as ex:
+            if record_unit is not None:
+                record_unit(f"combine/{cnt+1}", "failed", error=str(ex))
+            raise
+    add_run_metric("rows_decoded", get_day_row_count(df_comb_csv))
+    return df_comb_csv
+
+
+def publish_day_stage(cnt, chunk, df_comb_csv, run_state={}, start_date=None, stream_to_use="oper",
+                      push_destination="", push_data_path="", prepped_dir="", known_md5s={},
+                      output_format="csv", places=[], point_method="bilinear", point_tables={}, regions=[],
+                      record_unit=None):
+    """
+    Publish stage of the pipeline: the combined day, uploaded to s3 or saved locally.
+
+    The day is recorded as published in the run state only when all its files are; its day
+    checkpoint is then removed. A failure is journaled as publish/{day} failed and raised.
+
+    Returns:
+        list: the published entries of the day, see publish_chunk
+    """
+    with measure_stage("publish", day=cnt+1):
+        try:
+            entries = publish_chunk(cnt=cnt, chunk=chunk, df_comb_csv=df_comb_csv,
+                                    start_date=start_date, stream_to_use=stream_to_use,
+                                    push_destination=push_destination,
+                                    push_data_path=push_data_path, prepped_dir=prepped_dir,
+                                    known_md5s=known_md5s, output_format=output_format,
+                                    places=places, point_method=point_method,
+                                    point_tables=point_tables, regions=regions)
+        except Exception as ex:
+            if record_unit is not None:
+                record_unit(f"publish/{cnt+1}", "failed", error=str(ex))
+            raise
+        finally:
+            release_lazy_day(df_comb_csv)
+    if all(entry["status"] for entry in entries):
+        record_day_published(run_state=run_state, cnt=cnt, chunk=chunk, entries=entries)
+        if record_unit is not None:
+            record_unit(f"publish/{cnt+1}", "done")
+        # the day is out, its checkpoint is no longer needed
+        combine_file = get_done_unit_file(run_state=run_state, unit=f"combine/{cnt+1}")
+        if combine_file:
+            os.remove(combine_file)
+    else:
+        if record_unit is not None:
+            record_unit(f"publish/{cnt+1}", "failed",
+                        error=f"Not published: {[entry['key'] for entry in entries if not entry['status']]}")
+    # uploaded to s3, or saved locally; unchanged files are skipped on s3
+    uploaded = [entry for entry in entries if entry["uploaded"]]
+    add_run_metric("files_uploaded", len(uploaded))
+    add_run_metric("bytes_uploaded", sum(entry["size"] for entry in uploaded))
+    add_run_metric("files_unchanged", len(entries) - len(uploaded))
+    return entries
+
 
 def download_and_process_ecmwf_data(download_path="", prepped_path="", prepped_suffix="",
                                     filter_levels=[], level=2,                                    
                                     number_of_days=5, step_size=6, 
                                     push_destination="", push_data_path="",
-                                    yaml_file=""):
+                                    yaml_file="", max_parallel_downloads=4, memory_budget=0,
+                                    decode_workers=1, grib_cache_dir="", grib_cache_max_mb=0,
+                                    remove_stale_s3_files=False, output_format="csv", profile_decode=False,
+                                    lazy=False, run_state_file="", incremental=False, resume=False,
+                                    checkpoint_dir="", checkpoint=False):
     step = ""
     dp_status = False
     bucket_name = ""
+    decode_executor = None
+    spill_dir = ""
+    run_state = {}
+    state_s3_client = None
     
     try:
         root_temp_dir = os.getenv('TEMP_DIR', '/tmp')
         os.makedirs(root_temp_dir, exist_ok=True, mode=0o777)
 
-        # get ecmwf client
-        client = get_ecmwf_client()
-
         # param set up
         step = " initial param set up "
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}, expected one of {OUTPUT_FORMATS}")
+        # a filter level the yaml has no columns for would fail the decode of every step
+        get_level_combine_cols(yaml_file=yaml_file, filter_levels=filter_levels)
                 
-        # 09/23/2025 - changed to 0th hour UTC current date + 6 hours to account for Bhutan
-        start_date, start_date_fmtd = get_formatted_utc_current_date()
-        print(f"ECMWF Data Refresh -- Start date: {start_date}, formatted Start date: {start_date_fmtd}")
-        logging.info(f"ECMWF Data Refresh -- Start date: {start_date}, formatted Start date: {start_date_fmtd}")
-
         step = " fhours "
         start_hour = step_size
-        current_date = start_date
         # hours_per_day = 24
         step_hours = get_forecast_hours_for_total_days(num_days=number_of_days, 
                                                        step_size=step_size, start=start_hour)
 
-        # loop
-        cnt = 0        
-        chunk_step_size = 24 // step_size  # 24 // 6 = 4
+        # the run state (and checkpoint journal) of the previous run, from s3 when pushing there
+        step = " run state load "
+        run_state_file = run_state_file or f"{root_temp_dir}/{RUN_STATE_FILE_NAME}"
+        if push_destination == "s3":
+            state_s3_client, bucket_name = get_s3_client()
+        saved_run_state = load_run_state(state_file=run_state_file, bucket=bucket_name,
+                                         object_prefix=f"{push_data_path}/", s3_client=state_s3_client)
+
+        # 09/23/2025 - changed to 0th hour UTC current date + 6 hours to account for Bhutan
+        step = " run date "
+        if resume and get_run_date(saved_run_state) is not None:
+            # carry on with the run of the journal, even if a newer one is out by now
+            start_date = get_run_date(saved_run_state)
+            start_date_fmtd = start_date.strftime('%Y-%m-%d %H:%M:%S')
+        elif incremental:
+            # the latest 00 UTC run published through the last step, today's once it is out
+            start_date = get_latest_run_date(step_hour=step_hours[-1], stream_to_use="oper")
+            start_date_fmtd = start_date.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            start_date, start_date_fmtd = get_formatted_utc_current_date()
+        print(f"ECMWF Data Refresh -- Start date: {start_date}, formatted Start date: {start_date_fmtd}")
+        logging.info(f"ECMWF Data Refresh -- Start date: {start_date}, formatted Start date: {start_date_fmtd}")
+
+        # only the params the processing needs, as per pre_combine_cols
+        download_params, download_levtypes = get_download_params(yaml_file=yaml_file, filter_levels=filter_levels)
+        print(f"Download params: {download_params}, levtypes: {download_levtypes}")
+        logging.info(f"Download params: {download_params}, levtypes: {download_levtypes}")
+
+        current_date = start_date
+
         # get the 4 chunked bins
-        chunks = [step_hours[i:i + chunk_step_size] for i in range(0, len(step_hours), chunk_step_size)]
-        step = " main processing loop(days) "
-        uploaded_file_list = []
+        chunks = get_day_chunks(step_hours=step_hours, step_size=step_size)
         stream_to_use = "oper"
-        for chunk in chunks:
-            print(f"Processing chunk: {chunk}")
-            logging.info(f"Processing chunk: {chunk}")
-            # loop through for each day
-            step = f" download {cnt+1} - chunk {chunk} "
-            logging.info(f"\nDownload process for Day {cnt+1}...")
-            if push_destination == "local":
-                download_dir = download_path
-            else:
-                download_dir = f"{root_temp_dir}/{download_path}"
-            os.makedirs(download_dir, exist_ok=True, mode=0o777)
-            for i in range(len(chunk)):
-                step_hour = chunk[i]
-                print(f"step_hour: {step_hour}")
-                # set target filename 
-                # NOTE: FYI, here we are closely mimicking to the server filename              
-                target_filename = f"{download_dir}/ecmwf_data_{start_date.strftime('%Y%m%d')}000000_{step_hour}h_{stream_to_use}_fc.grib2"
-                if not os.path.exists(target_filename):
-                    client.download(
-                        date=current_date, # UTC starting at 00 hours, so time arg befow can be excluded
-                        # time=0,
-                        step=step_hour,
-                        stream=stream_to_use, # stream=['oper','wave','enfo','waef','scda','scwv'] adjust if needed, 
-                        # but we are allowed to only finite attrs within a level
-                        type="fc", # Forecast data
-                        target=target_filename,
-                    )
-                    logging.info(f"Downloaded data for {current_date} to {target_filename}")
-                else:
-                    logging.info(f"⚠️ Already exists: {target_filename}")
-                        
-            # process (load, combine, save to prepped) before resuming the while loop
-            # load
-            step = f" loadgribtocsv cnt {cnt+1} "
-            # print(f"filter_levels: {filter_levels}")
-            if push_destination == "local":
-                prepped_dir = prepped_path
-            else:
-                prepped_dir = f"{root_temp_dir}/{prepped_path}"
-            os.makedirs(prepped_dir, exist_ok=True, mode=0o777)
-            load_grib2_to_csv(filter_levels=filter_levels, input_dir=download_dir,
-                              prepped_dir=prepped_dir, level=level, yaml_file=yaml_file)
-            
-            # combine period csv s for one day to one common csv
-            step = f" cmbcsv cnt {cnt+1} "
-            df_comb_csv = combine_csvs_for_one_day(prepped_path=prepped_dir, hour_array=chunk, stream_to_use=stream_to_use)
-            print(df_comb_csv.head(2))
-
-            # delete the grib2 and grib2.idx files
-            # NOTE: each time a grib2 file is opened, an index file i.e. idx file gets created,
-            #       so *.grib2.* pattern is needed, as it will delete all grib2 related files.
-            step = f" del gribdate {cnt+1} "
-            del_path = f"{download_dir}/*.grib2*"
-            files_to_del = glob(del_path)
-            for f_del in files_to_del:
-                os.remove(f_del)
 
-            # delete the grib files
-            step = f" del prepdate {cnt+1} "
-            p_del_path = f"{prepped_dir}/{prepped_suffix}/*.csv"
-            p_files_to_del = glob(p_del_path)
-            for f_del in p_files_to_del:
-                os.remove(f_del)
+        step = " folders set up "
+        download_dir, prepped_dir, grib_cache_dir = get_run_dirs(download_path=download_path, prepped_path=prepped_path,
+                                                                 push_destination=push_destination,
+                                                                 grib_cache_dir=grib_cache_dir,
+                                                                 grib_cache_max_mb=grib_cache_max_mb)
+        os.makedirs(download_dir, exist_ok=True, mode=0o777)
+        os.makedirs(prepped_dir, exist_ok=True, mode=0o777)
+        spill_dir = f"{prepped_dir}/{prepped_suffix or 'temp'}"
+
+        # grib cache, disabled with a size cap of 0
+        if grib_cache_dir:
+            os.makedirs(grib_cache_dir, exist_ok=True, mode=0o777)
+            print(f"Grib cache: {grib_cache_dir}, size cap: {grib_cache_max_mb} MB")
+            logging.info(f"Grib cache: {grib_cache_dir}, size cap: {grib_cache_max_mb} MB")
+        # the box slice bounds per grid, kept next to the grib cache so the workflow carries them over
+        region_index_file = f"{grib_cache_dir or root_temp_dir}/{REGION_INDEX_FILE}"
+
+        # the regions, decoded once over the box around them all and split up on publish
+        regions = get_regions(yaml_file=yaml_file)
+        if not regions:
+            raise ValueError(f"No lat/lon box could be read from {yaml_file}")
+        if regions[0]["name"]:
+            print(f"Regions: {[region['name'] for region in regions]}")
+            logging.info(f"Regions: {[region['name'] for region in regions]}")
+
+        # the places for the per place time series, geocoded once and cached in a local file
+        step = " places set up "
+        places_config = load_places_config(yaml_file=yaml_file)
+        with measure_stage("places_setup"):
+            places = geocode_places(places_config=places_config) if places_config else []
+        point_method = places_config.get("method", "bilinear")
+        # the grid index/weight table per place, worked out on the first day and shared by the rest
+        point_tables = {}
+        if places:
+            print(f"Places for the per place time series: {len(places)}, method: {point_method}")
+            logging.info(f"Places for the per place time series: {len(places)}, method: {point_method}")
+
+        # content md5 of what is already on s3, so unchanged files are not uploaded again
+        known_md5s = {}
+        if push_destination == "s3":
+            step = " s3 known files "
+            s3c, bucket_name = get_s3_client()
+            object_prefix = f"{push_data_path}/"
+            with measure_stage("s3_known_files"):
+                known_md5s = get_known_content_md5s(bucket=bucket_name, object_prefix=object_prefix, s3_client=s3c)
+                # parts of uploads from runs killed midway are otherwise kept (and billed) on the bucket
+                abort_stale_multipart_uploads(bucket=bucket_name, object_prefix=object_prefix, s3_client=s3c)
 
-            # save the combined csv-dataframe to a csv file
-            step = f" save cmbcsvdate {cnt+1} "
-            curr_cmb_hrs = "".join([str(t) for t in chunk])
-            save_file =f"ecmwf_data_{start_date.strftime('%Y%m%d')}000000_{curr_cmb_hrs}h_{stream_to_use}_fc_{cnt+1}.csv"     
-            print(f"Save file name for day {cnt+1}: {save_file}")       
-            cmb_file = ""
-            s3c = None
-            s3s = {}
-            match push_destination: 
-                case "local":
-                    # sample: cmb_file = f"{prepped_dir}/ecmwf_data_{start_date.strftime('%Y%m%d')}000000_{curr_cmb_hrs}h_scda_fc.csv"
-                    cmb_file = f"{prepped_dir}/{save_file}"
-                    print(f"✅Saved for day {cnt+1}, the completely processed/prepped grib2-csv file as: {cmb_file}\n")
-                    df_comb_csv.to_csv(cmb_file, index=False)
-                case "s3":
-                    # save dataframe as a csv file on AWS s3
-                    print(f"Saving data on s3 as file: {save_file}")
-                    logging.info(f"Saving data on s3 as file: {save_file}")
-                    # get s3 client details
-                    s3c, bucket_name = get_s3_client()
-                    
-                    key = f"{push_data_path}/{save_file}"
-                    save_status = upload_dataframe_as_csv(df_comb_csv, 
-                                                          bucket=bucket_name, 
-                                                          key=key,
-                                                          s3_client=s3c)
-                    if save_status:
-                        logging.info(f"✅Push to s3 - the completely processed/prepped grib2-csv file{save_file} for day {cnt+1} succeeded.")
-                        uploaded_file_list.append(key)
-                    else:
-                        logging.warning(f"❌Push to s3 - the completely processed/prepped grib2-csv file{save_file} for day {cnt+1} failed.")
-                            
-            # status
+        # the steps of this run already processed, with the same config, see run_state_scripts.py
+        step = " run state "
+        with open(yaml_file, 'rb') as f:
+            yaml_md5 = hashlib.md5(f.read()).hexdigest()
+        config_key = get_run_config_key({"filter_levels": filter_levels, "level": level, "step_size": step_size,
+                                         "output_format": output_format, "push_destination": push_destination,
+                                         "push_data_path": push_data_path, "prepped_dir": prepped_dir,
+                                         "yaml_md5": yaml_md5})
+        run_state = start_run_state(saved_run_state, run_id=get_run_id(run_date=start_date, stream_to_use=stream_to_use),
+                                    config_key=config_key, resume=resume)
+        if resume and run_state["units"]:
+            print(f"Resuming run {start_date_fmtd}, failed units to retry: {get_failed_units(run_state)}")
+            logging.info(f"Resuming run {start_date_fmtd}, failed units to retry: {get_failed_units(run_state)}")
+        day_indices = [cnt for cnt, chunk in enumerate(chunks)
+                       if not ((incremental or resume) and is_day_published(run_state=run_state, cnt=cnt, chunk=chunk,
+                                                                            push_destination=push_destination,
+                                                                            known_md5s=known_md5s))]
+        # days published earlier, left as they are
+        kept_day_numbers = [cnt+1 for cnt in range(len(chunks)) if cnt not in day_indices]
+        if kept_day_numbers:
+            print(f"Days already published for run {start_date_fmtd}, skipped: {kept_day_numbers}")
+            logging.info(f"Days already published for run {start_date_fmtd}, skipped: {kept_day_numbers}")
+        if not day_indices:
+            print(f"Nothing new to process for run {start_date_fmtd}")
+            logging.info(f"Nothing new to process for run {start_date_fmtd}")
             dp_status = True
+            return dp_status
+
+        # the decoded step frames and combined days, kept until the day is published; the
+        # checkpoints not in the journal (of an earlier run, or not resuming) are removed
+        # NOTE: the parquet writes cost a few % of the decode, so only with checkpoint (or resume)
+        step = " checkpoints set up "
+        checkpoint = checkpoint or resume
+        checkpoint_dir = checkpoint_dir or f"{root_temp_dir}/{CHECKPOINT_DIR_NAME}"
+        os.makedirs(checkpoint_dir, exist_ok=True, mode=0o777)
+        journal_files = {run_unit["file"] for run_unit in run_state["units"].values()}
+        for checkpoint_file in glob(f"{glob_escape(checkpoint_dir)}/*.parquet"):
+            if checkpoint_file not in journal_files:
+                os.remove(checkpoint_file)
+        checkpoint_stem = f"step_frame_{start_date.strftime('%Y%m%d%H')}"
+
+        def record_unit(unit, status, unit_file="", error=""):
+            # journaled to the local run state file right away
+            record_run_unit(run_state=run_state, unit=unit, status=status, unit_file=unit_file, error=error,
+                            state_file=run_state_file)
 
-            # update setup bwfore proceeding with next in the while loop...
-            step = " next in while loop "            
-            cnt += 1
+        # process pool for the grib2 decode, None means decode in process
+        step = " decode workers set up "
+        decode_executor = get_decode_executor(decode_workers=decode_workers)
+        if lazy and decode_executor is not None:
+            logging.warning("The lazy decode runs in process, decode_workers is not used")
+        if profile_decode and decode_executor is not None:
+            logging.warning("The decode profile only covers the decode worker processes as far as waiting on them, "
+                            "profile with decode_workers=1 to see the decode itself")
+
+        # download, decode and publish the days as pipelined stages
+        step = " main processing pipeline(days) "
+        # each stage run of a day is measured, see run_metrics_scripts.py
+        download_fn = partial(download_day_stage, run_state=run_state, current_date=current_date,
+                              stream_to_use=stream_to_use, download_dir=download_dir,
+                              max_parallel_downloads=max_parallel_downloads,
+                              params=download_params, levtypes=download_levtypes,
+                              grib_cache_dir=grib_cache_dir, grib_cache_max_mb=grib_cache_max_mb,
+                              record_unit=record_unit)
+        decode_fn = partial(decode_day_stage, run_state=run_state, start_date=start_date,
+                            stream_to_use=stream_to_use, filter_levels=filter_levels, level=level,
+                            yaml_file=yaml_file, memory_budget=memory_budget, spill_dir=spill_dir,
+                            decode_executor=decode_executor, grib_cache_dir=grib_cache_dir,
+                            grib_cache_max_mb=grib_cache_max_mb, region_index_file=region_index_file,
+                            lazy=lazy, checkpoint=checkpoint, checkpoint_dir=checkpoint_dir,
+                            checkpoint_stem=checkpoint_stem, profile_decode=profile_decode,
+                            record_unit=record_unit)
+        publish_fn = partial(publish_day_stage, run_state=run_state, start_date=start_date,
+                             stream_to_use=stream_to_use, push_destination=push_destination,
+                             push_data_path=push_data_path, prepped_dir=prepped_dir,
+                             known_md5s=known_md5s, output_format=output_format, places=places,
+                             point_method=point_method, point_tables=point_tables, regions=regions,
+                             record_unit=record_unit)
+        # the days upload concurrently, as many as the s3 transfer config allows
+        published_lists, failure = run_chunks_pipelined(chunks=[chunks[cnt] for cnt in day_indices],
+                                                        day_indices=day_indices, download_fn=download_fn,
+                                                        decode_fn=decode_fn, publish_fn=publish_fn,
+                                                        max_parallel_publishes=S3_TRANSFER_CONFIG.max_concurrency)
+        published = [entry for entries in published_lists for entry in entries]
+        uploaded_file_list = [entry["key"] for entry in published if entry["status"]]
+        if grib_cache_dir:
+            grib_cache_stats = log_grib_cache_stats(cache_dir=grib_cache_dir)
+            add_run_metric("grib_cache_hits", grib_cache_stats["hits"])
+            add_run_metric("grib_cache_misses", grib_cache_stats["misses"])
+            add_run_metric("grib_cache_hit_bytes", grib_cache_stats["hit_bytes"])
+        # status, a run with a failed stage is not a success even if some days were published
+        dp_status = failure is None and len(uploaded_file_list) > 0
+        if failure is not None:
+            # NOTE: the manifest is not switched, so the prefix keeps serving the previous data;
+            #       the days published so far and the journal are kept for a resumed run
+            step, pipeline_ex = failure
+            raise pipeline_ex
         
         s3_list = []
         if push_destination == "s3":
             logging.info(f"\nSaved csv file list s3 from gitaction code: {','.join(uploaded_file_list)}")
-            s3c, bucket_name = get_s3_client()
-            object_prefix = f"{push_data_path}/"
+            uploaded_cnt = len([entry for entry in published if entry["uploaded"]])
+            logging.info(f"Uploaded {uploaded_cnt} changed files, skipped {len(uploaded_file_list) - uploaded_cnt} unchanged files")
+
+            # switch over to the new set of files, then remove the ones no longer listed
+            step = " s3 manifest switch "
+            if len(uploaded_file_list) != len(published):
+                raise ValueError("Not all the files were pushed to s3, the manifest is left as is")
+            manifest_objects = get_published_day_files(run_state=run_state, day_numbers=kept_day_numbers)
+            manifest_objects.update({entry["key"]: {"md5": entry["md5"], "size": entry["size"]} for entry in published})
+            with measure_stage("s3_manifest_switch"):
+                if not save_s3_manifest(objects=manifest_objects, bucket=bucket_name, object_prefix=object_prefix,
+                                        s3_client=s3c):
+                    raise ValueError("Unable to save the s3 manifest")
+            if remove_stale_s3_files:
+                step = " s3 remove stale files "
+                with measure_stage("s3_remove_stale"):
+                    remove_stale_files_on_s3(keep_keys=list(manifest_objects.keys()) + [get_s3_run_state_key(object_prefix)],
+                                             bucket=bucket_name, object_prefix=object_prefix, s3_client=s3c)
+
             s3_list = list_bucket_objects(bucket=bucket_name, s3_client=s3c, object_prefix=object_prefix)
             logging.info(f"\nSaved csv file list from s3 objects: {','.join(s3_list)}")
-            s3c.close()
     except Exception as ex:
         logging.error(f"Error with exception: {ex} at step: {step}")
+    finally:
+        if decode_executor is not None:
+            decode_executor.shutdown(wait=True, cancel_futures=True)
+        if run_state:
+            # the published days and the journal, whether the run failed or not, for the next or a resumed run
+            try:
+                save_run_state(run_state=run_state, state_file=run_state_file, bucket=bucket_name,
+                               object_prefix=f"{push_data_path}/", s3_client=state_s3_client)
+            except Exception as ex:
+                logging.error(f"Error with exception: {ex} at step: run state save ")
+        if lazy and spill_dir:
+            # lazy days decoded but never published, e.g. after a failed stage
+            for values_file in glob(f"{glob_escape(spill_dir)}/{LAZY_DAY_FILE_PREFIX}*.npy"):
+                os.remove(values_file)
     return dp_status
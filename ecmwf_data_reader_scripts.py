@@ -0,0 +1,336 @@
+import os
+import io
+import re
+from glob import glob
+from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset
+import logging
+# ******************************************************************************************
+# Reads the published ECMWF output back into one dataframe, from s3 or a local folder, with
+# only the columns and rows asked for:
+#   - csv is streamed from the object body into the parser in row chunks, each chunk is
+#     filtered before the next is read;
+#   - parquet and arrow files are read through ranged GETs, i.e. only the footer and the
+#     column chunks (parquet: of the row groups whose statistics match the box) are fetched;
+#   - the forecast_date/param partitions are pruned from the key, before any file is read.
+# ******************************************************************************************
+
+# csv is one file per day. parquet and arrow (IPC, feather v2) are hive partitioned per day as
+# forecast_date=<date>/param=<param>/<file>, so readers can prune partitions and read only the
+# columns they need. The partition columns are not repeated inside the files.
+OUTPUT_FORMATS = ["csv", "parquet", "arrow"]
+OUTPUT_PARTITION_COLS = ["forecast_date", "param"]
+OUTPUT_PARTITION_PATTERN = re.compile(r'forecast_date=(\d{4}-\d{2}-\d{2})/param=([^/]+)/')
+READ_CSV_CHUNK_ROWS = 100000
+MAX_PARALLEL_READS = 8
+# each ranged GET reads ahead this much, so the many small reads of the parquet / arrow readers
+# (footer, page headers, column chunks) take a few GETs rather than one each
+S3_READ_BUFFER_SIZE = 8 * 1024 * 1024
+# the end of the object is fetched once, as the readers go back to it (parquet footer, arrow
+# footer and schema, which the arrow reader reads again to pick the columns)
+S3_READ_TAIL_SIZE = 64 * 1024
+
+
+def get_output_partitioning():
+    # use as pyarrow.dataset.dataset(path, format="parquet", partitioning=get_output_partitioning())
+    return pa.dataset.partitioning(pa.schema([("forecast_date", pa.date32()), ("param", pa.string())]),
+                                   flavor="hive")
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over an s3 object, every read is a ranged GET, but for
+    the reads in the last tail_size bytes, which are all served from one.
+
+    Lets the parquet / arrow readers fetch only the byte ranges they need (footer, column chunks)
+    rather than the whole object. Meant to be wrapped in an io.BufferedReader, see open_s3_object.
+    """
+    def __init__(self, bucket="", key="", s3_client=None, size=None, tail_size=S3_READ_TAIL_SIZE):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.position = 0
+        self.bytes_read = 0
+        self.get_count = 0
+        self.tail_start = max(self.size - tail_size, 0)
+        self.tail = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        if self.position >= self.tail_start:
+            if self.tail is None:
+                self.tail = self.get_range(self.tail_start, self.size - self.tail_start)
+            start = self.position - self.tail_start
+            buffer[:length] = self.tail[start:start + length]
+            self.position += length
+            return length
+        body = self.get_range(self.position, length)
+        buffer[:len(body)] = body
+        self.position += len(body)
+        return len(body)
+
+    def get_range(self, start=0, length=0):
+        s3_file = self.s3_client.get_object(Bucket=self.bucket, Key=self.key,
+                                            Range=f"bytes={start}-{start + length - 1}")
+        body = s3_file['Body'].read()
+        self.get_count += 1
+        self.bytes_read += len(body)
+        return body
+
+
+def open_s3_object(bucket="", key="", s3_client=None, buffer_size=S3_READ_BUFFER_SIZE):
+    # a buffered S3RangeReader, returns (file object, range reader) the latter for its counts
+    range_reader = S3RangeReader(bucket=bucket, key=key, s3_client=s3_client)
+    return io.BufferedReader(range_reader, buffer_size=buffer_size), range_reader
+
+
+def get_partition_values(key=""):
+    # e.g. data/forecast_date=2025-09-22/param=precipitation/ecmwf_..._fc_1.parquet -> ("2025-09-22", "precipitation")
+    matched = OUTPUT_PARTITION_PATTERN.search(key)
+    return (matched.group(1), matched.group(2)) if matched else (None, None)
+
+
+def to_date(date_value=None):
+    if date_value is None or isinstance(date_value, date):
+        return date_value
+    return datetime.strptime(str(date_value)[:10], "%Y-%m-%d").date()
+
+
+def is_partition_wanted(key="", forecast_date_range=None, params=None):
+    # prunes a parquet / arrow key on its forecast_date / param partition
+    forecast_date, param = get_partition_values(key)
+    if forecast_date is None:
+        return True
+    if params and param not in params:
+        return False
+    if forecast_date_range:
+        start_date, end_date = (to_date(value) for value in forecast_date_range)
+        if (start_date and to_date(forecast_date) < start_date) or (end_date and to_date(forecast_date) > end_date):
+            return False
+    return True
+
+
+def get_row_filter(bbox=None, forecast_date_range=None, params=None, partition_cols=True):
+    """
+    The row filter as a pyarrow expression, None when there is nothing to filter on.
+
+    bbox is as the coords in gribcfg.yaml in decimal degrees i.e. {"north", "south", "west", "east"}.
+    partition_cols=False leaves out forecast_date/param, for files which do not hold them.
+    """
+    conditions = []
+    field = pa.dataset.field
+    if bbox:
+        conditions += [field("latitude") >= bbox["south"], field("latitude") <= bbox["north"],
+                       field("longitude") >= bbox["west"], field("longitude") <= bbox["east"]]
+    if partition_cols and params:
+        conditions.append(field("param").isin(list(params)))
+    if partition_cols and forecast_date_range:
+        start_date, end_date = (to_date(value) for value in forecast_date_range)
+        if start_date:
+            conditions.append(field("forecast_date") >= pa.scalar(start_date, pa.date32()))
+        if end_date:
+            conditions.append(field("forecast_date") <= pa.scalar(end_date, pa.date32()))
+    row_filter = None
+    for condition in conditions:
+        row_filter = condition if row_filter is None else row_filter & condition
+    return row_filter
+
+
+def get_filter_columns(bbox=None, forecast_date_range=None, params=None):
+    filter_columns = []
+    if bbox:
+        filter_columns += ["longitude", "latitude"]
+    if forecast_date_range:
+        filter_columns.append("forecast_date")
+    if params:
+        filter_columns.append("param")
+    return filter_columns
+
+
+def filter_csv_chunk(chunk_df=None, bbox=None, forecast_date_range=None, params=None):
+    keep = pd.Series(True, index=chunk_df.index)
+    if bbox:
+        keep &= chunk_df["latitude"].between(bbox["south"], bbox["north"])
+        keep &= chunk_df["longitude"].between(bbox["west"], bbox["east"])
+    if params:
+        keep &= chunk_df["param"].isin(list(params))
+    if forecast_date_range:
+        start_date, end_date = (to_date(value) for value in forecast_date_range)
+        forecast_dates = pd.to_datetime(chunk_df["forecast_date"]).dt.date
+        if start_date:
+            keep &= forecast_dates >= start_date
+        if end_date:
+            keep &= forecast_dates <= end_date
+    return chunk_df[keep]
+
+
+def read_csv_output(source=None, columns=None, bbox=None, forecast_date_range=None, params=None):
+    # the source (an s3 body stream or a file) goes straight into the parser, in row chunks
+    usecols = None
+    if columns is not None:
+        # NOTE: a callable, as the forecast hour columns differ from day to day
+        wanted_columns = set(columns) | set(get_filter_columns(bbox, forecast_date_range, params))
+        usecols = lambda col: col in wanted_columns
+    with pd.read_csv(source, usecols=usecols, chunksize=READ_CSV_CHUNK_ROWS) as csv_reader:
+        chunk_dfs = [filter_csv_chunk(chunk_df, bbox=bbox, forecast_date_range=forecast_date_range, params=params)
+                     for chunk_df in csv_reader]
+    df = pd.concat(chunk_dfs, ignore_index=True) if chunk_dfs else pd.DataFrame()
+    return df if columns is None else df.reindex(columns=list(columns))
+
+
+def is_row_group_in_bbox(row_group_metadata=None, bbox=None):
+    # from the min/max statistics of the latitude/longitude columns; no statistics -> read it
+    for i in range(row_group_metadata.num_columns):
+        column_metadata = row_group_metadata.column(i)
+        statistics = column_metadata.statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        if column_metadata.path_in_schema == "latitude":
+            if statistics.max < bbox["south"] or statistics.min > bbox["north"]:
+                return False
+        elif column_metadata.path_in_schema == "longitude":
+            if statistics.max < bbox["west"] or statistics.min > bbox["east"]:
+                return False
+    return True
+
+
+def read_columnar_output(source=None, output_format="parquet", key="", columns=None, bbox=None):
+    """
+    Reads one parquet / arrow partition file, only the columns asked for and the rows in the box.
+
+    For parquet only the row groups whose statistics overlap the box are read, their column
+    chunks in coalesced ranges. For arrow only the wanted columns of each record batch are read,
+    and each batch is filtered before the next is read. The forecast_date / param columns are
+    added back from the partition in the key.
+    """
+    forecast_date, param = get_partition_values(key)
+    row_filter = get_row_filter(bbox=bbox, partition_cols=False)
+    if output_format == "parquet":
+        parquet_file = pq.ParquetFile(source, pre_buffer=True)
+        file_schema = parquet_file.schema_arrow
+    else:
+        ipc_file = pa.ipc.open_file(source)
+        file_schema = ipc_file.schema
+    file_columns = None
+    if columns is not None:
+        wanted_columns = set(columns) | set(get_filter_columns(bbox=bbox))
+        file_columns = [col for col in file_schema.names if col in wanted_columns]
+
+    if output_format == "parquet":
+        row_groups = [i for i in range(parquet_file.num_row_groups)
+                      if not bbox or is_row_group_in_bbox(parquet_file.metadata.row_group(i), bbox=bbox)]
+        table = parquet_file.read_row_groups(row_groups, columns=file_columns)
+        if row_filter is not None:
+            table = table.filter(row_filter)
+    else:
+        if file_columns:
+            # NOTE: only the buffers of the included fields are read from the file
+            ipc_file = pa.ipc.open_file(source, options=pa.ipc.IpcReadOptions(
+                included_fields=[file_schema.get_field_index(col) for col in file_columns]))
+        batches = []
+        for i in range(ipc_file.num_record_batches):
+            batch = ipc_file.get_batch(i)
+            if file_columns is not None:
+                batch = batch.select(file_columns)
+            if row_filter is not None:
+                batch = batch.filter(row_filter)
+            batches.append(batch)
+        table = pa.Table.from_batches(batches, schema=pa.schema([file_schema.field(col) for col in file_columns])
+                                      if file_columns is not None else file_schema)
+    df = table.to_pandas()
+    if forecast_date is not None:
+        df["forecast_date"] = forecast_date
+        df["param"] = param
+    return df if columns is None else df.reindex(columns=list(columns))
+
+
+def list_output_files(object_prefix="", output_format="csv", bucket="", s3_client=None):
+    # the published files of the format under object_prefix: s3 keys, or local paths when no s3_client
+    if s3_client is not None:
+        # NOTE: imported here, the reader does not need s3 when reading a local folder
+        from s3_scripts import list_bucket_objects
+        output_files = list_bucket_objects(bucket=bucket, s3_client=s3_client, object_prefix=object_prefix)
+    else:
+        output_files = sorted(glob(f"{object_prefix.rstrip('/')}/**/*.{output_format}", recursive=True))
+    # NOTE: the per place tables (places/ecmwf_places_*.csv) have other columns, they are not part of the box data
+    return [f for f in output_files if f.endswith(f".{output_format}") and os.path.basename(f).startswith("ecmwf_data_")]
+
+
+def load_ecmwf_output_file(key="", output_format="csv", bucket="", s3_client=None, columns=None,
+                           bbox=None, forecast_date_range=None, params=None):
+    """Loads one published file, from s3 (s3_client given) or a local path."""
+    if output_format == "csv":
+        if s3_client is not None:
+            s3_file = s3_client.get_object(Bucket=bucket, Key=key)
+            return read_csv_output(s3_file['Body'], columns=columns, bbox=bbox,
+                                   forecast_date_range=forecast_date_range, params=params)
+        return read_csv_output(key, columns=columns, bbox=bbox, forecast_date_range=forecast_date_range,
+                               params=params)
+
+    if s3_client is None:
+        return read_columnar_output(key, output_format=output_format, key=key, columns=columns, bbox=bbox)
+    source, range_reader = open_s3_object(bucket=bucket, key=key, s3_client=s3_client)
+    with source:
+        df = read_columnar_output(source, output_format=output_format, key=key, columns=columns, bbox=bbox)
+    logging.info(f"Read {range_reader.bytes_read} of {range_reader.size} bytes of s3://{bucket}/{key} "
+                 f"in {range_reader.get_count} GETs")
+    return df
+
+
+def load_ecmwf_output(object_prefix="", output_format="csv", bucket="", s3_client=None, columns=None,
+                      bbox=None, forecast_date_range=None, params=None, max_parallel_reads=MAX_PARALLEL_READS):
+    """
+    Loads the published ECMWF output under object_prefix into one dataframe, reading several files at once.
+
+    Args:
+        object_prefix: s3 prefix (e.g. "ecmwfdata/"), or the local folder when s3_client is None.
+        output_format: csv, parquet or arrow, as published.
+        columns: the columns to return e.g. ["longitude", "latitude", "param", "6h"], None for all.
+        bbox: {"north", "south", "west", "east"} in decimal degrees, rows outside are dropped.
+        forecast_date_range: (start, end) dates, inclusive, either may be None.
+        params: the params to keep e.g. ["precipitation"].
+
+    Returns:
+        pd.DataFrame: the rows of all the files, in key order.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}, expected one of {OUTPUT_FORMATS}")
+    output_files = [f for f in list_output_files(object_prefix=object_prefix, output_format=output_format,
+                                                 bucket=bucket, s3_client=s3_client)
+                    if is_partition_wanted(f, forecast_date_range=forecast_date_range, params=params)]
+    logging.info(f"Loading {len(output_files)} {output_format} files under {object_prefix}")
+    if len(output_files) == 0:
+        return pd.DataFrame(columns=columns)
+
+    with ThreadPoolExecutor(max_workers=min(max_parallel_reads, len(output_files))) as executor:
+        dfs = list(executor.map(lambda f: load_ecmwf_output_file(key=f, output_format=output_format, bucket=bucket,
+                                                                 s3_client=s3_client, columns=columns, bbox=bbox,
+                                                                 forecast_date_range=forecast_date_range,
+                                                                 params=params),
+                                output_files))
+    return pd.concat(dfs, ignore_index=True)
@@ -0,0 +1,381 @@
+import os
+import re
+from datetime import datetime, timedelta, timezone
+import yaml
+import logging
+# ******************************************************************************************
+# The run plan: the run date, the forecast steps and their split into days, the step files to
+# download and the files to publish, all worked out from the run args and the yaml alone.
+#
+# Kept apart from the decode stack (xarray, cfgrib/eccodes, pyarrow, boto3 ...) and on the
+# standard library and pyyaml only, so main_ecmwf_data_pipeline.py --help and --plan start
+# without loading it.
+# ******************************************************************************************
+
+# *************  Scripts - lat/lon box and regions
+def convert_coordinate_to_numeric(coord_string):
+    # Find all sequences of one or more digits
+    numbers_as_strings = re.findall(r'\d+', coord_string)
+
+    # Convert the extracted strings to integers
+    coord_values = [int(num) for num in numbers_as_strings]
+    return coord_values
+
+
+def convert_degrees_to_decimal(degrees, minutes=None, seconds=None, direction=None):
+    """
+    Converts Degrees, Minutes, Seconds (DMS) to Decimal Degrees (DD).
+
+    Args:
+        degrees (float or int): The degree component.
+        minutes (float or int): The minute component.
+        seconds (float or int): The second component.
+        direction (str, optional): The cardinal direction ('N', 'S', 'E', 'W').
+                                   If 'S' or 'W', the decimal degrees will be negative.
+                                   Defaults to None.
+
+    Returns:
+        float: The equivalent value in decimal degrees.
+    """
+    conv_mins = (float(minutes) / 60) if minutes is not None else 0
+    conv_secs = (float(seconds) / 3600) if seconds is not None else 0
+    # deg_decimal = float(degrees) + (float(minutes) / 60) + (float(seconds) / 3600)
+    deg_decimal = float(degrees) + conv_mins + conv_secs
+
+    # further process if cardinal direction has been provided
+    if direction and direction.upper() in ['S', 'W']:
+        deg_decimal *= -1
+
+    return deg_decimal
+
+def convert_coords_to_decimal(coords={}, coord_keys_map={}):
+    # north, west, south, east degree/minute strings -> decimal, under the coords_map names
+    result = {}
+    for key in coords.keys():
+        # print(key)
+        # convert coords to numeric
+        vals = convert_coordinate_to_numeric(coords[key])
+        # convert coords to decimal
+        disp_key = coord_keys_map[key]
+        match len(vals):
+            case 2:
+                result[disp_key] = convert_degrees_to_decimal(degrees=vals[0], minutes=vals[1])
+            case 3:
+                result[disp_key] = convert_degrees_to_decimal(degrees=vals[0], minutes=vals[1], seconds=vals[2])
+            case _:  # Default case
+                result[disp_key] = convert_degrees_to_decimal(degrees=vals[0], minutes=vals[1])
+    return result
+
+
+def set_coords_as_decimal(yaml_file=""):
+    result = {}
+    data = None
+
+    try:
+        # load config for coords
+        with open(yaml_file, 'r') as f:
+            data = yaml.load(f, Loader=yaml.SafeLoader)
+        # print(data['coords']['north'])
+        # fetch the north, west, south, east coords
+        result = convert_coords_to_decimal(coords=data['coords'], coord_keys_map=data["coords_map"])
+
+    except Exception as ex:
+        logging.error(f"Error occurred as exception: {ex}")
+    return result
+
+
+def get_regions_from_yaml(yaml_file=""):
+    """
+    The boxes to publish: the 'regions' list of the yaml, or else the single 'coords' box.
+
+    Returns:
+        list: [{"name", "min_max_coords"}]; the single 'coords' box has no name and is
+              published at the top of the prefix, as before; named regions under {name}/.
+    """
+    with open(yaml_file, 'r') as f:
+        data = yaml.load(f, Loader=yaml.SafeLoader)
+    if not data.get("regions"):
+        return [{"name": "", "min_max_coords": set_coords_as_decimal(yaml_file=yaml_file)}]
+
+    regions = []
+    for region in data["regions"]:
+        name = str(region.get("name", "")).strip()
+        if not re.fullmatch(r"[A-Za-z0-9_\-]+", name):
+            raise ValueError(f"Region name '{name}' in {yaml_file} must be letters, digits, _ or -")
+        if name == "places":
+            raise ValueError(f"Region name '{name}' in {yaml_file} is taken by the per place time series")
+        if name in [r["name"] for r in regions]:
+            raise ValueError(f"Region name '{name}' is repeated in {yaml_file}")
+        regions.append({"name": name,
+                        "min_max_coords": convert_coords_to_decimal(coords=region["coords"],
+                                                                    coord_keys_map=data["coords_map"])})
+    return regions
+
+
+def get_regions_union_box(regions=[]):
+    # the box around all the regions, decoded once and then split up per region
+    union_box = {}
+    for region in regions:
+        for key, value in region["min_max_coords"].items():
+            if key not in union_box:
+                union_box[key] = value
+            else:
+                union_box[key] = min(union_box[key], value) if key.startswith("min_") else max(union_box[key], value)
+    return union_box
+
+
+# cfgrib variable names -> ecmwf open data param names, where the two differ
+CFGRIB_TO_OPENDATA_PARAM = {"t2m": "2t", "d2m": "2d", "u10": "10u", "v10": "10v"}
+# typeOfLevel -> ecmwf open data levtype
+TYPEOFLEVEL_TO_LEVTYPE = {"surface": "sfc", "heightAboveGround": "sfc", "isobaricInhPa": "pl"}
+# columns in pre_combine_cols which are grib coordinates, not downloadable params
+GRIB_COORD_COLS = ["longitude", "latitude", "time", "step", "valid_time",
+                   "surface", "heightAboveGround", "isobaricInhPa"]
+
+def get_pre_combine_cols(yaml_file="", filter_levels=[]):
+    """
+    The columns to take from each filter level when the levels are combined, from pre_combine_cols in the yaml.
+
+    Raises:
+        ValueError: if a filter level has no pre_combine_cols, as it could not be combined.
+    """
+    with open(yaml_file, 'r') as f:
+        data = yaml.load(f, Loader=yaml.SafeLoader)
+    pre_combine_cols = data.get("pre_combine_cols") or {}
+    missing_levels = [filter_level for filter_level in filter_levels if not pre_combine_cols.get(filter_level)]
+    if missing_levels:
+        raise ValueError(f"No pre_combine_cols for the filter levels {missing_levels} in {yaml_file}")
+    return {filter_level: list(pre_combine_cols[filter_level]) for filter_level in filter_levels}
+
+
+def get_download_params(yaml_file="", filter_levels=[]):
+    """
+    Resolves the ecmwf open data params (and levtypes) to request, from pre_combine_cols in the yaml.
+
+    Returns:
+        tuple: (params, levtypes) lists, both empty if nothing could be resolved,
+               in which case the complete files get downloaded.
+    """
+    params = []
+    levtypes = []
+
+    try:
+        with open(yaml_file, 'r') as f:
+            data = yaml.load(f, Loader=yaml.SafeLoader)
+        pre_combine_cols = data.get("pre_combine_cols", {})
+
+        for filter_level in filter_levels:
+            for col in pre_combine_cols.get(filter_level, []):
+                if col in GRIB_COORD_COLS:
+                    continue
+                param = CFGRIB_TO_OPENDATA_PARAM.get(col, col)
+                if param not in params:
+                    params.append(param)
+            levtype = TYPEOFLEVEL_TO_LEVTYPE.get(filter_level, "sfc")
+            if levtype not in levtypes:
+                levtypes.append(levtype)
+    except Exception as ex:
+        logging.error(f"Error occurred as exception: {ex}")
+        params = []
+        levtypes = []
+    return params, levtypes
+
+
+
+# *************  Scripts - forecast steps, days and file names
+# the latest run lookup gives up quickly, the downloads keep the client's default retries
+LATEST_RUN_MAX_RETRIES = 2
+LATEST_RUN_RETRY_AFTER = 5
+
+def get_ecmwf_client(maximum_retries=0, retry_after=0):
+    # NOTE: ECMWF_OPENDATA_SOURCE may point to a mirror (aws, azure, google) or a local
+    #       http stand-in e.g. http://127.0.0.1:8000 serving the same folder layout
+    # NOTE: imported here, only the downloads and the latest run lookup need the client (and requests)
+    from ecmwf.opendata import Client
+
+    ecmwf_source = os.getenv('ECMWF_OPENDATA_SOURCE', 'ecmwf')
+    client_args = {}
+    if maximum_retries:
+        client_args["maximum_retries"] = maximum_retries
+    if retry_after:
+        client_args["retry_after"] = retry_after
+    ecmwf_client = Client(source=ecmwf_source, **client_args)
+    return ecmwf_client
+
+
+def get_latest_run_date(client=None, step_hour=0, stream_to_use="oper"):
+    """
+    The latest 00 UTC run ECMWF has published up to step_hour, through the client's latest run lookup.
+
+    Falls back to the previous day's run (get_formatted_utc_current_date) if it can not be established.
+    """
+    try:
+        if client is None:
+            client = get_ecmwf_client(maximum_retries=LATEST_RUN_MAX_RETRIES, retry_after=LATEST_RUN_RETRY_AFTER)
+        # NOTE: HEAD requests on the step file of today's, then yesterday's 00 UTC run
+        latest_date = client.latest(time=0, step=step_hour, stream=stream_to_use, type="fc")
+        return latest_date.replace(tzinfo=timezone.utc)
+    except Exception as ex:
+        logging.warning(f"Unable to establish the latest run, using the previous day's run: {ex}")
+        return get_formatted_utc_current_date()[0]
+
+
+def get_forecast_hours_for_total_days(num_days=0, step_size=6, start=6):
+    hours_per_day = 24
+    hours_array = list(range(start, (num_days * hours_per_day) + 1, step_size))
+    return hours_array
+
+def get_formatted_utc_current_date():
+    utc_1dayprior_date = None
+    fmtd_utc_1dayprior_date = None
+    # get the current date in UTC
+    today_utc = datetime.now(timezone.utc).date()
+
+    # get the current UTC date and time, setting the time to 00:00:00
+    current_utc_date_at_midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    # we are keeping in UTC, so we don't alter the source data integrity 
+    utc_1dayprior_date = (current_utc_date_at_midnight - timedelta(days=1)) 
+
+    # check by printing the resulting date and time
+    print(f"The current UTC date at 0 hours is: {current_utc_date_at_midnight}")
+    print(f"UTC date 1day prior so we cover Bhutan TZ: {utc_1dayprior_date}")
+    fmtd_utc_1dayprior_date = utc_1dayprior_date.strftime("%Y-%m-%d %H:%M:%S")
+    return utc_1dayprior_date, fmtd_utc_1dayprior_date
+
+def get_step_cache_request(current_date=None, step_hour=0, stream_to_use="oper", params=[], levtypes=[]):
+    # what identifies a downloaded step file in the grib cache
+    return {"date": current_date.strftime('%Y%m%d'), "cycle": current_date.strftime('%H'),
+            "step": step_hour, "stream": stream_to_use, "type": "fc",
+            "param": list(params), "levtype": list(levtypes)}
+
+
+def get_run_dirs(download_path="", prepped_path="", push_destination="", grib_cache_dir="", grib_cache_max_mb=0):
+    """
+    The download, prepped and grib cache folders of a run; under TEMP_DIR unless saving locally.
+
+    Returns:
+        tuple: (download_dir, prepped_dir, grib_cache_dir), grib_cache_dir is "" with a size cap of 0.
+    """
+    root_temp_dir = os.getenv('TEMP_DIR', '/tmp')
+    if push_destination == "local":
+        download_dir = download_path
+        prepped_dir = prepped_path
+    else:
+        download_dir = f"{root_temp_dir}/{download_path}"
+        prepped_dir = f"{root_temp_dir}/{prepped_path}"
+    grib_cache_dir = (grib_cache_dir or f"{root_temp_dir}/grib_cache") if grib_cache_max_mb > 0 else ""
+    return download_dir, prepped_dir, grib_cache_dir
+
+
+def get_day_chunks(step_hours=[], step_size=6):
+    # the forecast steps split into days, e.g. [[6, 12, 18, 24], [30, 36, 42, 48], ...] for 6 hourly steps
+    chunk_step_size = 24 // step_size  # 24 // 6 = 4
+    return [step_hours[i:i + chunk_step_size] for i in range(0, len(step_hours), chunk_step_size)]
+
+
+def get_step_file_name(download_dir="", current_date=None, step_hour=0, stream_to_use="oper"):
+    # NOTE: FYI, here we are closely mimicking to the server filename
+    return f"{download_dir}/ecmwf_data_{current_date.strftime('%Y%m%d')}000000_{step_hour}h_{stream_to_use}_fc.grib2"
+
+
+def get_day_file_stem(cnt=0, chunk=[], start_date=None, stream_to_use="oper"):
+    # e.g. ecmwf_data_20250922000000_6121824h_oper_fc_1
+    curr_cmb_hrs = "".join([str(t) for t in chunk])
+    return f"ecmwf_data_{start_date.strftime('%Y%m%d')}000000_{curr_cmb_hrs}h_{stream_to_use}_fc_{cnt+1}"
+
+
+# *************  Scripts - output layout
+# the forecast variables, published as one block of rows (param_tag) each
+DAY_FORECAST_VARS = ['t2m_cel', 'surface', 'tp']
+
+def assign_param_by_tag(row):    
+    param_value = "temperature_celcius" if row['param_tag']=="t2m_cel" else "surface_runoff" if row['param_tag']=="surface" else "precipitation"
+    return param_value
+
+
+def get_day_output_files(cnt=0, chunk=[], start_date=None, stream_to_use="oper", output_format="csv",
+                         region_names=[""], with_places=False):
+    """
+    The relative paths of the files published for one day, as publish_chunk lays them out.
+
+    parquet/arrow are partitioned by forecast_date (the run date) and param.
+    """
+    file_stem = get_day_file_stem(cnt=cnt, chunk=chunk, start_date=start_date, stream_to_use=stream_to_use)
+    output_files = []
+    for region_name in region_names:
+        region_dir = f"{region_name}/" if region_name else ""
+        if output_format == "csv":
+            output_files.append(f"{region_dir}{file_stem}.csv")
+            continue
+        for param in sorted(assign_param_by_tag({'param_tag': tag}) for tag in DAY_FORECAST_VARS):
+            output_files.append(f"{region_dir}forecast_date={start_date.strftime('%Y-%m-%d')}/param={param}/"
+                                f"{file_stem}.{output_format}")
+    if with_places:
+        output_files.append(f"places/{file_stem.replace('ecmwf_data_', 'ecmwf_places_', 1)}.csv")
+    return output_files
+
+
+def get_run_plan(start_date=None, number_of_days=5, step_size=6, filter_levels=[], yaml_file="",
+                 download_dir="", grib_cache_dir="", push_destination="", push_data_path="", prepped_dir="",
+                 output_format="csv"):
+    """
+    What a run would download and publish, without downloading, decoding or uploading anything.
+
+    Returns:
+        dict: {"run_date", "params", "levtypes", "regions", "grib_cache_dir",
+               "days": [{"day", "steps", "downloads": [{"step", "file", "cached"}], "outputs"}]}
+    """
+    # NOTE: imported here, the cache lookup only reads the cache index (no numpy/eccodes)
+    from grib_cache_scripts import peek_grib_cache
+
+    stream_to_use = "oper"
+    params, levtypes = get_download_params(yaml_file=yaml_file, filter_levels=filter_levels)
+    region_names = [region["name"] for region in get_regions_from_yaml(yaml_file=yaml_file)]
+    with open(yaml_file, 'r') as f:
+        with_places = bool(((yaml.load(f, Loader=yaml.SafeLoader) or {}).get("places") or {}).get("locations"))
+    step_hours = get_forecast_hours_for_total_days(num_days=number_of_days, step_size=step_size, start=step_size)
+    output_prefix = f"{push_data_path}/" if push_destination == "s3" else f"{prepped_dir}/"
+
+    days = []
+    for cnt, chunk in enumerate(get_day_chunks(step_hours=step_hours, step_size=step_size)):
+        downloads = []
+        for step_hour in chunk:
+            cached = None
+            if grib_cache_dir:
+                cached = peek_grib_cache(cache_dir=grib_cache_dir,
+                                         request=get_step_cache_request(current_date=start_date, step_hour=step_hour,
+                                                                        stream_to_use=stream_to_use, params=params,
+                                                                        levtypes=levtypes))
+            downloads.append({"step": step_hour, "cached": cached,
+                              "file": get_step_file_name(download_dir=download_dir, current_date=start_date,
+                                                         step_hour=step_hour, stream_to_use=stream_to_use)})
+        outputs = get_day_output_files(cnt=cnt, chunk=chunk, start_date=start_date, stream_to_use=stream_to_use,
+                                       output_format=output_format, region_names=region_names,
+                                       with_places=with_places)
+        days.append({"day": cnt + 1, "steps": chunk, "downloads": downloads,
+                     "outputs": [f"{output_prefix}{output_file}" for output_file in outputs]})
+    return {"run_date": start_date.strftime("%Y-%m-%d %H:%M:%S"), "params": params, "levtypes": levtypes,
+            "regions": region_names, "grib_cache_dir": grib_cache_dir, "days": days}
+
+
+def print_run_plan(run_plan={}):
+    lines = [f"Run plan for the {run_plan['run_date']} UTC run, params: {run_plan['params']}, "
+             f"levtypes: {run_plan['levtypes']}, regions: {[name or '(top of the prefix)' for name in run_plan['regions']]}"]
+    for day in run_plan["days"]:
+        lines.append(f"Day {day['day']}, steps {day['steps']}:")
+        for download in day["downloads"]:
+            if not run_plan["grib_cache_dir"]:
+                cache_status = "no grib cache"
+            elif download["cached"]:
+                cache_status = f"cached ({download['cached']['size'] / (1024 * 1024):.1f} MB)"
+            else:
+                cache_status = "not cached, to download"
+            lines.append(f"  download step {download['step']}h -> {download['file']} [{cache_status}]")
+        for output in day["outputs"]:
+            lines.append(f"  publish {output}")
+    n_downloads = sum(len(day["downloads"]) for day in run_plan["days"])
+    n_cached = sum(1 for day in run_plan["days"] for download in day["downloads"] if download["cached"])
+    summary = (f"Run plan: {n_downloads} step files ({n_cached} cached), "
+               f"{sum(len(day['outputs']) for day in run_plan['days'])} files to publish")
+    print("\n".join(lines))
+    logging.info(summary)
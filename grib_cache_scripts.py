@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from glob import glob, escape as glob_escape
+import logging
+# ******************************************************************************************
+# A content addressed, size bounded cache of the downloaded grib2 files.
+#
+# Each file is stored as <cache_dir>/<key>.grib2, where key is a hash of the request that
+# produced it i.e. (run date, cycle, step, stream, type, param set), and the cfgrib .idx files
+# are left next to it, so reopening a cached file is cheap. cache_index.json holds the size,
+# sha256 and last access time per key; the least recently used entries are evicted once the
+# cache grows beyond its size cap. Files in use by the running pipeline are pinned, so they
+# are never evicted from under the decode stage.
+#
+# The index is read once per process and kept in memory; it is written back when entries are
+# added, dropped or evicted, while the access times of the hits are written along with the
+# next change, or when the decode unpins the files of a day. The files are hashed outside
+# the lock, so the lookups of the download threads do not queue behind each other.
+# ******************************************************************************************
+
+GRIB_CACHE_INDEX_FILE = "cache_index.json"
+
+_grib_cache_lock = threading.Lock()
+_grib_cache_indexes = {}
+_grib_cache_dirty = set()
+_grib_cache_pinned = set()
+_grib_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "corrupt": 0,
+                     "hit_bytes": 0, "added_bytes": 0, "evicted_bytes": 0}
+
+
+def get_grib_cache_key(request={}):
+    # request e.g. {"date": "2025092200", "step": 6, "stream": "oper", "type": "fc", "param": ["2t", "tp"]}
+    canonical = {k: (sorted(v) if isinstance(v, (list, tuple)) else v) for k, v in request.items()}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_file_sha256(file_path=""):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def load_grib_cache_index(cache_dir=""):
+    index_file = f"{cache_dir}/{GRIB_CACHE_INDEX_FILE}"
+    if not os.path.exists(index_file):
+        return {}
+    try:
+        with open(index_file, 'r') as f:
+            return json.load(f)
+    except Exception as ex:
+        # a broken index only costs re-downloads, so start over rather than fail the run
+        logging.warning(f"Unable to read grib cache index {index_file}, starting empty: {ex}")
+        return {}
+
+
+def save_grib_cache_index(cache_dir="", cache_index={}):
+    # write then rename, so the index on disk is never half written
+    index_file = f"{cache_dir}/{GRIB_CACHE_INDEX_FILE}"
+    tmp_index_file = f"{index_file}.tmp"
+    with open(tmp_index_file, 'w') as f:
+        json.dump(cache_index, f, indent=1)
+    os.replace(tmp_index_file, index_file)
+
+
+def get_grib_cache_index(cache_dir=""):
+    # the in memory index of cache_dir, read from disk on first use; hold _grib_cache_lock
+    if cache_dir not in _grib_cache_indexes:
+        _grib_cache_indexes[cache_dir] = load_grib_cache_index(cache_dir)
+    return _grib_cache_indexes[cache_dir]
+
+
+def flush_grib_cache_index(cache_dir=""):
+    # writes the index back if it changed since it was last written; hold _grib_cache_lock
+    if cache_dir in _grib_cache_dirty:
+        save_grib_cache_index(cache_dir, _grib_cache_indexes[cache_dir])
+        _grib_cache_dirty.discard(cache_dir)
+
+
+def remove_grib_cache_files(file_path=""):
+    # the grib2 file along with its cfgrib .idx files
+    for f_del in glob(f"{glob_escape(file_path)}*"):
+        os.remove(f_del)
+
+
+def get_grib_cache_file(cache_dir="", key=""):
+    return f"{cache_dir}/{key}.grib2"
+
+
+def lookup_grib_cache(cache_dir="", request={}, verify=True):
+    """
+    Returns the cached grib2 file for the request and pins it, or "" on a miss.
+
+    On a hit the file size and (if verify) the sha256 are checked against the index;
+    a file that fails the check is dropped from the cache and reported as a miss.
+    """
+    key = get_grib_cache_key(request)
+    cached_file = get_grib_cache_file(cache_dir, key)
+    with _grib_cache_lock:
+        entry = get_grib_cache_index(cache_dir).get(key)
+        entry = dict(entry) if entry is not None else None
+    # NOTE: hashed without the lock, the entry is checked to be still the same once relocked
+    intact = (entry is not None and os.path.exists(cached_file)
+              and os.path.getsize(cached_file) == entry["size"]
+              and (not verify or get_file_sha256(cached_file) == entry["sha256"]))
+    with _grib_cache_lock:
+        cache_index = get_grib_cache_index(cache_dir)
+        current_entry = cache_index.get(key)
+        same_entry = (entry is not None and current_entry is not None
+                      and current_entry["sha256"] == entry["sha256"])
+        if not intact or not same_entry:
+            if not intact and same_entry:
+                logging.warning(f"Grib cache entry failed the integrity check, dropped: {cached_file}")
+                _grib_cache_stats["corrupt"] += 1
+                cache_index.pop(key, None)
+                remove_grib_cache_files(cached_file)
+                _grib_cache_dirty.add(cache_dir)
+                flush_grib_cache_index(cache_dir)
+            _grib_cache_stats["misses"] += 1
+            return ""
+
+        # the access time is written along with the next change of the index
+        current_entry["last_access"] = time.time()
+        _grib_cache_dirty.add(cache_dir)
+        _grib_cache_pinned.add(key)
+        _grib_cache_stats["hits"] += 1
+        _grib_cache_stats["hit_bytes"] += current_entry["size"]
+    logging.info(f"Grib cache hit: {request} -> {cached_file}")
+    return cached_file
+
+
+def peek_grib_cache(cache_dir="", request={}):
+    # the cache index entry of the request, or None; read only, no integrity check, no pin, no stats
+    key = get_grib_cache_key(request)
+    with _grib_cache_lock:
+        entry = get_grib_cache_index(cache_dir).get(key)
+    if entry is None or not os.path.exists(get_grib_cache_file(cache_dir, key)):
+        return None
+    return entry
+
+
+def add_to_grib_cache(cache_dir="", request={}, file_path="", max_cache_mb=0):
+    """
+    Moves a freshly downloaded file into the cache, pins it and evicts down to max_cache_mb.
+
+    file_path should be on the same file system as cache_dir, so the move is a rename.
+
+    Returns:
+        str: the cached grib2 file.
+    """
+    key = get_grib_cache_key(request)
+    cached_file = get_grib_cache_file(cache_dir, key)
+    # the download is not shared yet, so it is hashed before taking the lock
+    file_size = os.path.getsize(file_path)
+    file_sha256 = get_file_sha256(file_path)
+    with _grib_cache_lock:
+        cache_index = get_grib_cache_index(cache_dir)
+        os.replace(file_path, cached_file)
+        cache_index[key] = {
+            "file": os.path.basename(cached_file),
+            "size": file_size,
+            "sha256": file_sha256,
+            "last_access": time.time(),
+            "request": request,
+        }
+        _grib_cache_pinned.add(key)
+        _grib_cache_stats["added_bytes"] += file_size
+        evict_grib_cache(cache_dir=cache_dir, cache_index=cache_index, max_cache_mb=max_cache_mb)
+        _grib_cache_dirty.add(cache_dir)
+        flush_grib_cache_index(cache_dir)
+    return cached_file
+
+
+def evict_grib_cache(cache_dir="", cache_index={}, max_cache_mb=0):
+    # least recently used first, skipping the pinned entries; cache_index is updated in place
+    # and the number of evicted entries returned
+    evicted_cnt = 0
+    max_cache_bytes = max_cache_mb * 1024 * 1024
+    total_bytes = sum(entry["size"] for entry in cache_index.values())
+    for key, entry in sorted(cache_index.items(), key=lambda item: item[1]["last_access"]):
+        if total_bytes <= max_cache_bytes:
+            break
+        if key in _grib_cache_pinned:
+            continue
+        remove_grib_cache_files(get_grib_cache_file(cache_dir, key))
+        cache_index.pop(key)
+        total_bytes -= entry["size"]
+        _grib_cache_stats["evictions"] += 1
+        _grib_cache_stats["evicted_bytes"] += entry["size"]
+        evicted_cnt += 1
+        logging.info(f"Grib cache evicted: {entry['request']}")
+    return evicted_cnt
+
+
+def unpin_grib_cache_files(cache_dir="", file_paths=[], max_cache_mb=0):
+    # the decode is done with these files, so they may be evicted from now on
+    with _grib_cache_lock:
+        for file_path in file_paths:
+            _grib_cache_pinned.discard(os.path.basename(file_path).split(".grib2")[0])
+        cache_index = get_grib_cache_index(cache_dir)
+        if evict_grib_cache(cache_dir=cache_dir, cache_index=cache_index, max_cache_mb=max_cache_mb) > 0:
+            _grib_cache_dirty.add(cache_dir)
+        # along with the access times of the day's hits
+        flush_grib_cache_index(cache_dir)
+
+
+def get_grib_cache_stats():
+    with _grib_cache_lock:
+        return dict(_grib_cache_stats)
+
+
+def log_grib_cache_stats(cache_dir=""):
+    stats = get_grib_cache_stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = (stats["hits"] / lookups * 100) if lookups > 0 else 0
+    with _grib_cache_lock:
+        cache_index = dict(get_grib_cache_index(cache_dir))
+        flush_grib_cache_index(cache_dir)
+    cache_mb = sum(entry["size"] for entry in cache_index.values()) / (1024 * 1024)
+    msg = (f"Grib cache stats: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0f}% hit rate), "
+           f"{stats['evictions']} evictions, {stats['corrupt']} corrupt, "
+           f"{stats['hit_bytes'] / (1024 * 1024):.1f} MB served from cache, "
+           f"{len(cache_index)} files / {cache_mb:.1f} MB in {cache_dir}")
+    print(msg)
+    logging.info(msg)
+    return stats
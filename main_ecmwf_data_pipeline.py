@@ -1,24 +1,70 @@
 import os
 import argparse
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta, date
 import time
 import logging
-# Configure basic logging
+# Configure basic logging, once for the whole pipeline
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 # import custom script
-from ecmwf_data_processing_scripts import *
-from s3_scripts import *
+# NOTE: only the light modules (standard library, pyyaml) are imported up front, so --help and --plan
+#       start fast; the decode stack (xarray, cfgrib/eccodes, pyarrow, pandas) and boto3 are imported
+#       in main_process_ecmwf_data, when a run actually starts
+from ecmwf_run_plan_scripts import *
+from run_metrics_scripts import *
 # *************************************************************************************************
 
+def plan_ecmwf_data(download_path="", prepped_path="", filter_levels=[],
+                    number_of_days=0, step_counter=6,
+                    push_destination="", push_data_path="",
+                    yaml_file="", grib_cache_dir="", grib_cache_max_mb=0,
+                    output_format="csv", incremental=False):
+    # what the run would download and publish, nothing is downloaded, decoded or uploaded
+    if incremental:
+        # NOTE: the latest run lookup sends a few HEAD requests to ECMWF
+        step_hours = get_forecast_hours_for_total_days(num_days=number_of_days, step_size=step_counter,
+                                                       start=step_counter)
+        start_date = get_latest_run_date(step_hour=step_hours[-1], stream_to_use="oper")
+    else:
+        start_date, start_date_fmtd = get_formatted_utc_current_date()
+    download_dir, prepped_dir, grib_cache_dir = get_run_dirs(download_path=download_path, prepped_path=prepped_path,
+                                                             push_destination=push_destination,
+                                                             grib_cache_dir=grib_cache_dir,
+                                                             grib_cache_max_mb=grib_cache_max_mb)
+    run_plan = get_run_plan(start_date=start_date, number_of_days=number_of_days, step_size=step_counter,
+                            filter_levels=filter_levels, yaml_file=yaml_file, download_dir=download_dir,
+                            grib_cache_dir=grib_cache_dir, push_destination=push_destination,
+                            push_data_path=push_data_path, prepped_dir=prepped_dir, output_format=output_format)
+    print_run_plan(run_plan)
+    return run_plan
+
+
 def main_process_ecmwf_data(download_path="", prepped_path="", prepped_suffix="",
                             filter_levels=[], level=2,
                             number_of_days=0, step_counter=6,
                             push_destination="", push_data_path="",
                             yaml_file="", 
-                            delete_s3_files=False
+                            delete_s3_files=False,
+                            max_parallel_downloads=4,
+                            memory_budget=0,
+                            decode_workers=1,
+                            grib_cache_dir="",
+                            grib_cache_max_mb=0,
+                            output_format="csv",
+                            lazy=False,
+                            run_state_file="",
+                            incremental=False,
+                            resume=False,
+                            checkpoint_dir="",
+                            checkpoint=False,
+                            metrics_file="",
+                            prometheus_file="",
+                            profile=False,
+                            profile_dir=""
                             ):
+    # NOTE: imported here rather than at the top, see the imports above
+    from ecmwf_data_processing_scripts import download_and_process_ecmwf_data
+    from s3_scripts import get_s3_client, list_bucket_objects, close_s3_clients
+
     object_prefix = ""
 
     # ********** NOTE: Always assumed today's date, hence not passing to the function call below
@@ -31,20 +77,10 @@ def main_process_ecmwf_data(download_path="", prepped_path="", prepped_suffix=""
     print(f"ECMWF Data download and processing started at: {fmt_date}")
     logging.info(f"ECMWF Data download and processing started at: {fmt_date}")
     start_t = time.time()
+    reset_run_metrics()
 
-    # clean data on s3 first
-    if delete_s3_files:
-        s3c, bucket_name = get_s3_client()
-        object_prefix = f"{push_data_path}/"
-        flist = list_bucket_objects(bucket=bucket_name, s3_client=s3c, object_prefix=object_prefix)
-        logging.info(f"list of files in s3 with object_prefix - {object_prefix}: {flist}")
-        # check if file count is > 0, delete else proceed to refresh data
-        if len(flist) > 0:
-            del_status = remove_files_on_s3(file_list=flist, bucket=bucket_name, s3_client=s3c)
-            print(f"ECMWF data files deleted on S3, to prep for data refresh.")
-        else:
-            print(f"No ECMWF data files found on S3, no action taken before data refresh.")
-        s3c.close()
+    # NOTE: data on s3 is no longer cleaned up front; the refresh uploads only the changed files,
+    #       switches the manifest over and only then removes the stale files (if delete_s3_files)
         
     # download and process
     overall_status = download_and_process_ecmwf_data(download_path=download_path, prepped_path=prepped_path,
@@ -53,14 +89,29 @@ def main_process_ecmwf_data(download_path="", prepped_path="", prepped_suffix=""
                                                      number_of_days=number_of_days, step_size=step_counter,                                                     
                                                      push_destination=push_destination, 
                                                      push_data_path=push_data_path,
-                                                     yaml_file=yaml_file
+                                                     yaml_file=yaml_file,
+                                                     max_parallel_downloads=max_parallel_downloads,
+                                                     memory_budget=memory_budget,
+                                                     decode_workers=decode_workers,
+                                                     grib_cache_dir=grib_cache_dir,
+                                                     grib_cache_max_mb=grib_cache_max_mb,
+                                                     remove_stale_s3_files=delete_s3_files,
+                                                     output_format=output_format,
+                                                     profile_decode=profile,
+                                                     lazy=lazy,
+                                                     run_state_file=run_state_file,
+                                                     incremental=incremental,
+                                                     resume=resume,
+                                                     checkpoint_dir=checkpoint_dir,
+                                                     checkpoint=checkpoint
                                                     )
     
     # list the files after push to s3 as well for audit purposes
     s3c, bucket_name = get_s3_client()
     # print(f"bucket_name: {bucket_name}")
     object_prefix = f"{push_data_path}/"
-    f_postlist = list_bucket_objects(bucket=bucket_name, s3_client=s3c, object_prefix=object_prefix)
+    with measure_stage("s3_audit_list"):
+        f_postlist = list_bucket_objects(bucket=bucket_name, s3_client=s3c, object_prefix=object_prefix)
     # user friendly format the list and show in the log
     logging.info(f"ECMWF data refresh on S3, for requested date of {fmt_date} for {number_of_days} days:")
     if f_postlist:
@@ -68,7 +119,8 @@ def main_process_ecmwf_data(download_path="", prepped_path="", prepped_suffix=""
         logging.info(f"{fmt_flist}")
     else:
         logging.warn(" Unable to locate files after the ECMWF data push to S3")
-    s3c.close()
+    # the s3 client is shared across the run, close its connections once done
+    close_s3_clients()
 
     # record end of ECMWF data processing
     end_t = time.time()
@@ -88,6 +140,16 @@ def main_process_ecmwf_data(download_path="", prepped_path="", prepped_suffix=""
     print(msg)
     logging.info(msg)
 
+    # the run report, with the timings and counters per stage
+    run_info = {"run_at": datetime.fromtimestamp(start_t).strftime("%Y-%m-%d %H:%M:%S"), "status": overall_status, "wall_s": round(end_t - start_t, 3),
+                "number_of_days": number_of_days, "push_destination": push_destination,
+                "push_data_path": push_data_path, "output_format": output_format,
+                "decode_workers": decode_workers, "max_parallel_downloads": max_parallel_downloads,
+                "lazy": lazy, "memory_budget": memory_budget, "incremental": incremental, "resume": resume}
+    save_run_metrics_report(report_file=metrics_file, prometheus_file=prometheus_file, run_info=run_info)
+    if profile:
+        save_stage_profiles(profile_dir=profile_dir)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Downloading ECMWF data and processing to convert to .CSV...')
@@ -114,7 +176,48 @@ if __name__ == "__main__":
     parser.add_argument('--yaml_file', type=str, default='gribcfg.yaml',
                         help='settings required for download')
     parser.add_argument('--delete_s3_files_flag', type=str, default='Y',
-                        help='flag to indicate to delete all files on S3')
+                        help='flag to indicate to delete the stale files on S3, once the refreshed files are published')
+    parser.add_argument('--max_parallel_downloads', type=str, default='4',
+                        help='maximum number of forecast step files downloaded concurrently')
+    parser.add_argument('--memory_budget', type=str, default='0',
+                        help='memory budget in MB for decoded step data, beyond which it is spilled to disk (0 = no limit); '
+                             'with --lazy, the memory for each output tile')
+    parser.add_argument('--decode_workers', type=str, default='1',
+                        help='number of processes decoding the grib2 files in parallel (1 = decode in process)')
+    parser.add_argument('--grib_cache_dir', type=str, default='',
+                        help='folder of the persistent grib2 download cache (default: TEMP_DIR/grib_cache)')
+    parser.add_argument('--grib_cache_max_mb', type=str, default='2048',
+                        help='size cap in MB of the grib2 download cache, least recently used files are evicted (0 = no cache)')
+    parser.add_argument('--output_format', type=str, default='csv',
+                        help='format of the published data: csv, parquet or arrow (parquet/arrow are partitioned by forecast_date/param)')
+    parser.add_argument('--plan', type=str, default='N',
+                        help='flag to only print the run plan (Y/N): the step files to download, the days, '
+                             'the grib cache status and the files to publish, without running the pipeline')
+    parser.add_argument('--lazy', type=str, default='N',
+                        help='flag to decode through dask into a disk backed array and publish it in tiles (Y/N), for flat memory')
+    parser.add_argument('--run_state_file', type=str, default='',
+                        help='json file of the processed (date, cycle, step) of the latest run, mirrored to s3 as _run_state.json, '
+                             'default {TEMP_DIR}/ecmwf_run_state.json')
+    parser.add_argument('--incremental', type=str, default='N',
+                        help='flag to process the latest published ECMWF run, and only the days not yet published for it (Y/N)')
+    parser.add_argument('--resume', type=str, default='N',
+                        help='flag to resume the run in the run state (Y/N): the finished downloads, decodes, combines '
+                             'and publishes are skipped, and only the failed or missing ones are run again')
+    parser.add_argument('--checkpoint_dir', type=str, default='',
+                        help='folder for the checkpoints of a run (decoded step frames, combined days), '
+                             'default {TEMP_DIR}/ecmwf_checkpoint')
+    parser.add_argument('--checkpoint', type=str, default='N',
+                        help='flag to checkpoint the decoded step frames and combined days as parquet (Y/N), '
+                             'so a failed run can be resumed from them; always on with --resume')
+    
+    parser.add_argument('--metrics_file', type=str, default='ecmwf_run_metrics.json',
+                        help='json report of the run: wall/cpu time and memory per stage, bytes, rows and cache hits')
+    parser.add_argument('--prometheus_file', type=str, default='',
+                        help='optional file to also write the run metrics to, in the Prometheus text format')
+    parser.add_argument('--profile', type=str, default='N',
+                        help='flag to run the decode stage under cProfile (Y/N), best with --decode_workers=1')
+    parser.add_argument('--profile_dir', type=str, default='profile',
+                        help='folder for the cProfile output, decode.pstats and decode_profile.txt')
     
     parse_args = parser.parse_args()
     logging.info(f'\nRun args for downloading ECMWF data and processing to convert to .csv --> {parse_args}')
@@ -134,6 +237,23 @@ if __name__ == "__main__":
     yaml_file = ""
     # env = ""
     delete_s3_files = False
+    max_parallel_downloads = 4
+    memory_budget = 0
+    decode_workers = 1
+    grib_cache_dir = ""
+    grib_cache_max_mb = 2048
+    output_format = "csv"
+    plan = False
+    lazy = False
+    run_state_file = ""
+    incremental = False
+    resume = False
+    checkpoint_dir = ""
+    checkpoint = False
+    metrics_file = ""
+    prometheus_file = ""
+    profile = False
+    profile_dir = ""
 
     if parse_args.download_path:
         download_path = parse_args.download_path
@@ -164,17 +284,79 @@ if __name__ == "__main__":
         yaml_file = parse_args.yaml_file
     if parse_args.delete_s3_files_flag is not None:
         delete_s3_files = True if parse_args.delete_s3_files_flag=="Y" else False
+    if parse_args.max_parallel_downloads is not None:
+        max_parallel_downloads_s = parse_args.max_parallel_downloads
+        max_parallel_downloads = int(max_parallel_downloads_s)
+    if parse_args.memory_budget is not None:
+        memory_budget_s = parse_args.memory_budget
+        memory_budget = int(memory_budget_s)
+    if parse_args.decode_workers is not None:
+        decode_workers_s = parse_args.decode_workers
+        decode_workers = int(decode_workers_s)
+    if parse_args.grib_cache_dir is not None:
+        grib_cache_dir = parse_args.grib_cache_dir
+    if parse_args.grib_cache_max_mb is not None:
+        grib_cache_max_mb_s = parse_args.grib_cache_max_mb
+        grib_cache_max_mb = int(grib_cache_max_mb_s)
+    if parse_args.output_format is not None:
+        output_format = parse_args.output_format.strip().lower()
+    if parse_args.plan is not None:
+        plan = True if parse_args.plan=="Y" else False
+    if parse_args.lazy is not None:
+        lazy = True if parse_args.lazy=="Y" else False
+    if parse_args.run_state_file is not None:
+        run_state_file = parse_args.run_state_file
+    if parse_args.incremental is not None:
+        incremental = True if parse_args.incremental=="Y" else False
+    if parse_args.resume is not None:
+        resume = True if parse_args.resume=="Y" else False
+    if parse_args.checkpoint_dir is not None:
+        checkpoint_dir = parse_args.checkpoint_dir
+    if parse_args.checkpoint is not None:
+        checkpoint = True if parse_args.checkpoint=="Y" else False
+    if parse_args.metrics_file is not None:
+        metrics_file = parse_args.metrics_file
+    if parse_args.prometheus_file is not None:
+        prometheus_file = parse_args.prometheus_file
+    if parse_args.profile is not None:
+        profile = True if parse_args.profile=="Y" else False
+    if parse_args.profile_dir is not None:
+        profile_dir = parse_args.profile_dir
         
     # prepare filter levels array
     if len(filter_levels_str.strip()) > 0:
         filter_levels = [item.strip() for item in filter_levels_str.split(",")]
     print(f"filter_levels (split): {filter_levels}")
+    if plan:
+        plan_ecmwf_data(download_path=download_path, prepped_path=prepped_path, filter_levels=filter_levels,
+                        number_of_days=number_of_days, step_counter=step_counter,
+                        push_destination=push_destination, push_data_path=push_data_path,
+                        yaml_file=yaml_file, grib_cache_dir=grib_cache_dir,
+                        grib_cache_max_mb=grib_cache_max_mb, output_format=output_format,
+                        incremental=incremental)
+        raise SystemExit(0)
     # kickoff the main processing function
     main_process_ecmwf_data(download_path=download_path, prepped_path=prepped_path, 
                             prepped_suffix=prepped_suffix, filter_levels=filter_levels, level=level,
                             number_of_days=number_of_days, step_counter=step_counter,
                             push_destination=push_destination, push_data_path=push_data_path,
                             yaml_file=yaml_file, 
-                            delete_s3_files=delete_s3_files
+                            delete_s3_files=delete_s3_files,
+                            max_parallel_downloads=max_parallel_downloads,
+                            memory_budget=memory_budget,
+                            decode_workers=decode_workers,
+                            grib_cache_dir=grib_cache_dir,
+                            grib_cache_max_mb=grib_cache_max_mb,
+                            output_format=output_format,
+                            lazy=lazy,
+                            run_state_file=run_state_file,
+                            incremental=incremental,
+                            resume=resume,
+                            checkpoint_dir=checkpoint_dir,
+                            checkpoint=checkpoint,
+                            metrics_file=metrics_file,
+                            prometheus_file=prometheus_file,
+                            profile=profile,
+                            profile_dir=profile_dir
                             )
     
\ No newline at end of file
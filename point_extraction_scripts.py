@@ -0,0 +1,217 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import yaml
+import logging
+# ******************************************************************************************
+# Time series at named places (district centres, hydro stations) from the decoded box.
+#
+# The places in the 'places' section of the yaml are given with their latitude/longitude. With
+# geocode: true, a place given by name only is geocoded once, through Nominatim, and the
+# coordinates kept in a local json cache, so later runs make no geocoding requests. For the grid of the box a
+# table of grid point indices and weights per place is worked out once (nearest: 1 point,
+# bilinear: the 4 surrounding points), then every place's values for every param and
+# forecast hour come out of the day's grid values in a single gather.
+# ******************************************************************************************
+
+POINT_METHODS = ["nearest", "bilinear"]
+GEOCODE_USER_AGENT = "ecmwf_data_pipeline"
+
+
+def load_places_config(yaml_file=""):
+    # the 'places' section of the yaml, {} when there is none
+    with open(yaml_file, 'r') as f:
+        data = yaml.load(f, Loader=yaml.SafeLoader)
+    places_config = data.get("places") or {}
+    method = places_config.get("method", "bilinear")
+    if method not in POINT_METHODS:
+        raise ValueError(f"Unknown point extraction method: {method}, expected one of {POINT_METHODS}")
+    return places_config
+
+
+def load_geocode_cache(cache_file=""):
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, 'r') as f:
+        return json.load(f)
+
+
+def save_geocode_cache(cache_file="", geocode_cache={}):
+    tmp_cache_file = f"{cache_file}.tmp"
+    with open(tmp_cache_file, 'w') as f:
+        json.dump(geocode_cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_cache_file, cache_file)
+
+
+def geocode_places(places_config={}):
+    """
+    Resolves the coordinates of the configured places, geocoding only those not in the cache.
+
+    Places without latitude/longitude are geocoded only with geocode: true in the places config,
+    else they are left out with a warning. A place which can not be geocoded is left out with a
+    warning too, it does not fail the run.
+
+    Returns:
+        list: [{"name", "latitude", "longitude"}] in the configured order.
+    """
+    cache_file = places_config.get("geocode_cache_file", "")
+    country = places_config.get("country", "")
+    geocode_enabled = bool(places_config.get("geocode", False))
+    geocode_cache = load_geocode_cache(cache_file) if geocode_enabled else {}
+    cache_updated = False
+    geocode = None
+
+    places = []
+    for location in places_config.get("locations", []):
+        name = location["name"]
+        if "latitude" in location and "longitude" in location:
+            places.append({"name": name, "latitude": float(location["latitude"]),
+                           "longitude": float(location["longitude"])})
+            continue
+        if not geocode_enabled:
+            logging.warning(f"Place {name} has no latitude/longitude and geocoding is off, left out")
+            continue
+        query = f"{name}, {country}" if country else name
+        if query not in geocode_cache:
+            if geocode is None:
+                # NOTE: imported here, geopy is only needed for places not in the cache yet
+                from geopy.geocoders import Nominatim
+                from geopy.extra.rate_limiter import RateLimiter
+                # Nominatim's usage policy: at most 1 request per second
+                geolocator = Nominatim(user_agent=GEOCODE_USER_AGENT, timeout=10)
+                geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1, max_retries=2,
+                                      swallow_exceptions=True)
+            found = geocode(query)
+            if found is None:
+                logging.warning(f"Unable to geocode place: {query}, left out")
+                continue
+            geocode_cache[query] = {"latitude": found.latitude, "longitude": found.longitude}
+            cache_updated = True
+            logging.info(f"Geocoded place: {query} -> {geocode_cache[query]}")
+        places.append({"name": name, **geocode_cache[query]})
+
+    if cache_updated and cache_file:
+        save_geocode_cache(cache_file, geocode_cache)
+    return places
+
+
+def get_axis_neighbours(axis=None, values=None):
+    # for each value, the indices (in axis order, ascending or descending) of the two axis
+    # points around it and the weight of the second one
+    order = np.argsort(axis)
+    sorted_axis = axis[order]
+    pos = np.clip(np.searchsorted(sorted_axis, values, side="right") - 1, 0, len(axis) - 2)
+    lower = sorted_axis[pos]
+    upper = sorted_axis[pos + 1]
+    weights = np.clip((values - lower) / (upper - lower), 0, 1)
+    return order[pos], order[pos + 1], weights
+
+
+def get_point_weight_table(grid_lats=None, grid_lons=None, places=[], method="bilinear"):
+    """
+    Grid point indices and weights per place, on a lat-major grid of grid_lats x grid_lons.
+
+    Places outside the grid are left out with a warning.
+
+    Returns:
+        dict: {"places": [...], "indices": (places, k) flat grid indices, "weights": (places, k)},
+              k is 1 for nearest and 4 for bilinear.
+    """
+    place_lats = np.array([place["latitude"] for place in places], dtype=np.float64)
+    place_lons = np.array([place["longitude"] for place in places], dtype=np.float64)
+    inside = ((place_lats >= grid_lats.min()) & (place_lats <= grid_lats.max()) &
+              (place_lons >= grid_lons.min()) & (place_lons <= grid_lons.max()))
+    for place in [place for place, is_inside in zip(places, inside) if not is_inside]:
+        logging.warning(f"Place {place['name']} ({place['latitude']}, {place['longitude']}) is outside the grid, left out")
+    places = [place for place, is_inside in zip(places, inside) if is_inside]
+    place_lats, place_lons = place_lats[inside], place_lons[inside]
+    n_lon = len(grid_lons)
+
+    if method == "nearest" or len(grid_lats) < 2 or len(grid_lons) < 2:
+        lat_idx = np.abs(grid_lats[None, :] - place_lats[:, None]).argmin(axis=1)
+        lon_idx = np.abs(grid_lons[None, :] - place_lons[:, None]).argmin(axis=1)
+        indices = (lat_idx * n_lon + lon_idx)[:, None]
+        weights = np.ones(indices.shape, dtype=np.float64)
+    else:
+        lat0, lat1, wy = get_axis_neighbours(grid_lats, place_lats)
+        lon0, lon1, wx = get_axis_neighbours(grid_lons, place_lons)
+        indices = np.stack([lat0 * n_lon + lon0, lat0 * n_lon + lon1,
+                            lat1 * n_lon + lon0, lat1 * n_lon + lon1], axis=1)
+        weights = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx], axis=1)
+    return {"places": places, "indices": indices, "weights": weights}
+
+
+def get_day_dataframe_grid(df=None):
+    """
+    The (lats, lons) grid axes of a combined day dataframe, and the number of rows per param.
+
+    The combined dataframe holds one block of grid rows per param_tag, each in the same lat-major order.
+    """
+    n_blocks = df["param_tag"].nunique()
+    block_rows = len(df) // n_blocks
+    block = df.iloc[:block_rows]
+    grid_lats = pd.unique(block["latitude"].to_numpy())
+    grid_lons = pd.unique(block["longitude"].to_numpy())
+    if len(grid_lats) * len(grid_lons) != block_rows or n_blocks * block_rows != len(df):
+        raise ValueError("The combined day dataframe is not a regular lat-major grid per param")
+    return grid_lats, grid_lons, block_rows
+
+
+def get_cached_point_weight_table(point_tables={}, grid_lats=None, grid_lons=None, places=[], method="bilinear"):
+    # the table is worked out once per grid, the days of a run share the grid
+    grid_key = (grid_lats.tobytes(), grid_lons.tobytes(), method)
+    if grid_key not in point_tables:
+        point_tables[grid_key] = get_point_weight_table(grid_lats=grid_lats, grid_lons=grid_lons,
+                                                        places=places, method=method)
+    return point_tables[grid_key]
+
+
+def extract_points_from_grid_values(values=None, grid_lats=None, grid_lons=None, block_df=None, hour_cols=[],
+                                     places=[], method="bilinear", point_tables={}):
+    """
+    The per place time series from the grid values of a day.
+
+    Args:
+        values: (param block, forecast hour, lat-major grid point) array, e.g. a view of the
+                combined day dataframe or the disk backed array of a lazy day.
+        block_df (pd.DataFrame): forecast_date, param and param_tag of each param block.
+
+    Returns:
+        pd.DataFrame: one row per place and param: place, place_latitude, place_longitude,
+                      forecast_date, param, param_tag and the forecast hour columns.
+    """
+    point_table = get_cached_point_weight_table(point_tables=point_tables, grid_lats=grid_lats,
+                                                grid_lons=grid_lons, places=places, method=method)
+    table_places = point_table["places"]
+    n_blocks = values.shape[0]
+    n_places = len(table_places)
+
+    # a single gather for every param block, forecast hour, place and neighbour
+    point_values = np.einsum('bhpk,pk->bph', values[:, :, point_table["indices"]], point_table["weights"])
+
+    points_df = pd.DataFrame({
+        "place": np.tile([place["name"] for place in table_places], n_blocks),
+        "place_latitude": np.tile([place["latitude"] for place in table_places], n_blocks),
+        "place_longitude": np.tile([place["longitude"] for place in table_places], n_blocks),
+        "forecast_date": np.repeat(block_df["forecast_date"].to_numpy(), n_places),
+        "param": np.repeat(block_df["param"].to_numpy(), n_places),
+        "param_tag": np.repeat(block_df["param_tag"].astype(str).to_numpy(), n_places),
+    })
+    points_df[hour_cols] = point_values.reshape(n_blocks * n_places, len(hour_cols))
+    return points_df
+
+
+def extract_points_from_day_dataframe(df=None, places=[], method="bilinear", point_tables={}):
+    """
+    The per place time series of a combined day dataframe, see extract_points_from_grid_values.
+    """
+    grid_lats, grid_lons, block_rows = get_day_dataframe_grid(df)
+    hour_cols = [col for col in df.columns if col.endswith("h") and col[:-1].isdigit()]
+    n_blocks = len(df) // block_rows
+    # a view of the hour columns as (param block, forecast hour, grid point)
+    values = df[hour_cols].to_numpy(dtype=np.float64).reshape(n_blocks, block_rows, len(hour_cols)).transpose(0, 2, 1)
+    block_df = df.iloc[np.arange(n_blocks) * block_rows]
+    return extract_points_from_grid_values(values=values, grid_lats=grid_lats, grid_lons=grid_lons,
+                                           block_df=block_df, hour_cols=hour_cols, places=places,
+                                           method=method, point_tables=point_tables)
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import threading
+import resource
+import cProfile
+import pstats
+import io
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import logging
+# ******************************************************************************************
+# Run metrics: wall/cpu time and memory per pipeline stage, plus run counters (bytes
+# downloaded/uploaded, rows, cache hits ...), reported once per run as json and optionally
+# in the Prometheus text format (e.g. for the node_exporter textfile collector).
+#
+# The stages run in the download/decode/publish threads, so the cpu time of a stage is the
+# cpu time of its thread; memory is the process rss, current and peak (high water mark) at
+# the end of the stage.
+# ******************************************************************************************
+
+PROMETHEUS_METRIC_PREFIX = "ecmwf_pipeline"
+PROFILE_TOP_FUNCTIONS = 40
+
+_run_metrics_lock = threading.Lock()
+_run_stages = []
+_run_counters = {}
+_stage_profiles = {}
+
+
+def reset_run_metrics():
+    with _run_metrics_lock:
+        _run_stages.clear()
+        _run_counters.clear()
+        _stage_profiles.clear()
+
+
+def get_rss_mb():
+    # current resident set size, linux only
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on linux, in bytes on macOS
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+def add_run_metric(name="", value=1):
+    with _run_metrics_lock:
+        _run_counters[name] = _run_counters.get(name, 0) + value
+
+
+@contextmanager
+def measure_stage(stage="", day=None):
+    """Records the wall time, thread cpu time and memory of the block as one stage run."""
+    started_at = datetime.now(timezone.utc).isoformat()
+    start_t = time.perf_counter()
+    start_cpu = time.thread_time()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        stage_run = {"stage": stage, "day": day, "status": status, "started_at": started_at,
+                     "wall_s": round(time.perf_counter() - start_t, 3),
+                     "cpu_s": round(time.thread_time() - start_cpu, 3),
+                     "rss_mb": round(get_rss_mb() or 0, 1),
+                     "peak_rss_mb": round(get_peak_rss_mb(), 1)}
+        with _run_metrics_lock:
+            _run_stages.append(stage_run)
+
+
+@contextmanager
+def profile_stage(stage="", enabled=False):
+    """With enabled, runs the block under cProfile; the profiles are added up per stage."""
+    if not enabled:
+        yield
+        return
+    # NOTE: cProfile follows the calling thread only, work in other processes is not seen
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        with _run_metrics_lock:
+            _stage_profiles.setdefault(stage, []).append(profile)
+
+
+def save_stage_profiles(profile_dir=""):
+    """Writes {stage}.pstats (for snakeviz, pstats ...) and the top functions as {stage}_profile.txt."""
+    with _run_metrics_lock:
+        stage_profiles = {stage: list(profiles) for stage, profiles in _stage_profiles.items()}
+    for stage, profiles in stage_profiles.items():
+        os.makedirs(profile_dir, exist_ok=True)
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=stats_text)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{profile_dir}/{stage}.pstats")
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        with open(f"{profile_dir}/{stage}_profile.txt", 'w') as f:
+            f.write(stats_text.getvalue())
+        logging.info(f"cProfile of stage {stage} saved to: {profile_dir}/{stage}.pstats")
+
+
+def get_run_metrics_report(run_info={}):
+    """The run report: the stage runs, their totals per stage and the run counters."""
+    with _run_metrics_lock:
+        stages = list(_run_stages)
+        counters = dict(_run_counters)
+    stage_totals = {}
+    for stage_run in stages:
+        totals = stage_totals.setdefault(stage_run["stage"], {"runs": 0, "failed": 0, "wall_s": 0.0,
+                                                              "cpu_s": 0.0, "peak_rss_mb": 0.0})
+        totals["runs"] += 1
+        totals["failed"] += stage_run["status"] != "ok"
+        totals["wall_s"] = round(totals["wall_s"] + stage_run["wall_s"], 3)
+        totals["cpu_s"] = round(totals["cpu_s"] + stage_run["cpu_s"], 3)
+        totals["peak_rss_mb"] = max(totals["peak_rss_mb"], stage_run["peak_rss_mb"])
+    return {**run_info,
+            "peak_rss_mb": round(get_peak_rss_mb(), 1),
+            # e.g. the decode worker processes, once they have exited
+            "children_peak_rss_mb": round(get_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+            "process_cpu_s": round(time.process_time(), 3),
+            "counters": counters,
+            "stage_totals": stage_totals,
+            "stages": stages}
+
+
+def get_prometheus_metrics(report={}):
+    # Prometheus text exposition format, gauges only
+    lines = []
+
+    def add_gauge(name, help_text, samples):
+        lines.append(f"# HELP {PROMETHEUS_METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_METRIC_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{PROMETHEUS_METRIC_PREFIX}_{name}{{{label_text}}} {value}" if label_text
+                         else f"{PROMETHEUS_METRIC_PREFIX}_{name} {value}")
+
+    stage_totals = report.get("stage_totals", {})
+    add_gauge("stage_wall_seconds", "Wall time of the stage, summed over its runs.",
+              [({"stage": stage}, totals["wall_s"]) for stage, totals in stage_totals.items()])
+    add_gauge("stage_cpu_seconds", "Cpu time of the stage thread, summed over its runs.",
+              [({"stage": stage}, totals["cpu_s"]) for stage, totals in stage_totals.items()])
+    add_gauge("stage_runs", "Number of runs of the stage.",
+              [({"stage": stage}, totals["runs"]) for stage, totals in stage_totals.items()])
+    add_gauge("stage_failed_runs", "Number of failed runs of the stage.",
+              [({"stage": stage}, totals["failed"]) for stage, totals in stage_totals.items()])
+    for name, value in sorted(report.get("counters", {}).items()):
+        add_gauge(name, f"Run counter {name}.", [({}, value)])
+    add_gauge("peak_rss_bytes", "Peak resident set size of the run.",
+              [({}, int(report.get("peak_rss_mb", 0) * 1024 * 1024))])
+    if "wall_s" in report:
+        add_gauge("run_wall_seconds", "Wall time of the run.", [({}, report["wall_s"])])
+    if "status" in report:
+        add_gauge("run_success", "1 if the run succeeded, else 0.", [({}, int(bool(report["status"])))])
+    add_gauge("run_timestamp_seconds", "Unix time the report was written.", [({}, int(time.time()))])
+    return "\n".join(lines) + "\n"
+
+
+def save_run_metrics_report(report_file="", prometheus_file="", run_info={}):
+    """Writes the run report as json, and in the Prometheus text format if prometheus_file is given."""
+    report = get_run_metrics_report(run_info=run_info)
+    for target_file, content in [(report_file, lambda: json.dumps(report, indent=1)),
+                                 (prometheus_file, lambda: get_prometheus_metrics(report))]:
+        if not target_file:
+            continue
+        os.makedirs(os.path.dirname(target_file) or ".", exist_ok=True)
+        # written under a temp name and renamed, a textfile collector never reads half a file
+        with open(f"{target_file}.tmp", 'w') as f:
+            f.write(content())
+        os.replace(f"{target_file}.tmp", target_file)
+        logging.info(f"Run metrics saved to: {target_file}")
+
+    for stage, totals in report["stage_totals"].items():
+        logging.info(f"Stage {stage}: {totals['runs']} runs, wall {totals['wall_s']}s, cpu {totals['cpu_s']}s, "
+                     f"peak rss {totals['peak_rss_mb']} MB")
+    return report
@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+import logging
+# ******************************************************************************************
+# Run state: which forecast steps of which ECMWF run have been processed and published.
+#
+# Kept as a small json file, locally and mirrored under the s3 push prefix (the workflow
+# runners are fresh on every run, so the s3 copy is the one that carries over). It holds the
+# run (date, cycle, stream), the processed (date, cycle, step) tuples and, per published day,
+# the files with their md5. A later run of the same ECMWF run and the same config skips the
+# days whose steps are all processed and whose files are still in place; a newer run, or a
+# change of config (yaml, output format, levels ...), starts over.
+#
+# It is also the checkpoint journal of the run: the units (download/{step}, decode/{step},
+# combine/{day}, publish/{day}) as done or failed, with the checkpoint file a done unit left
+# (the grib2 file, the decoded step frame, the combined day). The local file is rewritten as
+# each unit ends, so it holds up even when the run is killed; a resumed run picks up the done
+# units whose files are still there and redoes the rest.
+# ******************************************************************************************
+
+S3_RUN_STATE_FILE = "_run_state.json"
+# under TEMP_DIR, unless a run state file is given
+RUN_STATE_FILE_NAME = "ecmwf_run_state.json"
+# under TEMP_DIR, unless a checkpoint folder is given
+CHECKPOINT_DIR_NAME = "ecmwf_checkpoint"
+
+# the days are published from several threads
+_run_state_lock = threading.Lock()
+
+
+def get_s3_run_state_key(object_prefix=""):
+    return f"{object_prefix.rstrip('/')}/{S3_RUN_STATE_FILE}"
+
+
+def get_run_config_key(run_config={}):
+    # what shapes the published files, other than the ecmwf run itself
+    return hashlib.sha1(json.dumps(run_config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_run_id(run_date=None, stream_to_use="oper"):
+    return {"date": run_date.strftime('%Y%m%d'), "cycle": run_date.strftime('%H'), "stream": stream_to_use}
+
+
+def load_run_state(state_file="", bucket="", object_prefix="", s3_client=None):
+    """The run state, from s3 when given an s3 client, else (or if not on s3 yet) from state_file; {} if none."""
+    if s3_client is not None:
+        state_key = get_s3_run_state_key(object_prefix)
+        try:
+            s3_file = s3_client.get_object(Bucket=bucket, Key=state_key)
+            return json.loads(s3_file['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logging.warning(f"Unable to load run state s3://{bucket}/{state_key}: {e}")
+    if state_file and os.path.exists(state_file):
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        except Exception as ex:
+            # a broken state only costs a full rerun
+            logging.warning(f"Unable to read run state {state_file}, starting over: {ex}")
+    return {}
+
+
+def write_run_state_file(run_state={}, state_file=""):
+    # written under a temp name and renamed, a killed run never leaves half a state
+    with _run_state_lock:
+        run_state["updated_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        body = json.dumps(run_state, indent=1)
+        if state_file:
+            os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+            with open(f"{state_file}.tmp", 'w') as f:
+                f.write(body)
+            os.replace(f"{state_file}.tmp", state_file)
+    return body
+
+
+def save_run_state(run_state={}, state_file="", bucket="", object_prefix="", s3_client=None):
+    body = write_run_state_file(run_state=run_state, state_file=state_file)
+    if s3_client is not None:
+        state_key = get_s3_run_state_key(object_prefix)
+        try:
+            s3_client.put_object(Body=body.encode("utf-8"), Bucket=bucket, Key=state_key,
+                                 ContentType="application/json")
+        except ClientError as e:
+            logging.error(f"Run state save failed -> s3://{bucket}/{state_key}: {e}")
+            return False
+    logging.info(f"Run state saved: {len(run_state.get('processed', []))} steps of run {run_state.get('run')}")
+    return True
+
+
+def get_run_date(run_state={}):
+    # the date of the run in the state, None if there is none
+    run_id = run_state.get("run")
+    if not run_id:
+        return None
+    return datetime.strptime(f"{run_id['date']}{run_id['cycle']}", '%Y%m%d%H').replace(tzinfo=timezone.utc)
+
+
+def start_run_state(run_state={}, run_id={}, config_key="", resume=False):
+    """
+    Carried over for the same run and config, else a fresh state for this run.
+
+    The published days are always carried over; the units of the journal only when resuming.
+    """
+    if run_state.get("run") == run_id and run_state.get("config_key") == config_key:
+        if not resume:
+            run_state["units"] = {}
+        run_state.setdefault("units", {})
+        return run_state
+    if run_state.get("run"):
+        logging.info(f"Run state of run {run_state.get('run')} superseded by run {run_id}")
+    if resume:
+        logging.warning(f"Nothing to resume for run {run_id}, the run starts over")
+    return {"run": run_id, "config_key": config_key, "processed": [], "days": {}, "units": {}}
+
+
+def record_run_unit(run_state={}, unit="", status="done", unit_file="", error="", state_file=""):
+    # e.g. unit "download/36", "decode/36", "combine/2" or "publish/2", journaled to state_file right away
+    with _run_state_lock:
+        run_state.setdefault("units", {})[unit] = {"status": status, "file": unit_file, "error": error,
+                                                    "at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")}
+    if status != "done":
+        logging.warning(f"Run unit {unit} {status}: {error}")
+    write_run_state_file(run_state=run_state, state_file=state_file)
+
+
+def get_done_unit_file(run_state={}, unit=""):
+    # the checkpoint file of a done unit, "" if the unit is not done or its file is gone
+    with _run_state_lock:
+        run_unit = run_state.get("units", {}).get(unit, {})
+    if run_unit.get("status") == "done" and run_unit.get("file") and os.path.exists(run_unit["file"]):
+        return run_unit["file"]
+    return ""
+
+
+def get_failed_units(run_state={}):
+    with _run_state_lock:
+        return {unit: run_unit["error"] for unit, run_unit in run_state.get("units", {}).items()
+                if run_unit["status"] != "done"}
+
+
+def is_day_published(run_state={}, cnt=0, chunk=[], push_destination="", known_md5s={}):
+    """True if every step of the day is processed and its files are still in place, unchanged."""
+    processed_steps = {step for date, cycle, step in run_state.get("processed", [])}
+    day = run_state.get("days", {}).get(str(cnt + 1))
+    if day is None or day["steps"] != list(chunk) or not set(chunk) <= processed_steps:
+        return False
+    for key, entry in day["files"].items():
+        if push_destination == "s3":
+            if known_md5s.get(key) != entry["md5"]:
+                return False
+        elif not os.path.exists(key) or os.path.getsize(key) != entry["size"]:
+            return False
+    return True
+
+
+def record_day_published(run_state={}, cnt=0, chunk=[], entries=[]):
+    # the steps of the day as processed, with the files they were published to
+    run_id = run_state["run"]
+    with _run_state_lock:
+        processed = [item for item in run_state["processed"] if item[2] not in chunk]
+        processed += [[run_id["date"], run_id["cycle"], step] for step in chunk]
+        run_state["processed"] = sorted(processed, key=lambda item: item[2])
+        run_state["days"][str(cnt + 1)] = {"steps": list(chunk),
+                                           "files": {entry["key"]: {"md5": entry["md5"], "size": entry["size"]}
+                                                     for entry in entries}}
+
+
+def get_published_day_files(run_state={}, day_numbers=[]):
+    # {key: {"md5", "size"}} of the given published days, e.g. for the manifest
+    day_files = {}
+    for day_number in day_numbers:
+        day_files.update(run_state.get("days", {}).get(str(day_number), {}).get("files", {}))
+    return day_files
@@ -2,12 +2,17 @@ import os
 import boto3
 import pickle
 import json
+import hashlib
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import pandas as pd 
 import logging
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-from io import StringIO, BytesIO
+from io import BytesIO
 
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
 # ******************************************************************************************
 
@@ -31,19 +36,56 @@ def get_s3_settings():
     return s3_settings
 
 
+# One client per process (and set of settings), shared by all the threads of the pipeline:
+# boto3 clients are thread safe, and reusing one keeps its connection pool, so credentials
+# are resolved and TLS handshakes done once rather than per call.
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=32,    # >= the parallel day uploads x the parts in flight per upload
+    retries={"max_attempts": 10, "mode": "adaptive"},
+    tcp_keepalive=True,
+    connect_timeout=10,
+    read_timeout=60,
+)
+# sizes the multipart uploads (upload_file, upload_fileobj and upload_stream_to_s3) and the
+# number of concurrent uploads
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+_s3_clients_lock = threading.Lock()
+_s3_clients = {}
+
+
 def get_s3_client():
+    """Returns the shared s3 client and the bucket name; do not close the client, see close_s3_clients."""
     s3_settings = get_s3_settings()
     bucket = s3_settings['S3_BUCKET_NAME']
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=s3_settings["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=s3_settings['AWS_SECRET_ACCESS_KEY'],
-        region_name=s3_settings['S3_REGION']  # e.g., 'us-east-2'
-    )
+    client_key = (s3_settings["AWS_ACCESS_KEY_ID"], s3_settings['AWS_SECRET_ACCESS_KEY'], s3_settings['S3_REGION'])
+    with _s3_clients_lock:
+        s3_client = _s3_clients.get(client_key)
+        if s3_client is None:
+            s3_session = boto3.session.Session(
+                aws_access_key_id=s3_settings["AWS_ACCESS_KEY_ID"],
+                aws_secret_access_key=s3_settings['AWS_SECRET_ACCESS_KEY'],
+                region_name=s3_settings['S3_REGION']  # e.g., 'us-east-2'
+            )
+            s3_client = s3_session.client('s3', config=S3_CLIENT_CONFIG)
+            _s3_clients[client_key] = s3_client
 
     return s3_client, bucket
 
 
+def close_s3_clients():
+    # at the end of the run, closes the pooled connections of the shared clients
+    with _s3_clients_lock:
+        for s3_client in _s3_clients.values():
+            s3_client.close()
+        _s3_clients.clear()
+
+
 def verify_object_exists(bucket: str=None, key: str=None, s3_client=None) -> bool:
     """Verify object exists and return True (calls head_object)."""
     verify_status = False
@@ -58,40 +100,115 @@ def verify_object_exists(bucket: str=None, key: str=None, s3_client=None) -> boo
     return verify_status
 
 
+# *************  Listing and deleting many objects
+# list_objects_v2 returns at most 1000 keys per call and delete_objects takes at most 1000 keys,
+# so both go page by page / batch by batch. A prefix with sub-prefixes (e.g. the partitions
+# forecast_date=.../) is split on "/" and the sub-prefixes are listed concurrently.
+S3_DELETE_BATCH_SIZE = 1000
+S3_MAX_PARALLEL_REQUESTS = 8
+S3_LIST_SPLIT_DEPTH = 2
+
+def list_prefix_objects(bucket:str="", s3_client=None, object_prefix="", delimiter="") -> tuple:
+    """
+    All the objects directly under object_prefix (all below it, when no delimiter), page by page.
+
+    Returns:
+        tuple: (object entries {"Key", "ETag", "Size", ..}, the common prefixes when a delimiter is given)
+    """
+    objects = []
+    common_prefixes = []
+    list_args = {"Bucket": bucket, "Prefix": object_prefix}
+    if delimiter:
+        list_args["Delimiter"] = delimiter
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**list_args):
+        # an empty prefix has no 'Contents'
+        objects.extend(page.get('Contents', []))
+        common_prefixes.extend(cp['Prefix'] for cp in page.get('CommonPrefixes', []))
+    return objects, common_prefixes
+
+
+def list_bucket_object_entries(bucket:str="", s3_client=None, object_prefix="",
+                               split_depth=S3_LIST_SPLIT_DEPTH, max_parallel_lists=S3_MAX_PARALLEL_REQUESTS) -> list:
+    """
+    All the objects under object_prefix, in key order, listing the sub-prefixes concurrently.
+
+    The prefix is split on "/" up to split_depth levels down; the objects directly at each level
+    are listed along the way, and every sub-prefix at the last level is listed in full in parallel.
+    """
+    objects = []
+    prefixes = [object_prefix]
+    for _ in range(split_depth):
+        sub_prefixes = []
+        for prefix in prefixes:
+            level_objects, level_prefixes = list_prefix_objects(bucket=bucket, s3_client=s3_client,
+                                                                object_prefix=prefix, delimiter="/")
+            objects.extend(level_objects)
+            sub_prefixes.extend(level_prefixes)
+        prefixes = sub_prefixes
+        if len(prefixes) >= max_parallel_lists or len(prefixes) == 0:
+            break
+    if len(prefixes) > 0:
+        with ThreadPoolExecutor(max_workers=min(max_parallel_lists, len(prefixes))) as executor:
+            for prefix_objects, _ in executor.map(lambda prefix: list_prefix_objects(bucket=bucket, s3_client=s3_client,
+                                                                                     object_prefix=prefix),
+                                                  prefixes):
+                objects.extend(prefix_objects)
+    return sorted(objects, key=lambda obj: obj['Key'])
+
+
 def list_bucket_objects(bucket:str="", s3_client=None, object_prefix="") -> list:
     lst_objects = []
     
     try:
-        # response = s3_client.list_objects_v2(Bucket=bucket)
-        if object_prefix != "":
-            response = s3_client.list_objects_v2(Bucket=bucket, Prefix=object_prefix)
-        else:
-            response = s3_client.list_objects_v2(Bucket=bucket)
-
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                lst_objects.append(f"{obj['Key']}")
-        else:
-            raise Exception("Contents not found in the list_objects_v2")
+        for obj in list_bucket_object_entries(bucket=bucket, s3_client=s3_client, object_prefix=object_prefix):
+            lst_objects.append(f"{obj['Key']}")
     except Exception as ex:
         logging.error(f"Error with exception: {ex}")
     
     return lst_objects
 
+
+def delete_s3_objects_in_batches(file_list=[], bucket:str="", s3_client=None,
+                                 max_parallel_deletes=S3_MAX_PARALLEL_REQUESTS) -> tuple:
+    """
+    Delete the keys in batches of S3_DELETE_BATCH_SIZE, the batches in parallel.
+
+    Returns:
+        tuple: (number of keys deleted, errors [{"Key", "Code", "Message"}] of the keys not deleted)
+    """
+    batches = [file_list[i:i + S3_DELETE_BATCH_SIZE] for i in range(0, len(file_list), S3_DELETE_BATCH_SIZE)]
+
+    def delete_batch(batch):
+        try:
+            # Quiet: the response lists only the keys which failed
+            response = s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{"Key": fl} for fl in batch], 'Quiet': True}
+            )
+            return response.get('Errors', [])
+        except Exception as e:
+            # the whole batch failed, report it per key, with the S3 error code when there is one
+            error_code = getattr(e, "response", {}).get("Error", {}).get("Code", type(e).__name__)
+            return [{"Key": fl, "Code": error_code, "Message": str(e)} for fl in batch]
+
+    errors = []
+    if len(batches) > 0:
+        with ThreadPoolExecutor(max_workers=min(max_parallel_deletes, len(batches))) as executor:
+            for batch_errors in executor.map(delete_batch, batches):
+                errors.extend(batch_errors)
+    return len(file_list) - len(errors), errors
+
     
 def remove_files_on_s3(file_list=None, bucket:str="", s3_client=None):
     status = False
 
     try:
-        files_to_delete = [{"Key":fl} for fl in file_list]
-        response = s3_client.delete_objects(
-            Bucket=bucket,
-            Delete={'Objects': files_to_delete, 'Quiet': False}
-        )
-        print(f"Files deleted successfully from bucket '{bucket}'.")
-        if 'Errors' in response:
-            print("Errors encountered during deletion:")
-            for error in response['Errors']:
+        deleted_cnt, errors = delete_s3_objects_in_batches(file_list=file_list, bucket=bucket, s3_client=s3_client)
+        print(f"{deleted_cnt} files deleted successfully from bucket '{bucket}'.")
+        if len(errors) > 0:
+            print(f"Errors encountered during deletion of {len(errors)} files:")
+            for error in errors:
                 print(f"  Code: {error['Code']}, Key: {error['Key']}, Message: {error['Message']}")
         else:
             status = True
@@ -107,7 +224,7 @@ def upload_as_file(local_path: str="", bucket: str="", key: str="", s3_client=No
     try:
         # NOTE: key is filename here...
         logging.info(f"Uploading local file {local_path} -> s3://{bucket}/{key}")
-        s3_client.upload_file(local_path, bucket, key)
+        s3_client.upload_file(local_path, bucket, key, Config=S3_TRANSFER_CONFIG)
         logging.info("Upload complete.")
         upl_f_status = True
     except (ClientError, FileNotFoundError) as e:
@@ -115,25 +232,6 @@ def upload_as_file(local_path: str="", bucket: str="", key: str="", s3_client=No
     return upl_f_status
 
 
-def upload_dataframe_as_csv(df: pd.DataFrame, bucket: str, key: str, s3_client=None):
-    """Upload a DataFrame to S3 as CSV (in-memory)"""
-    buf = StringIO()
-    upl_d_status = False
-
-    try:
-        df.to_csv(buf, index=False)
-        buf.seek(0)
-        # NOTE: key is filename here...
-        logging.info(f"Uploading DataFrame as CSV -> s3://{bucket}/{key}")
-        # put_object is fine for reasonably sized CSVs
-        s3_client.put_object(Body=buf.getvalue().encode("utf-8"), Bucket=bucket, Key=key)
-        logging.info("CSV upload complete.")
-        upl_d_status = True
-    except ClientError as e:
-        logging.error(f"CSV upload failed: {e}")
-    return upl_d_status
-
-
 def upload_dataframe_as_parquet(df: pd.DataFrame, bucket: str="", key: str="", s3_client=None):
     """Upload a DataFrame to S3 as Parquet (in-memory). Requires pyarrow or fastparquet."""
     buf = BytesIO()
@@ -154,7 +252,7 @@ def upload_dataframe_as_parquet(df: pd.DataFrame, bucket: str="", key: str="", s
         # NOTE: key is filename here...
         logging.info(f"Uploading DataFrame as Parquet -> s3://{bucket}/{key}")
         # Use upload_fileobj for streaming bytes
-        s3_client.upload_fileobj(buf, bucket, key)
+        s3_client.upload_fileobj(buf, bucket, key, Config=S3_TRANSFER_CONFIG)
         logging.info("Parquet upload complete.")
         upl_p_status = True
     except ClientError as e:
@@ -162,6 +260,288 @@ def upload_dataframe_as_parquet(df: pd.DataFrame, bucket: str="", key: str="", s
     return upl_p_status
 
 
+# *************  Streaming upload - multipart
+# Large outputs are serialized in row chunks straight into an S3 multipart upload, so the
+# memory used stays bounded by the part size times the parts in flight, however big the
+# output is. Outputs smaller than one part go up with a single put_object. A failed upload
+# is aborted, so no orphan parts are left behind (and still billed) on the bucket.
+MULTIPART_PART_SIZE = S3_TRANSFER_CONFIG.multipart_chunksize   # S3 minimum is 5 MB, but for the last part
+MULTIPART_MAX_PARALLEL_PARTS = S3_TRANSFER_CONFIG.max_concurrency
+CSV_CHUNK_ROWS = 100000
+
+def iter_dataframe_csv_chunks(df: pd.DataFrame, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield the CSV of df as utf-8 bytes, chunk_rows rows at a time; joined they equal df.to_csv(index=False)."""
+    yield df.iloc[:0].to_csv(index=False).encode("utf-8")
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode("utf-8")
+
+
+def iter_frames_csv_chunks(frames=[], chunk_rows=CSV_CHUNK_ROWS):
+    """Yield the CSV of the frames one after the other as utf-8 bytes, under the header of the first frame."""
+    for i, df in enumerate(frames):
+        chunks = iter_dataframe_csv_chunks(df, chunk_rows=chunk_rows)
+        if i > 0:
+            next(chunks)
+        yield from chunks
+
+
+def get_chunks_md5_and_size(chunks=[]):
+    """md5 and size of the concatenated chunks, without holding them together in memory."""
+    md5 = hashlib.md5()
+    size = 0
+    for chunk in chunks:
+        md5.update(chunk)
+        size += len(chunk)
+    return md5.hexdigest(), size
+
+
+def upload_stream_to_s3(chunks=[], bucket: str="", key: str="", s3_client=None, content_type="text/csv",
+                        part_size=MULTIPART_PART_SIZE, max_parallel_parts=MULTIPART_MAX_PARALLEL_PARTS) -> bool:
+    """
+    Upload the byte chunks to s3://{bucket}/{key} as a multipart upload with parallel parts.
+
+    At most max_parallel_parts parts are uploading at a time, while the next part is buffered,
+    so memory stays around (max_parallel_parts + 1) * part_size. Any failure aborts the upload.
+    """
+    upl_s_status = False
+    buffer = bytearray()
+    chunks = iter(chunks)
+
+    # fill the first part; if the chunks end before, it is a plain put_object
+    for chunk in chunks:
+        buffer.extend(chunk)
+        if len(buffer) >= part_size:
+            break
+    if len(buffer) < part_size:
+        try:
+            s3_client.put_object(Body=bytes(buffer), Bucket=bucket, Key=key, ContentType=content_type)
+            upl_s_status = True
+        except ClientError as e:
+            logging.error(f"Upload failed: {e}")
+        return upl_s_status
+
+    try:
+        upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]
+    except ClientError as e:
+        logging.error(f"Multipart upload failed to start for s3://{bucket}/{key}: {e}")
+        return upl_s_status
+    parts_in_flight = threading.BoundedSemaphore(max_parallel_parts)
+    part_futures = []
+
+    def upload_part(part_number, body):
+        try:
+            response = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                             PartNumber=part_number, Body=body)
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        finally:
+            parts_in_flight.release()
+
+    def submit_part(executor, body):
+        # blocks while max_parallel_parts are uploading, which bounds the memory held
+        parts_in_flight.acquire()
+        part_futures.append(executor.submit(upload_part, len(part_futures) + 1, body))
+        # fail fast on a part that already failed
+        for future in part_futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_parallel_parts) as executor:
+            try:
+                submit_part(executor, bytes(buffer[:part_size]))
+                del buffer[:part_size]
+                for chunk in chunks:
+                    buffer.extend(chunk)
+                    while len(buffer) >= part_size:
+                        submit_part(executor, bytes(buffer[:part_size]))
+                        del buffer[:part_size]
+                if len(buffer) > 0:
+                    submit_part(executor, bytes(buffer))
+                    buffer = bytearray()
+            except BaseException:
+                # do not start the parts still queued
+                for future in part_futures:
+                    future.cancel()
+                raise
+            parts = [future.result() for future in part_futures]
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                            MultipartUpload={"Parts": parts})
+        logging.info(f"Multipart upload of {len(parts)} parts complete -> s3://{bucket}/{key}")
+        upl_s_status = True
+    except BaseException as ex:
+        # also on KeyboardInterrupt, so an interrupted run leaves no orphan parts
+        logging.error(f"Multipart upload failed, aborting s3://{bucket}/{key}: {ex}")
+        try:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            logging.error(f"Abort of the multipart upload failed: {e}")
+        if not isinstance(ex, Exception):
+            raise
+    return upl_s_status
+
+
+def abort_stale_multipart_uploads(bucket: str="", object_prefix="", s3_client=None, older_than_hours=24):
+    """Abort the multipart uploads under object_prefix left over by runs which were killed midway."""
+    aborted_keys = []
+    try:
+        cutoff = datetime.now(timezone.utc).timestamp() - older_than_hours * 3600
+        paginator = s3_client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=bucket, Prefix=object_prefix):
+            for upload in page.get('Uploads', []):
+                if upload['Initiated'].timestamp() < cutoff:
+                    s3_client.abort_multipart_upload(Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+                    aborted_keys.append(upload['Key'])
+        if len(aborted_keys) > 0:
+            logging.info(f"Aborted {len(aborted_keys)} stale multipart uploads under s3://{bucket}/{object_prefix}: {aborted_keys}")
+    except Exception as ex:
+        logging.error(f"Error with exception: {ex}")
+    return aborted_keys
+
+
+# *************  Incremental publish - manifest based
+# The manifest object under the push prefix lists the current set of published keys with
+# the md5 of their content. A run uploads only the objects whose content changed, then
+# switches over by writing the new manifest in one put_object, and only after that removes
+# the objects the new manifest no longer lists. Readers never see an empty prefix.
+S3_MANIFEST_FILE = "_manifest.json"
+
+def get_s3_manifest_key(object_prefix=""):
+    return f"{object_prefix.rstrip('/')}/{S3_MANIFEST_FILE}"
+
+
+def load_s3_manifest(bucket: str="", object_prefix="", s3_client=None) -> dict:
+    """Load the manifest under object_prefix, an empty manifest if there is none yet."""
+    manifest = {"objects": {}}
+    manifest_key = get_s3_manifest_key(object_prefix)
+    try:
+        s3_file = s3_client.get_object(Bucket=bucket, Key=manifest_key)
+        manifest = json.loads(s3_file['Body'].read().decode('utf-8'))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+            logging.error(f"Unable to load manifest s3://{bucket}/{manifest_key}: {e}")
+    return manifest
+
+
+def save_s3_manifest(objects={}, bucket: str="", object_prefix="", s3_client=None) -> bool:
+    """Write the manifest for objects i.e. {key: {"md5": .., "size": ..}}, in a single put."""
+    save_status = False
+    manifest_key = get_s3_manifest_key(object_prefix)
+    manifest = {
+        "updated_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "objects": objects,
+    }
+    try:
+        s3_client.put_object(Body=json.dumps(manifest, indent=1).encode("utf-8"), Bucket=bucket,
+                             Key=manifest_key, ContentType="application/json")
+        logging.info(f"Manifest with {len(objects)} objects saved -> s3://{bucket}/{manifest_key}")
+        save_status = True
+    except ClientError as e:
+        logging.error(f"Manifest save failed: {e}")
+    return save_status
+
+
+def get_known_content_md5s(bucket: str="", object_prefix="", s3_client=None) -> dict:
+    """
+    Content md5 per key under object_prefix: from the ETag, else from the manifest.
+
+    The ETag of a single part upload is the md5 of its content, as stored, so it is used even
+    when the manifest says otherwise; multipart ETags (with a '-') are not, so those keys are
+    only known through the manifest.
+    """
+    known_md5s = {}
+    multipart_keys = set()
+    try:
+        for obj in list_bucket_object_entries(bucket=bucket, s3_client=s3_client, object_prefix=object_prefix):
+            etag = obj.get('ETag', '').strip('"')
+            if etag and '-' not in etag:
+                known_md5s[obj['Key']] = etag
+            else:
+                multipart_keys.add(obj['Key'])
+    except Exception as ex:
+        logging.error(f"Error with exception: {ex}")
+    manifest = load_s3_manifest(bucket=bucket, object_prefix=object_prefix, s3_client=s3_client)
+    for key, entry in manifest.get("objects", {}).items():
+        # a manifest key deleted since is not known, so it is uploaded again
+        if key in multipart_keys and entry.get("md5"):
+            known_md5s[key] = entry["md5"]
+    return known_md5s
+
+
+def upload_bytes_if_changed(body: bytes=b"", bucket: str="", key: str="", s3_client=None,
+                            known_md5s={}, content_type="text/csv"):
+    """
+    Upload body to s3://{bucket}/{key}, unless the stored object already has the same content.
+
+    Returns:
+        dict: {"key", "md5", "size", "uploaded", "status"} for the manifest.
+    """
+    body_view = memoryview(body)
+    return upload_hashed_chunks_if_changed(body_md5=hashlib.md5(body_view).hexdigest(), body_size=len(body_view),
+                                           get_chunks=lambda: (body_view[i:i + MULTIPART_PART_SIZE]
+                                                               for i in range(0, len(body_view), MULTIPART_PART_SIZE)),
+                                           bucket=bucket, key=key, s3_client=s3_client,
+                                           known_md5s=known_md5s, content_type=content_type)
+
+
+def spool_chunks(chunks=[], spool=None):
+    # pass the chunks through, keeping a copy in the spool file
+    for chunk in chunks:
+        spool.write(chunk)
+        yield chunk
+
+
+def upload_chunks_if_changed(get_chunks=None, bucket: str="", key: str="", s3_client=None,
+                             known_md5s={}, content_type="text/csv"):
+    """
+    Upload the chunks from get_chunks() to s3://{bucket}/{key}, unless the stored object already
+    has the same content.
+
+    The chunks are serialized once: hashed while spooled (in memory up to a part, then to a temp
+    file under TEMP_DIR), and a changed content is streamed to the upload from the spool.
+
+    Returns:
+        dict: {"key", "md5", "size", "uploaded", "status"} for the manifest.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=MULTIPART_PART_SIZE, dir=os.getenv('TEMP_DIR')) as spool:
+        body_md5, body_size = get_chunks_md5_and_size(spool_chunks(chunks=get_chunks(), spool=spool))
+        spool.seek(0)
+        return upload_hashed_chunks_if_changed(body_md5=body_md5, body_size=body_size,
+                                               get_chunks=lambda: iter(lambda: spool.read(MULTIPART_PART_SIZE), b""),
+                                               bucket=bucket, key=key, s3_client=s3_client,
+                                               known_md5s=known_md5s, content_type=content_type)
+
+
+def upload_hashed_chunks_if_changed(body_md5="", body_size=0, get_chunks=None, bucket: str="", key: str="",
+                                    s3_client=None, known_md5s={}, content_type="text/csv"):
+    """Upload the chunks from get_chunks() of a content already hashed, unless known_md5s has that md5 for key."""
+    result = {"key": key, "md5": body_md5, "size": body_size, "uploaded": False, "status": False}
+    if known_md5s.get(key) == body_md5:
+        logging.info(f"Unchanged, upload skipped: s3://{bucket}/{key}")
+        result["status"] = True
+        return result
+    logging.info(f"Uploading changed content -> s3://{bucket}/{key}")
+    if upload_stream_to_s3(chunks=get_chunks(), bucket=bucket, key=key, s3_client=s3_client,
+                           content_type=content_type):
+        result["uploaded"] = True
+        result["status"] = True
+    return result
+
+
+def remove_stale_files_on_s3(keep_keys=[], bucket: str="", object_prefix="", s3_client=None):
+    """Delete the objects under object_prefix which are neither in keep_keys nor the manifest."""
+    keep = set(keep_keys)
+    keep.add(get_s3_manifest_key(object_prefix))
+    stale_keys = [key for key in list_bucket_objects(bucket=bucket, s3_client=s3_client,
+                                                     object_prefix=object_prefix)
+                  if key not in keep]
+    if len(stale_keys) == 0:
+        logging.info(f"No stale files under s3://{bucket}/{object_prefix}")
+        return True, stale_keys
+    logging.info(f"Removing {len(stale_keys)} stale files under s3://{bucket}/{object_prefix}: {stale_keys}")
+    del_status = remove_files_on_s3(file_list=stale_keys, bucket=bucket, s3_client=s3_client)
+    return del_status, stale_keys
+
+
 def download_file(file_type:str="csv", download_path:str="",
                    bucket:str="", key:str="", s3_client=None):
     dwl_f_status= False
@@ -184,16 +564,15 @@ def download_file(file_type:str="csv", download_path:str="",
 
 
 def load_csv_from_s3_to_dataframe(s3_file_key="", bucket="", s3_client=None):
+    df = None
     try:
         # get the s3 - stored csv file as an object 
         s3_file = s3_client.get_object(Bucket=bucket, Key=s3_file_key)
 
-        # load the object's body (CSV content), decoded as utf-8
-        csv_data = s3_file['Body'].read().decode('utf-8')
-
-        # load to a pandas dataframe, the io.StringIO contents of csv_data file-like object 
-        # and read into pandas DataFrame
-        df = pd.read_csv(StringIO(csv_data)) 
+        # stream the object's body (CSV content) straight into the parser, rather than
+        # holding it as bytes, a decoded string and a StringIO copy
+        # NOTE: for columns / row filters, see load_ecmwf_output in ecmwf_data_reader_scripts.py
+        df = pd.read_csv(s3_file['Body'])
     except s3_client.exceptions.NoSuchKey:
         print(f"Error: The object '{s3_file_key}' was not found in bucket '{bucket}'.")
     except Exception as e:
@@ -0,0 +1,30 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# the pipeline modules are flat scripts at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def opendata_server(tmp_path, monkeypatch):
+    """A local http stand-in for the ECMWF open data server, add the step files with add_step_file(server.root)."""
+    import ecmwf_data_processing_scripts
+    from opendata_stand_in import RangeRequestHandler
+
+    root = tmp_path / "opendata"
+    root.mkdir()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), lambda *args: RangeRequestHandler(*args, directory=str(root)))
+    server.root = str(root)
+    server.requested = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("ECMWF_OPENDATA_SOURCE", f"http://127.0.0.1:{server.server_address[1]}")
+    # the download client is kept per thread, start from one on the stand-in
+    monkeypatch.setattr(ecmwf_data_processing_scripts._ecmwf_thread_local, "client", None, raising=False)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,94 @@
+import json
+import os
+import re
+from http.server import SimpleHTTPRequestHandler
+
+import eccodes
+
+from benchmark_ecmwf_data_pipeline import make_synthetic_grib_file
+
+
+def get_step_file_name(run_date=None, step_hour=0, stream_to_use="oper"):
+    # as the open data server names a step file, e.g. 20250922000000-6h-oper-fc.grib2
+    return f"{run_date.strftime('%Y%m%d')}000000-{step_hour}h-{stream_to_use}-fc.grib2"
+
+
+def write_index_file(grib_file="", step_hour=0):
+    # one json line per message, as the .index sidecar of the open data server
+    entries = []
+    with open(grib_file, "rb") as f:
+        while (gid := eccodes.codes_grib_new_from_file(f)) is not None:
+            try:
+                entries.append({"domain": "g", "date": eccodes.codes_get_string(gid, "dataDate"), "time": "0000",
+                                "expver": "0001", "class": "od", "type": "fc", "stream": "oper",
+                                "step": str(step_hour), "levtype": "sfc",
+                                "param": eccodes.codes_get(gid, "shortName"),
+                                "_offset": int(eccodes.codes_get(gid, "offset")),
+                                "_length": int(eccodes.codes_get(gid, "totalLength"))})
+            finally:
+                eccodes.codes_release(gid)
+    with open(grib_file.removesuffix(".grib2") + ".index", "w") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries)
+    return entries
+
+
+def add_step_file(root="", run_date=None, step_hour=0, resolution=10, offset_kelvin=0.0):
+    """Writes a synthetic step file and its .index to the stand-in, returns the path and the index entries."""
+    grib_file = os.path.join(root, get_step_file_name(run_date=run_date, step_hour=step_hour))
+    make_synthetic_grib_file(file_path=grib_file, step_hour=step_hour, run_date=int(run_date.strftime('%Y%m%d')),
+                             resolution=resolution)
+    if offset_kelvin:
+        # a different forecast for the same step, e.g. a rerun with new data
+        with open(grib_file, "rb") as f:
+            messages = []
+            while (gid := eccodes.codes_grib_new_from_file(f)) is not None:
+                try:
+                    if eccodes.codes_get(gid, "shortName") == "2t":
+                        eccodes.codes_set_values(gid, eccodes.codes_get_values(gid) + offset_kelvin)
+                    messages.append(eccodes.codes_get_message(gid))
+                finally:
+                    eccodes.codes_release(gid)
+        with open(grib_file, "wb") as f:
+            f.writelines(messages)
+    return grib_file, write_index_file(grib_file=grib_file, step_hour=step_hour)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    # the step files are served by name from one folder, whatever the run/stream path before it;
+    # http Range requests are answered and all requests recorded on the server
+    def translate_path(self, path):
+        return os.path.join(self.directory, os.path.basename(path.split("?", 1)[0]))
+
+    def do_GET(self):
+        self.server.requested.append((self.path, self.headers.get("Range")))
+        file_path = self.translate_path(self.path)
+        byte_range = self.headers.get("Range")
+        if not byte_range or not os.path.isfile(file_path):
+            return super().do_GET()
+        with open(file_path, "rb") as f:
+            data = f.read()
+        ranges = [(int(start), min(int(end), len(data) - 1)) for start, end in re.findall(r"(\d+)-(\d+)", byte_range)]
+        if len(ranges) == 1:
+            [(start, end)] = ranges
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            body = data[start:end + 1]
+        else:
+            boundary = "range_boundary"
+            body = b"".join(f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+                            f"Content-Range: bytes {start}-{end}/{len(data)}\r\n\r\n".encode()
+                            + data[start:end + 1] + b"\r\n" for start, end in ranges)
+            body += f"--{boundary}--\r\n".encode()
+            self.send_response(206)
+            self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def end_headers(self):
+        # multiurl only sends Range requests to a server which advertises them
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
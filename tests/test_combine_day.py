@@ -0,0 +1,94 @@
+import ast
+import logging
+import os
+import subprocess
+from datetime import datetime
+from glob import glob
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ecmwf_data_processing_scripts import combine_step_frames_for_one_day, serialize_day_dataframe
+
+HOUR_ARRAY = [6, 12, 18, 24]
+K2C_VALUE = 273.15
+# the tree before the reworked pipeline, and the functions its combine_csvs_for_one_day uses
+BASELINE_COMMIT = "7a307df5e40e75c4e8f283eeb38b34fc2b2ce5e7"
+BASELINE_FUNCTIONS = ["combine_csvs_for_one_day", "assign_param_by_tag", "format_date_final", "re_arrange_df"]
+
+
+def make_step_frame(step_hour=0, n_lats=7, n_lons=9):
+    # a decoded step frame, with the columns and dtypes of load_combine_filter_ecmwf_grib_data
+    rng = np.random.default_rng(step_hour)
+    lats, lons = np.meshgrid(np.arange(28.0, 28.0 - n_lats * 0.25, -0.25), np.arange(88.5, 88.5 + n_lons * 0.25, 0.25),
+                             indexing="ij")
+    n_rows = n_lats * n_lons
+    t2m = rng.uniform(250.0, 310.0, n_rows).astype(np.float32)
+    return pd.DataFrame({"longitude": lons.reshape(-1), "latitude": lats.reshape(-1),
+                         "surface": rng.uniform(0.0, 0.01, n_rows).astype(np.float32).astype("float64"),
+                         "tp": rng.uniform(0.0, 0.02, n_rows).astype(np.float32),
+                         "tprate": rng.uniform(0.0, 0.01, n_rows).astype(np.float32),
+                         "time": pd.Timestamp("2025-09-22"),
+                         "t2m": t2m,
+                         "t2m_cel": t2m.astype("float64") - K2C_VALUE})
+
+
+def load_baseline_functions(names=BASELINE_FUNCTIONS):
+    # the combine as it was, taken from the baseline commit: the step csv files parsed back,
+    # then a row-wise apply for param (and the date)
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        source = subprocess.run(["git", "-C", repo_dir, "show", f"{BASELINE_COMMIT}:ecmwf_data_processing_scripts.py"],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as ex:
+        pytest.skip(f"baseline commit not available: {ex}")
+    module = ast.parse(source)
+    module.body = [node for node in module.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    namespace = {"pd": pd, "glob": glob, "logging": logging, "datetime": datetime}
+    exec(compile(module, "baseline_ecmwf_data_processing_scripts.py", "exec"), namespace)
+    return namespace
+
+
+@pytest.fixture
+def step_frames():
+    return {step_hour: make_step_frame(step_hour=step_hour) for step_hour in HOUR_ARRAY}
+
+
+def get_csv_outputs(step_frames, tmp_path, stream_to_use="oper"):
+    baseline = load_baseline_functions()
+    prepped_dir = tmp_path / "temp"
+    prepped_dir.mkdir()
+    for step_hour, df in step_frames.items():
+        df.to_csv(prepped_dir / f"ecmwf_data_20250922000000_{step_hour}h_{stream_to_use}_fc.csv", index=None)
+    reference_csv = baseline["combine_csvs_for_one_day"](prepped_path=str(tmp_path), prepped_suffix="temp",
+                                                         hour_array=HOUR_ARRAY,
+                                                         stream_to_use=stream_to_use).to_csv(index=False)
+    df_comb = combine_step_frames_for_one_day(step_frames=dict(step_frames), hour_array=HOUR_ARRAY,
+                                              stream_to_use=stream_to_use)
+    [(_, get_chunks)] = serialize_day_dataframe(df=df_comb, output_format="csv", file_stem="day")
+    return reference_csv, b"".join(get_chunks()).decode("utf-8")
+
+
+def test_combine_is_byte_identical_to_the_baseline(step_frames, tmp_path):
+    reference_csv, combined_csv = get_csv_outputs(step_frames, tmp_path)
+    assert combined_csv == reference_csv
+
+
+def test_combine_formats_the_date_as_the_baseline(step_frames, tmp_path):
+    # other streams have the step time in the csv, written as yyyy-mm-dd
+    for df in step_frames.values():
+        df["time"] = pd.Timestamp("2025-09-22 06:00:00")
+    reference_csv, combined_csv = get_csv_outputs(step_frames, tmp_path, stream_to_use="enfo")
+    assert ",2025-09-22," in reference_csv.splitlines()[1]
+    assert combined_csv == reference_csv
+
+
+def test_combine_keeps_the_decoded_temperature(step_frames):
+    df_comb = combine_step_frames_for_one_day(step_frames=dict(step_frames), hour_array=HOUR_ARRAY,
+                                              stream_to_use="oper")
+    temperature = df_comb[df_comb["param_tag"] == "t2m_cel"]
+    for step_hour in HOUR_ARRAY:
+        decoded = step_frames[step_hour]["t2m_cel"].to_numpy()
+        # as written to csv and parsed back, a few ulp off the decoded value at most
+        np.testing.assert_allclose(temperature[f"{step_hour}h"].to_numpy(), decoded, rtol=0, atol=1e-13)
@@ -0,0 +1,31 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from ecmwf_data_processing_scripts import load_grib2_to_step_frames
+from test_combine_day import HOUR_ARRAY, make_step_frame
+
+FAILING_STEP = HOUR_ARRAY[1]
+
+
+class StandInDecodeExecutor:
+    # completes each decode at submit, the worker of FAILING_STEP goes down with the pool
+    def submit(self, fn, file_path="", **kwargs):
+        future = Future()
+        step_hour = int(file_path.removeprefix("step_").removesuffix("h.grib2"))
+        if step_hour == FAILING_STEP:
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        else:
+            future.set_result({column: values.to_numpy() for column, values in make_step_frame(step_hour=step_hour).items()})
+        return future
+
+
+def test_failed_decode_worker_fails_its_step_only():
+    units = {}
+    step_files = {step_hour: f"step_{step_hour}h.grib2" for step_hour in HOUR_ARRAY}
+    step_frames = load_grib2_to_step_frames(step_files=step_files, decode_executor=StandInDecodeExecutor(),
+                                            record_unit=lambda unit, status, unit_file="", error="":
+                                            units.update({unit: (status, error)}))
+    assert list(step_frames) == [step_hour for step_hour in HOUR_ARRAY if step_hour != FAILING_STEP]
+    status, error = units[f"decode/{FAILING_STEP}"]
+    assert status == "failed" and "terminated abruptly" in error
+    assert all(units[f"decode/{step_hour}"][0] == "done" for step_hour in step_frames)
@@ -0,0 +1,87 @@
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from ecmwf_data_processing_scripts import download_ecmwf_step_file, get_grib_file_params
+from ecmwf_run_plan_scripts import get_download_params
+from opendata_stand_in import add_step_file
+
+RUN_DATE = datetime(2025, 9, 22)
+STEP_HOUR = 6
+REPO_YAML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gribcfg.yaml")
+FILTER_LEVELS = ["surface", "heightAboveGround"]
+
+
+def get_requested_byte_ranges(server):
+    return [(int(start), int(end)) for path, byte_range in server.requested
+            if path.endswith(".grib2") and byte_range for start, end in re.findall(r"(\d+)-(\d+)", byte_range)]
+
+
+def test_only_the_selected_params_byte_ranges_are_fetched(opendata_server, tmp_path):
+    server = opendata_server
+    grib_file, index_entries = add_step_file(root=server.root, run_date=RUN_DATE, step_hour=STEP_HOUR)
+    target_filename = str(tmp_path / "ecmwf_data_20250922000000_6h_oper_fc.grib2")
+    download_ecmwf_step_file(current_date=RUN_DATE, step_hour=STEP_HOUR, stream_to_use="oper",
+                             target_filename=target_filename, params=["2t", "tp"], levtypes=["sfc"])
+
+    assert any(path.endswith(".index") for path, _ in server.requested)
+    # the whole file is never requested, only ranges within the selected messages
+    assert all(byte_range for path, byte_range in server.requested if path.endswith(".grib2"))
+    selected = [entry for entry in index_entries if entry["param"] in ("2t", "tp")]
+    skipped = [entry for entry in index_entries if entry["param"] not in ("2t", "tp")]
+    fetched = set()
+    for start, end in get_requested_byte_ranges(server):
+        fetched.update(range(start, end + 1))
+    assert fetched == {i for entry in selected for i in range(entry["_offset"], entry["_offset"] + entry["_length"])}
+    assert not any(entry["_offset"] in fetched for entry in skipped)
+
+    assert get_grib_file_params(target_filename) == {"2t", "tp"}
+    grib_data = Path(grib_file).read_bytes()
+    assert open(target_filename, "rb").read() == b"".join(
+        grib_data[entry["_offset"]:entry["_offset"] + entry["_length"]]
+        for entry in sorted(selected, key=lambda entry: entry["_offset"]))
+
+
+def test_missing_param_fails_the_download(opendata_server, tmp_path):
+    # the client only warns "No index entries" for swvl1 and downloads the rest
+    add_step_file(root=opendata_server.root, run_date=RUN_DATE, step_hour=STEP_HOUR)
+    target_filename = str(tmp_path / "ecmwf_data_20250922000000_6h_oper_fc.grib2")
+    with pytest.raises(ValueError, match="swvl1"):
+        download_ecmwf_step_file(current_date=RUN_DATE, step_hour=STEP_HOUR, stream_to_use="oper",
+                                 target_filename=target_filename, params=["2t", "swvl1"], levtypes=["sfc"])
+    # neither the final file nor its temp file are left behind
+    assert os.listdir(tmp_path) == ["opendata"]
+
+
+def test_params_resolved_from_the_repo_yaml_are_fetched(opendata_server, tmp_path):
+    _, index_entries = add_step_file(root=opendata_server.root, run_date=RUN_DATE, step_hour=STEP_HOUR)
+    params, levtypes = get_download_params(yaml_file=REPO_YAML, filter_levels=FILTER_LEVELS)
+    assert (params, levtypes) == (["tp", "tprate", "2t"], ["sfc"])
+    target_filename = str(tmp_path / "ecmwf_data_20250922000000_6h_oper_fc.grib2")
+    download_ecmwf_step_file(current_date=RUN_DATE, step_hour=STEP_HOUR, stream_to_use="oper",
+                             target_filename=target_filename, params=params, levtypes=levtypes)
+
+    assert get_grib_file_params(target_filename) == set(params)
+    fetched = set()
+    for start, end in get_requested_byte_ranges(opendata_server):
+        fetched.update(range(start, end + 1))
+    assert fetched == {i for entry in index_entries if entry["param"] in params
+                       for i in range(entry["_offset"], entry["_offset"] + entry["_length"])}
+
+
+def test_param_resolved_from_the_yaml_missing_in_the_index_fails_the_download(opendata_server, tmp_path):
+    add_step_file(root=opendata_server.root, run_date=RUN_DATE, step_hour=STEP_HOUR)
+    # the repo yaml, with d2m (open data param 2d) added to the 2 m level
+    yaml_file = tmp_path / "gribcfg.yaml"
+    yaml_file.write_text(Path(REPO_YAML).read_text(encoding="utf-8").replace('"t2m"]', '"t2m","d2m"]', 1),
+                         encoding="utf-8")
+    params, levtypes = get_download_params(yaml_file=str(yaml_file), filter_levels=FILTER_LEVELS)
+    assert params == ["tp", "tprate", "2t", "2d"]
+    target_filename = str(tmp_path / "ecmwf_data_20250922000000_6h_oper_fc.grib2")
+    with pytest.raises(ValueError, match="2d"):
+        download_ecmwf_step_file(current_date=RUN_DATE, step_hour=STEP_HOUR, stream_to_use="oper",
+                                 target_filename=target_filename, params=params, levtypes=levtypes)
+    assert not os.path.exists(target_filename)
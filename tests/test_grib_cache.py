@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import grib_cache_scripts
+from grib_cache_scripts import (add_to_grib_cache, get_grib_cache_stats, load_grib_cache_index, lookup_grib_cache,
+                                unpin_grib_cache_files)
+
+REQUESTS = [{"date": "2025092200", "step": step_hour, "stream": "oper", "type": "fc", "param": ["2t", "tp"]}
+            for step_hour in (6, 12, 18, 24)]
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    cache_dir = str(tmp_path / "grib_cache")
+    os.makedirs(cache_dir)
+    return cache_dir
+
+
+@pytest.fixture
+def index_writes(monkeypatch):
+    # the index writes to disk, and a check that no file is hashed under the cache lock
+    writes = []
+    save_grib_cache_index = grib_cache_scripts.save_grib_cache_index
+    get_file_sha256 = grib_cache_scripts.get_file_sha256
+
+    def counted_save(cache_dir="", cache_index={}):
+        writes.append(dict(cache_index))
+        save_grib_cache_index(cache_dir, cache_index)
+
+    def unlocked_sha256(file_path=""):
+        assert not grib_cache_scripts._grib_cache_lock.locked()
+        return get_file_sha256(file_path)
+
+    monkeypatch.setattr(grib_cache_scripts, "save_grib_cache_index", counted_save)
+    monkeypatch.setattr(grib_cache_scripts, "get_file_sha256", unlocked_sha256)
+    return writes
+
+
+def add_files(cache_dir="", requests=REQUESTS):
+    cached_files = []
+    for i, request in enumerate(requests):
+        incoming_file = f"{cache_dir}/step_{i}.grib2.incoming"
+        with open(incoming_file, "wb") as f:
+            f.write(os.urandom(1024))
+        cached_files.append(add_to_grib_cache(cache_dir=cache_dir, request=request, file_path=incoming_file,
+                                              max_cache_mb=1))
+    return cached_files
+
+
+def test_hits_are_written_with_the_unpin_only(cache_dir, index_writes):
+    cached_files = add_files(cache_dir)
+    # one write per file added
+    assert len(index_writes) == len(REQUESTS)
+    unpin_grib_cache_files(cache_dir=cache_dir, file_paths=cached_files, max_cache_mb=1)
+    assert len(index_writes) == len(REQUESTS)
+
+    last_access = {key: entry["last_access"] for key, entry in load_grib_cache_index(cache_dir).items()}
+    hits = get_grib_cache_stats()["hits"]
+    assert [lookup_grib_cache(cache_dir=cache_dir, request=request) for request in REQUESTS] == cached_files
+    assert get_grib_cache_stats()["hits"] == hits + len(REQUESTS)
+    # a miss without an entry changes nothing either
+    assert lookup_grib_cache(cache_dir=cache_dir, request={**REQUESTS[0], "step": 30}) == ""
+    assert len(index_writes) == len(REQUESTS)
+
+    # the access times of the hits are written once, when the day is unpinned
+    unpin_grib_cache_files(cache_dir=cache_dir, file_paths=cached_files, max_cache_mb=1)
+    assert len(index_writes) == len(REQUESTS) + 1
+    saved_index = load_grib_cache_index(cache_dir)
+    assert all(saved_index[key]["last_access"] > last_access[key] for key in last_access)
+
+
+def test_corrupt_file_is_dropped(cache_dir, index_writes):
+    cached_files = add_files(cache_dir)
+    unpin_grib_cache_files(cache_dir=cache_dir, file_paths=cached_files, max_cache_mb=1)
+    with open(cached_files[1], "r+b") as f:
+        f.write(b"corrupt")
+    corrupt = get_grib_cache_stats()["corrupt"]
+    assert lookup_grib_cache(cache_dir=cache_dir, request=REQUESTS[1]) == ""
+    assert get_grib_cache_stats()["corrupt"] == corrupt + 1
+    assert not os.path.exists(cached_files[1])
+    assert len(load_grib_cache_index(cache_dir)) == len(REQUESTS) - 1
+
+
+def test_unpinned_files_are_evicted_least_recently_used_first(cache_dir, index_writes):
+    cached_files = add_files(cache_dir)
+    unpin_grib_cache_files(cache_dir=cache_dir, file_paths=cached_files, max_cache_mb=1)
+    assert lookup_grib_cache(cache_dir=cache_dir, request=REQUESTS[0]) == cached_files[0]
+    # down to 2 KB, the hit on the first file keeps it over the next ones
+    unpin_grib_cache_files(cache_dir=cache_dir, file_paths=cached_files, max_cache_mb=2 / 1024)
+    assert sorted(os.path.basename(path) for path in (cached_files[0], cached_files[3])) == \
+        sorted(entry["file"] for entry in load_grib_cache_index(cache_dir).values())
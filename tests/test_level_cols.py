@@ -0,0 +1,47 @@
+import pytest
+
+from benchmark_ecmwf_data_pipeline import make_synthetic_grib_file
+from ecmwf_data_processing_scripts import download_and_process_ecmwf_data, load_combine_filter_ecmwf_grib_data
+from ecmwf_run_plan_scripts import get_pre_combine_cols
+
+FILTER_LEVELS = ["surface", "heightAboveGround"]
+# the box of gribcfg.yaml, with the columns of each level to combine
+GRIB_CONFIG = """
+coords: {north: "28°15'", west: "88°45'", south: "26°40'", east: "92°10'"}
+coords_map: {north: "max_lat_bhutan", south: "min_lat_bhutan", west: "min_lon_bhutan", east: "max_lon_bhutan"}
+pre_combine_cols:
+ surface: ["longitude", "latitude", "surface", "tp"]
+ heightAboveGround: ["longitude", "latitude", "time", "t2m"]
+"""
+
+
+@pytest.fixture
+def yaml_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("TEMP_DIR", str(tmp_path / "temp"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "gribcfg.yaml").write_text(GRIB_CONFIG, encoding="utf-8")
+    return "gribcfg.yaml"
+
+
+def test_step_columns_follow_the_pre_combine_cols(yaml_file, tmp_path):
+    grib_file = str(tmp_path / "step_6h.grib2")
+    make_synthetic_grib_file(file_path=grib_file, step_hour=6, resolution=1)
+    status, df = load_combine_filter_ecmwf_grib_data(file_path=grib_file, filter_levels=FILTER_LEVELS,
+                                                     yaml_file=yaml_file)
+    assert status
+    # tprate is left out of the yaml, so out of the step frame
+    assert list(df.columns) == ["longitude", "latitude", "surface", "tp", "time", "t2m", "t2m_cel"]
+
+
+def test_level_without_pre_combine_cols_is_rejected(yaml_file):
+    assert list(get_pre_combine_cols(yaml_file=yaml_file, filter_levels=FILTER_LEVELS)) == FILTER_LEVELS
+    with pytest.raises(ValueError, match="isobaricInhPa"):
+        get_pre_combine_cols(yaml_file=yaml_file, filter_levels=FILTER_LEVELS + ["isobaricInhPa"])
+
+
+def test_run_with_an_unknown_level_fails_before_any_download(yaml_file, opendata_server):
+    status = download_and_process_ecmwf_data(download_path="download", prepped_path="prepped", prepped_suffix="temp",
+                                             filter_levels=FILTER_LEVELS + ["isobaricInhPa"], level=2,
+                                             number_of_days=1, step_size=6, yaml_file=yaml_file)
+    assert not status
+    assert opendata_server.requested == []
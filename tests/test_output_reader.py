@@ -0,0 +1,67 @@
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_aws
+
+from ecmwf_data_processing_scripts import combine_step_frames_for_one_day, serialize_day_dataframe
+from ecmwf_data_reader_scripts import load_ecmwf_output, open_s3_object, read_columnar_output
+from test_combine_day import HOUR_ARRAY, make_step_frame
+
+BUCKET = "ecmwf-test-bucket"
+PUSH_DATA_PATH = "data"
+COLUMNS = ["longitude", "latitude", "param", "forecast_date", "6h", "24h"]
+BBOX = {"north": 27.0, "south": 20.0, "west": 90.0, "east": 150.0}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+
+
+@pytest.fixture(params=["parquet", "arrow"])
+def published_day(request, s3, tmp_path):
+    # one day over 300 x 400 grid points, two row groups / record batches per param partition
+    step_frames = {step_hour: make_step_frame(step_hour=step_hour, n_lats=300, n_lons=400) for step_hour in HOUR_ARRAY}
+    df_comb = combine_step_frames_for_one_day(step_frames=step_frames, hour_array=HOUR_ARRAY, stream_to_use="oper")
+    df_comb["forecast_date"] = pd.Timestamp("2025-09-22")
+    keys = []
+    for save_file, get_chunks in serialize_day_dataframe(df=df_comb, output_format=request.param,
+                                                         file_stem="ecmwf_data_20250922000000_6h-24h_oper_fc_1"):
+        body = b"".join(get_chunks())
+        s3.put_object(Bucket=BUCKET, Key=f"{PUSH_DATA_PATH}/{save_file}", Body=body)
+        (tmp_path / save_file).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / save_file).write_bytes(body)
+        keys.append(f"{PUSH_DATA_PATH}/{save_file}")
+    return request.param, keys, tmp_path
+
+
+def test_s3_read_matches_the_local_read_in_a_few_gets(s3, published_day):
+    output_format, keys, local_dir = published_day
+    gets = []
+    s3.meta.events.register("provide-client-params.s3.GetObject", lambda params, **kwargs: gets.append(params))
+    df = load_ecmwf_output(object_prefix=f"{PUSH_DATA_PATH}/", output_format=output_format, bucket=BUCKET,
+                           s3_client=s3, columns=COLUMNS, bbox=BBOX, params=["precipitation", "surface_runoff"])
+    local_df = load_ecmwf_output(object_prefix=str(local_dir), output_format=output_format, columns=COLUMNS,
+                                 bbox=BBOX, params=["precipitation", "surface_runoff"])
+    assert len(df) > 0
+    pd.testing.assert_frame_equal(df, local_df)
+    assert (df["latitude"] <= BBOX["north"]).all() and set(df["param"]) == {"precipitation", "surface_runoff"}
+    # for each of the two files, the tail (footer) and the column chunks, read ahead in 8 MB ranges
+    assert len(gets) <= 2 * 2
+
+
+def test_only_the_wanted_columns_are_read(s3, published_day):
+    output_format, keys, _ = published_day
+    key = keys[0]
+    source, range_reader = open_s3_object(bucket=BUCKET, key=key, s3_client=s3, buffer_size=64 * 1024)
+    with source:
+        df = read_columnar_output(source, output_format=output_format, key=key, columns=["latitude", "6h"])
+    assert list(df.columns) == ["latitude", "6h"]
+    assert len(df) == 300 * 400
+    # 2 of the 7 columns of the file
+    assert range_reader.bytes_read < range_reader.size / 2
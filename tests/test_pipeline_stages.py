@@ -0,0 +1,107 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from ecmwf_data_processing_scripts import (combine_step_frames_for_one_day, download_day_stage, publish_day_stage,
+                                           run_chunks_pipelined)
+from opendata_stand_in import add_step_file
+from run_state_scripts import get_run_id, record_run_unit, start_run_state
+from test_combine_day import HOUR_ARRAY, make_step_frame
+
+RUN_DATE = datetime(2025, 9, 22)
+CHUNKS = [[6, 12, 18, 24], [30, 36, 42, 48], [54, 60, 66, 72]]
+
+
+@pytest.fixture
+def run_state(tmp_path):
+    state_file = str(tmp_path / "run_state.json")
+    run_state = start_run_state({}, run_id=get_run_id(run_date=RUN_DATE), config_key="test")
+
+    def record_unit(unit, status, unit_file="", error=""):
+        record_run_unit(run_state=run_state, unit=unit, status=status, unit_file=unit_file, error=error,
+                        state_file=state_file)
+    return run_state, record_unit
+
+
+@pytest.fixture
+def combined_day(tmp_path):
+    # a combined day, with its combine/{day} checkpoint
+    step_frames = {step_hour: make_step_frame(step_hour=step_hour) for step_hour in HOUR_ARRAY}
+    df_comb = combine_step_frames_for_one_day(step_frames=step_frames, hour_array=HOUR_ARRAY, stream_to_use="oper")
+    combine_file = tmp_path / "combine_1.parquet"
+    df_comb.to_parquet(combine_file, index=False)
+    return df_comb, combine_file
+
+
+def test_failed_decode_stops_the_downloads_and_keeps_the_days_before():
+    downloaded = []
+    day_2_failed = threading.Event()
+
+    def download_fn(cnt, chunk):
+        # the third day waits on the failure, so it is never handed to the decoder
+        if cnt == 2:
+            day_2_failed.wait(timeout=5)
+        downloaded.append(cnt)
+        return {step_hour: f"step_{step_hour}h.grib2" for step_hour in chunk}
+
+    def decode_fn(cnt, chunk, step_files):
+        if cnt == 1:
+            day_2_failed.set()
+            raise ValueError("Unable to decode day 2")
+        return list(step_files)
+
+    published, failure = run_chunks_pipelined(chunks=CHUNKS, download_fn=download_fn, decode_fn=decode_fn,
+                                              publish_fn=lambda cnt, chunk, steps: [(cnt, steps)])
+    assert published == [[(0, CHUNKS[0])]]
+    assert failure[0] == " decode 2 " and str(failure[1]) == "Unable to decode day 2"
+
+
+def test_download_stage_skips_the_combined_day_and_the_decoded_steps(opendata_server, run_state, tmp_path):
+    run_state, record_unit = run_state
+    for step_hour in [6, 12]:
+        add_step_file(root=opendata_server.root, run_date=RUN_DATE, step_hour=step_hour)
+    checkpoint_file = tmp_path / "step_frame_2025092200_6h.parquet"
+    checkpoint_file.write_bytes(b"")
+    record_unit("decode/6", "done", unit_file=str(checkpoint_file))
+    step_files = download_day_stage(0, [6, 12], run_state=run_state, current_date=RUN_DATE,
+                                    download_dir=str(tmp_path), params=["2t"], levtypes=["sfc"],
+                                    record_unit=record_unit)
+    assert list(step_files) == [12]
+    assert run_state["units"]["download/12"]["status"] == "done"
+    assert not any("_6h_" in path for path, _ in opendata_server.requested)
+
+    # a day combined by the run being resumed is not downloaded at all
+    opendata_server.requested.clear()
+    record_unit("combine/1", "done", unit_file=str(checkpoint_file))
+    assert download_day_stage(0, [6, 12], run_state=run_state, current_date=RUN_DATE,
+                              download_dir=str(tmp_path), params=["2t"], levtypes=["sfc"]) == {}
+    assert opendata_server.requested == []
+
+
+def test_publish_stage_records_the_day_and_removes_its_checkpoint(run_state, combined_day, tmp_path):
+    run_state, record_unit = run_state
+    df_comb, combine_file = combined_day
+    record_unit("combine/1", "done", unit_file=str(combine_file))
+
+    entries = publish_day_stage(0, HOUR_ARRAY, df_comb, run_state=run_state, start_date=RUN_DATE,
+                                push_destination="local", prepped_dir=str(tmp_path / "prepped"),
+                                record_unit=record_unit)
+    assert entries and all(entry["status"] for entry in entries)
+    assert run_state["units"]["publish/1"]["status"] == "done"
+    assert set(run_state["days"]["1"]["files"]) == {entry["key"] for entry in entries}
+    assert not combine_file.exists()
+
+
+def test_failed_publish_is_journaled_and_keeps_the_checkpoint(run_state, combined_day, tmp_path):
+    run_state, record_unit = run_state
+    df_comb, combine_file = combined_day
+    record_unit("combine/1", "done", unit_file=str(combine_file))
+    # the prepped dir can not be made, a file is in its place
+    (tmp_path / "prepped").write_bytes(b"")
+    with pytest.raises(OSError):
+        publish_day_stage(0, HOUR_ARRAY, df_comb, run_state=run_state, start_date=RUN_DATE,
+                          push_destination="local", prepped_dir=str(tmp_path / "prepped"), record_unit=record_unit)
+    assert run_state["units"]["publish/1"]["status"] == "failed"
+    assert "1" not in run_state["days"]
+    assert combine_file.exists()
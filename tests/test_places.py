@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+
+import pytest
+
+from ecmwf_data_processing_scripts import get_region_box
+from point_extraction_scripts import geocode_places, load_places_config
+
+REPO_YAML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gribcfg.yaml")
+
+
+@pytest.fixture
+def no_geocoding(monkeypatch):
+    # any geocoding request fails the test, geopy can not be imported
+    monkeypatch.setitem(sys.modules, "geopy.geocoders", None)
+
+
+def test_default_places_are_not_geocoded(no_geocoding):
+    places_config = load_places_config(yaml_file=REPO_YAML)
+    places = geocode_places(places_config=places_config)
+    assert len(places) == len(places_config["locations"]) == 20
+    box = get_region_box(yaml_file=REPO_YAML)
+    for place in places:
+        assert box["min_lat_bhutan"] <= place["latitude"] <= box["max_lat_bhutan"]
+        assert box["min_lon_bhutan"] <= place["longitude"] <= box["max_lon_bhutan"]
+
+
+def test_place_without_coordinates_is_left_out_when_geocoding_is_off(no_geocoding, tmp_path):
+    places_config = {"country": "Bhutan", "geocode_cache_file": str(tmp_path / "cache.json"),
+                     "locations": [{"name": "Paro", "latitude": 27.43, "longitude": 89.41}, {"name": "Kurichhu"}]}
+    assert [place["name"] for place in geocode_places(places_config=places_config)] == ["Paro"]
+    assert not os.path.exists(tmp_path / "cache.json")
+
+
+def test_place_without_coordinates_is_geocoded_when_opted_in(no_geocoding, tmp_path):
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text(json.dumps({"Kurichhu, Bhutan": {"latitude": 27.2, "longitude": 91.1}}))
+    places_config = {"country": "Bhutan", "geocode": True, "geocode_cache_file": str(cache_file),
+                     "locations": [{"name": "Kurichhu"}]}
+    assert geocode_places(places_config=places_config) == [{"name": "Kurichhu", "latitude": 27.2, "longitude": 91.1}]
+    # not in the cache: geocoded, here geopy can not be imported
+    places_config["locations"].append({"name": "Dangmechhu"})
+    with pytest.raises(ImportError):
+        geocode_places(places_config=places_config)
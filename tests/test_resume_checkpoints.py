@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from ecmwf_data_processing_scripts import decode_and_combine_chunk
+from test_combine_day import HOUR_ARRAY, make_step_frame
+
+
+@pytest.fixture
+def checkpoint_frames(tmp_path):
+    # the steps decoded by the run being resumed, as decode/{step} checkpoint files
+    checkpoint_frames = {}
+    for step_hour in HOUR_ARRAY:
+        checkpoint_file = str(tmp_path / f"step_frame_2025092200_{step_hour}h.parquet")
+        make_step_frame(step_hour=step_hour).to_parquet(checkpoint_file, index=False)
+        checkpoint_frames[step_hour] = checkpoint_file
+    return checkpoint_frames
+
+
+def test_resumed_checkpoints_are_kept_when_the_combine_fails(checkpoint_frames):
+    # a step of the day is neither decoded nor checkpointed, so the combine fails
+    with pytest.raises(ValueError):
+        decode_and_combine_chunk(cnt=0, chunk=HOUR_ARRAY + [30], step_files={},
+                                 checkpoint_frames=dict(checkpoint_frames))
+    assert all(os.path.exists(checkpoint_file) for checkpoint_file in checkpoint_frames.values())
+
+
+def test_resumed_checkpoints_are_left_to_the_combine_checkpoint(checkpoint_frames):
+    df_comb = decode_and_combine_chunk(cnt=0, chunk=HOUR_ARRAY, step_files={},
+                                       checkpoint_frames=dict(checkpoint_frames))
+    assert list(df_comb.columns[-len(HOUR_ARRAY):]) == [f"{step_hour}h" for step_hour in HOUR_ARRAY]
+    # removed by the caller, once the combined day is checkpointed
+    assert all(os.path.exists(checkpoint_file) for checkpoint_file in checkpoint_frames.values())
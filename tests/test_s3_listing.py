@@ -0,0 +1,112 @@
+import boto3
+import pytest
+from moto import mock_aws
+from moto.core import DEFAULT_ACCOUNT_ID
+from moto.s3.models import s3_backends
+
+from s3_scripts import delete_s3_objects_in_batches, list_bucket_object_entries, remove_files_on_s3
+
+BUCKET = "ecmwf-test-bucket"
+REGIONS = ["a", "b", "c", "d"]
+FORECAST_DATES = [f"2025-09-{day}" for day in range(22, 27)]
+# over 1000 keys in each partition, so each is listed in two pages
+PARTS_PER_PARTITION = 1001
+PARTITIONS = [f"data/{region}/forecast_date={forecast_date}/" for region in REGIONS for forecast_date in FORECAST_DATES]
+# the manifest, a day file per region and the partitions, some 20k keys
+KEYS = sorted(["data/_manifest.json"] + [f"data/{region}/day_1.csv" for region in REGIONS]
+              + [f"{partition}part-{i:04d}.parquet" for partition in PARTITIONS for i in range(PARTS_PER_PARTITION)])
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+
+
+@pytest.fixture
+def keys(s3):
+    # put straight into the stand-in's store, 20k put_object calls would take most of a minute
+    s3_backend = s3_backends[DEFAULT_ACCOUNT_ID]["aws"]
+    for key in KEYS:
+        s3_backend.put_object(BUCKET, key, b"")
+    assert s3.list_objects_v2(Bucket=BUCKET, Prefix=PARTITIONS[0], MaxKeys=1)["IsTruncated"]
+    return KEYS
+
+
+def record_calls(s3, operation=""):
+    # the request params of each call, e.g. {"Prefix", "Delimiter", "ContinuationToken"} of a list
+    calls = []
+    s3.meta.events.register(f"provide-client-params.s3.{operation}",
+                            lambda params, **kwargs: calls.append(dict(params)))
+    return calls
+
+
+def get_list_calls(calls=[], delimiter=""):
+    return sorted((call["Prefix"], "ContinuationToken" in call) for call in calls
+                  if call.get("Delimiter", "") == delimiter)
+
+
+def test_listing_splits_both_levels_and_pages_past_1000_keys(s3, keys):
+    calls = record_calls(s3, "ListObjectsV2")
+    objects = list_bucket_object_entries(bucket=BUCKET, s3_client=s3, object_prefix="data/",
+                                         split_depth=2, max_parallel_lists=8)
+    assert len(objects) == len(KEYS)
+    assert [obj["Key"] for obj in objects] == KEYS
+    # split on "/" at data/ and at each region
+    assert get_list_calls(calls, delimiter="/") == [("data/", False)] + [(f"data/{region}/", False)
+                                                                         for region in REGIONS]
+    # each of the 20 partitions listed in full, in two pages
+    assert get_list_calls(calls) == sorted((partition, continued) for partition in PARTITIONS
+                                           for continued in (False, True))
+
+
+def test_listing_stops_splitting_at_max_parallel_lists(s3, keys):
+    calls = record_calls(s3, "ListObjectsV2")
+    objects = list_bucket_object_entries(bucket=BUCKET, s3_client=s3, object_prefix="data/",
+                                         split_depth=2, max_parallel_lists=2)
+    assert [obj["Key"] for obj in objects] == KEYS
+    # the regions are enough to list in parallel, they are not split further
+    assert get_list_calls(calls, delimiter="/") == [("data/", False)]
+    assert sorted({prefix for prefix, _ in get_list_calls(calls)}) == [f"data/{region}/" for region in REGIONS]
+
+
+def test_deletes_go_in_batches_of_1000_keys(s3, keys):
+    calls = record_calls(s3, "DeleteObjects")
+    deleted_cnt, errors = delete_s3_objects_in_batches(file_list=KEYS, bucket=BUCKET, s3_client=s3)
+    assert (deleted_cnt, errors) == (len(KEYS), [])
+    assert sorted(len(call["Delete"]["Objects"]) for call in calls) == [len(KEYS) % 1000] + [1000] * (len(KEYS) // 1000)
+    assert s3.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_delete_errors_are_collected_per_key(s3, keys):
+    # S3 refuses some keys of the batches (e.g. under a legal hold) and lists them in the response Errors
+    protected_keys = sorted(["data/a/day_1.csv", f"{PARTITIONS[7]}part-0000.parquet", KEYS[-1]])
+
+    def keep_protected_keys(params, context, **kwargs):
+        # the keys refused in this call, for its response
+        context["refused_keys"] = [obj["Key"] for obj in params["Delete"]["Objects"] if obj["Key"] in protected_keys]
+        params["Delete"]["Objects"] = [obj for obj in params["Delete"]["Objects"] if obj["Key"] not in protected_keys]
+
+    def add_protected_key_errors(parsed, context, **kwargs):
+        parsed["Errors"] = [{"Key": key, "Code": "AccessDenied", "Message": "Access Denied"}
+                            for key in context["refused_keys"]]
+
+    s3.meta.events.register("provide-client-params.s3.DeleteObjects", keep_protected_keys)
+    s3.meta.events.register("after-call.s3.DeleteObjects", add_protected_key_errors)
+    deleted_cnt, errors = delete_s3_objects_in_batches(file_list=KEYS, bucket=BUCKET, s3_client=s3)
+    assert deleted_cnt == len(KEYS) - len(protected_keys)
+    assert sorted(error["Key"] for error in errors) == protected_keys
+    assert {error["Code"] for error in errors} == {"AccessDenied"}
+    assert sorted(obj["Key"] for obj in s3.list_objects_v2(Bucket=BUCKET)["Contents"]) == protected_keys
+
+
+def test_failed_batch_is_reported_for_each_of_its_keys(s3):
+    deleted_cnt, errors = delete_s3_objects_in_batches(file_list=KEYS, bucket="no-such-bucket", s3_client=s3)
+    assert deleted_cnt == 0
+    assert [error["Key"] for error in errors] == KEYS
+    assert {error["Code"] for error in errors} == {"NoSuchBucket"}
+    assert not remove_files_on_s3(file_list=KEYS[:1], bucket="no-such-bucket", s3_client=s3)
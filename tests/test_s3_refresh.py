@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import s3_scripts
+from ecmwf_data_processing_scripts import download_and_process_ecmwf_data, get_formatted_utc_current_date
+from opendata_stand_in import add_step_file, get_step_file_name
+from run_metrics_scripts import get_run_metrics_report, reset_run_metrics
+from s3_scripts import get_known_content_md5s
+
+BUCKET = "ecmwf-test-bucket"
+PUSH_DATA_PATH = "data"
+MANIFEST_KEY = f"{PUSH_DATA_PATH}/_manifest.json"
+# the box of gribcfg.yaml, without the places
+GRIB_CONFIG = """
+coords: {north: "28°15'", west: "88°45'", south: "26°40'", east: "92°10'"}
+coords_map: {north: "max_lat_bhutan", south: "min_lat_bhutan", west: "min_lon_bhutan", east: "max_lon_bhutan"}
+pre_combine_cols:
+ surface: ["longitude", "latitude", "surface", "tp", "tprate"]
+ heightAboveGround: ["longitude", "latitude", "time", "t2m"]
+"""
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("S3_REGION", "us-east-1")
+    monkeypatch.setenv("S3_BUCKET_NAME", BUCKET)
+    monkeypatch.setenv("TEMP_DIR", str(tmp_path / "temp"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "gribcfg.yaml").write_text(GRIB_CONFIG, encoding="utf-8")
+    # the shared s3 clients are created within the mock
+    monkeypatch.setattr(s3_scripts, "_s3_clients", {})
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+
+
+@pytest.fixture
+def run_date(opendata_server):
+    # the run the pipeline picks when not incremental, two days of 6 hourly steps on the stand-in
+    run_date, _ = get_formatted_utc_current_date()
+    for step_hour in range(6, 49, 6):
+        add_step_file(root=opendata_server.root, run_date=run_date, step_hour=step_hour, resolution=1)
+    return run_date
+
+
+def run_pipeline():
+    reset_run_metrics()
+    status = download_and_process_ecmwf_data(download_path="download", prepped_path="prepped", prepped_suffix="temp",
+                                             filter_levels=["surface", "heightAboveGround"], level=2,
+                                             number_of_days=2, step_size=6, push_destination="s3",
+                                             push_data_path=PUSH_DATA_PATH, yaml_file="gribcfg.yaml",
+                                             max_parallel_downloads=2, remove_stale_s3_files=True,
+                                             run_state_file="ecmwf_run_state.json")
+    return status, get_run_metrics_report()["counters"]
+
+
+def get_manifest(s3):
+    return s3.get_object(Bucket=BUCKET, Key=MANIFEST_KEY)["Body"].read()
+
+
+def get_keys(s3):
+    return {obj["Key"] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix=f"{PUSH_DATA_PATH}/").get("Contents", [])}
+
+
+def test_refresh_uploads_only_changed_files_and_switches_the_manifest(s3, run_date, opendata_server):
+    # first run, both days uploaded and listed in the manifest
+    status, counters = run_pipeline()
+    assert status
+    assert counters["files_uploaded"] == 2
+    manifest_objects = json.loads(get_manifest(s3))["objects"]
+    assert len(manifest_objects) == 2
+    [day_1_key] = [key for key in manifest_objects if key.endswith("_1.csv")]
+    [day_2_key] = [key for key in manifest_objects if key.endswith("_2.csv")]
+    for key in manifest_objects:
+        body = s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+        assert manifest_objects[key]["md5"] == hashlib.md5(body).hexdigest()
+
+    # unchanged rerun, nothing uploaded
+    status, counters = run_pipeline()
+    assert status
+    assert counters.get("files_uploaded", 0) == 0
+    assert counters["files_unchanged"] == 2
+
+    # a new forecast for a step of day 2, and an object no longer published
+    add_step_file(root=opendata_server.root, run_date=run_date, step_hour=36, resolution=1, offset_kelvin=1.0)
+    s3.put_object(Bucket=BUCKET, Key=f"{PUSH_DATA_PATH}/ecmwf_data_stale.csv", Body=b"stale")
+    status, counters = run_pipeline()
+    assert status
+    assert counters["files_uploaded"] == 1
+    assert counters["files_unchanged"] == 1
+    new_manifest_objects = json.loads(get_manifest(s3))["objects"]
+    assert new_manifest_objects[day_1_key] == manifest_objects[day_1_key]
+    assert new_manifest_objects[day_2_key]["md5"] != manifest_objects[day_2_key]["md5"]
+    assert f"{PUSH_DATA_PATH}/ecmwf_data_stale.csv" not in get_keys(s3)
+
+
+def test_failed_refresh_leaves_the_manifest_unchanged(s3, run_date, opendata_server):
+    status, _ = run_pipeline()
+    assert status
+    manifest = get_manifest(s3)
+    keys = get_keys(s3)
+
+    # day 1 changes, but tp is missing from a step of day 2, so the run fails
+    add_step_file(root=opendata_server.root, run_date=run_date, step_hour=12, resolution=1, offset_kelvin=1.0)
+    index_file = os.path.join(opendata_server.root, get_step_file_name(run_date=run_date, step_hour=42))
+    index_file = index_file.removesuffix(".grib2") + ".index"
+    with open(index_file) as f:
+        index_lines = [line for line in f if json.loads(line)["param"] != "tp"]
+    with open(index_file, "w") as f:
+        f.writelines(index_lines)
+    s3.put_object(Bucket=BUCKET, Key=f"{PUSH_DATA_PATH}/ecmwf_data_stale.csv", Body=b"stale")
+    status, _ = run_pipeline()
+    assert not status
+    # the previous data is still served: same manifest, nothing removed
+    assert get_manifest(s3) == manifest
+    assert keys | {f"{PUSH_DATA_PATH}/ecmwf_data_stale.csv"} <= get_keys(s3)
+
+
+def test_single_part_etag_is_preferred_over_the_manifest(s3):
+    # an object overwritten since the manifest was written, e.g. by hand
+    key = f"{PUSH_DATA_PATH}/day_1.csv"
+    s3.put_object(Bucket=BUCKET, Key=key, Body=b"overwritten")
+    s3.put_object(Bucket=BUCKET, Key=MANIFEST_KEY, Body=json.dumps(
+        {"objects": {key: {"md5": hashlib.md5(b"published").hexdigest(), "size": 9}}}).encode("utf-8"))
+    known_md5s = get_known_content_md5s(bucket=BUCKET, object_prefix=f"{PUSH_DATA_PATH}/", s3_client=s3)
+    assert known_md5s[key] == hashlib.md5(b"overwritten").hexdigest()
+
+
+def test_multipart_etag_is_known_through_the_manifest(s3):
+    key = f"{PUSH_DATA_PATH}/day_1.csv"
+    upload_id = s3.create_multipart_upload(Bucket=BUCKET, Key=key)["UploadId"]
+    part = s3.upload_part(Bucket=BUCKET, Key=key, UploadId=upload_id, PartNumber=1, Body=b"published")
+    s3.complete_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id,
+                                 MultipartUpload={"Parts": [{"ETag": part["ETag"], "PartNumber": 1}]})
+    assert "-" in s3.head_object(Bucket=BUCKET, Key=key)["ETag"]
+    known_md5s = get_known_content_md5s(bucket=BUCKET, object_prefix=f"{PUSH_DATA_PATH}/", s3_client=s3)
+    assert key not in known_md5s
+    s3.put_object(Bucket=BUCKET, Key=MANIFEST_KEY, Body=json.dumps(
+        {"objects": {key: {"md5": hashlib.md5(b"published").hexdigest(), "size": 9}}}).encode("utf-8"))
+    known_md5s = get_known_content_md5s(bucket=BUCKET, object_prefix=f"{PUSH_DATA_PATH}/", s3_client=s3)
+    assert known_md5s[key] == hashlib.md5(b"published").hexdigest()
@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from s3_scripts import MULTIPART_PART_SIZE, upload_chunks_if_changed, upload_stream_to_s3
+
+BUCKET = "ecmwf-test-bucket"
+KEY = "data/day_1.csv"
+# a day file over two parts, serialized in csv sized chunks
+CHUNKS = [os.urandom(1024 * 1024) for _ in range(MULTIPART_PART_SIZE // (1024 * 1024) + 3)]
+CONTENT_MD5 = hashlib.md5(b"".join(CHUNKS)).hexdigest()
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("TEMP_DIR", str(tmp_path))
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+
+
+def counted_chunks(calls=[]):
+    # get_chunks for upload_chunks_if_changed, each call a serialization of the day
+    def get_chunks():
+        calls.append(1)
+        return iter(CHUNKS)
+    return get_chunks
+
+
+def test_changed_content_is_serialized_once(s3):
+    calls = []
+    result = upload_chunks_if_changed(get_chunks=counted_chunks(calls), bucket=BUCKET, key=KEY, s3_client=s3)
+    assert result == {"key": KEY, "md5": CONTENT_MD5, "size": len(b"".join(CHUNKS)), "uploaded": True,
+                      "status": True}
+    assert len(calls) == 1
+    assert hashlib.md5(s3.get_object(Bucket=BUCKET, Key=KEY)["Body"].read()).hexdigest() == CONTENT_MD5
+    assert "-" in s3.head_object(Bucket=BUCKET, Key=KEY)["ETag"]
+
+
+def test_unchanged_content_is_not_uploaded(s3):
+    calls = []
+    result = upload_chunks_if_changed(get_chunks=counted_chunks(calls), bucket=BUCKET, key=KEY, s3_client=s3,
+                                      known_md5s={KEY: CONTENT_MD5})
+    assert (result["uploaded"], result["status"], len(calls)) == (False, True, 1)
+    assert s3.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_multipart_upload_refused_at_the_start_returns_false(s3):
+    assert not upload_stream_to_s3(chunks=CHUNKS, bucket="no-such-bucket", key=KEY, s3_client=s3)